@@ -0,0 +1,258 @@
+"""Movement analytics: rollup queries, ad-hoc range statistics and dashboard charts.
+
+The hourly_movement_stats, daily_movement_stats and dwell_histogram tables
+are kept current by triggers as vehicles enter and leave, so dashboard
+charts read a few hundred pre-aggregated rows. Ranges the rollups do not
+answer are computed from raw movements with vectorized pandas/NumPy.
+
+Usage: python analytics.py [db_file] --rebuild
+"""
+import argparse
+
+import altair as alt
+import numpy as np
+import pandas as pd
+
+import timeutil
+from migrations import DWELL_BUCKET_EDGES, EPOCH_DWELL_SQL, dwell_bucket_sql
+
+HOUR_FORMAT = '%Y-%m-%d %H:00'
+DWELL_BUCKET_LABELS = ('<15m', '15-30m', '30-60m', '1-2h', '2-4h', '4-8h', '8-24h', '24h+')
+# Rollups change with every movement but charts tolerate a short delay
+ROLLUP_TTL = 30
+
+
+def rebuild_rollups(conn, movements='VehicleMovements'):
+    """Recomputes the hourly rollups and dwell histogram from VehicleMovements.
+
+    Occupancy is replayed in time order with window functions, so this is
+    also the fix-up after importing history out of order. `movements` may be
+    any table or subquery with the movement columns; archive.MovementArchive
+    passes one that includes archived partitions.
+    """
+    dwell = EPOCH_DWELL_SQL.format('checkin_time', 'checkout_time')
+    hour = timeutil.local_hour_sql
+    conn.execute("DELETE FROM hourly_movement_stats")
+    conn.execute("DELETE FROM dwell_histogram")
+    conn.execute(f'''
+    WITH events AS (
+        SELECT id, checkin_time AS t, 1 AS delta FROM {movements} WHERE checkin_time IS NOT NULL
+        UNION ALL
+        SELECT id, checkout_time, -1 FROM {movements} WHERE state = 'out' AND checkout_time IS NOT NULL
+    ),
+    sequenced AS (
+        -- (t, delta) ties within a second; the movement id makes the replay order total
+        SELECT {hour('t')} AS hour, delta, ROW_NUMBER() OVER (ORDER BY t, delta, id) AS seq
+        FROM events
+    ),
+    running AS (
+        SELECT hour,
+               delta,
+               SUM(delta) OVER (ORDER BY seq ROWS UNBOUNDED PRECEDING) AS occupancy,
+               ROW_NUMBER() OVER (PARTITION BY hour ORDER BY seq DESC) AS from_end
+        FROM sequenced
+    )
+    INSERT INTO hourly_movement_stats (hour, peak_occupancy, closing_occupancy)
+    SELECT hour, MAX(0, MAX(MAX(occupancy, occupancy - delta))),
+           MAX(0, MAX(CASE WHEN from_end = 1 THEN occupancy END))
+    FROM running WHERE hour IS NOT NULL GROUP BY hour
+    ''')
+    conn.execute(f'''
+    INSERT INTO hourly_movement_stats (hour, entries, male_entries, female_entries, passenger_entries)
+    SELECT {hour('checkin_time')}, COUNT(*), SUM(owner_gender IS 'Male'),
+           SUM(owner_gender IS 'Female'), SUM(passengers IS 'Y')
+    FROM {movements} WHERE checkin_time IS NOT NULL GROUP BY 1
+    ON CONFLICT (hour) DO UPDATE SET
+        entries = excluded.entries, male_entries = excluded.male_entries,
+        female_entries = excluded.female_entries, passenger_entries = excluded.passenger_entries
+    ''')
+    conn.execute(f'''
+    INSERT INTO hourly_movement_stats (hour, exits, dwell_seconds)
+    SELECT {hour('checkout_time')}, COUNT(*), SUM({dwell})
+    FROM {movements} WHERE state = 'out' AND checkout_time IS NOT NULL GROUP BY 1
+    ON CONFLICT (hour) DO UPDATE SET exits = excluded.exits, dwell_seconds = excluded.dwell_seconds
+    ''')
+    conn.execute(f'''
+    INSERT INTO dwell_histogram (day, bucket, exits)
+    SELECT {timeutil.local_date_sql('checkout_time')}, {dwell_bucket_sql(dwell)}, COUNT(*)
+    FROM {movements} WHERE state = 'out' AND checkout_time IS NOT NULL GROUP BY 1, 2
+    ''')
+
+
+class Analytics:
+    """Read side of the rollups for the dashboard.
+
+    Rollups are keyed by local day and hour, so ranges are given as local
+    'YYYY-MM-DD HH:MM:SS' strings (or days as 'YYYY-MM-DD'). With an
+    archive.MovementArchive, range statistics include archived movements.
+    """
+
+    def __init__(self, database, archive=None):
+        self.db = database
+        self.archive = archive
+
+    def hourly(self, start, end):
+        """One row per hour in [start, end), quiet hours included with occupancy carried forward."""
+        first, last = pd.Timestamp(start).floor('h'), pd.Timestamp(end).ceil('h')
+        frame = self.db.fetch_dataframe(
+            "SELECT * FROM hourly_movement_stats WHERE hour >= ? AND hour < ? ORDER BY hour",
+            (first.strftime(HOUR_FORMAT), last.strftime(HOUR_FORMAT)), ttl=ROLLUP_TTL
+        )
+        # Occupancy going into the range comes from the last active hour before it
+        before = self.db.fetch_all(
+            "SELECT closing_occupancy FROM hourly_movement_stats WHERE hour < ? ORDER BY hour DESC LIMIT 1",
+            (first.strftime(HOUR_FORMAT),), ttl=ROLLUP_TTL
+        )
+        hours = pd.date_range(first, last, freq='h', inclusive='left')
+        frame.index = pd.to_datetime(frame['hour'], format=HOUR_FORMAT) if not frame.empty else pd.DatetimeIndex([])
+        frame = frame.drop(columns='hour').reindex(hours)
+        opening = before[0][0] if before else 0
+        closing = frame['closing_occupancy'].ffill().fillna(opening).astype('int64')
+        frame = frame.fillna(0).astype('int64')
+        frame['closing_occupancy'] = closing
+        # A quiet hour's peak is the occupancy carried into it
+        frame['peak_occupancy'] = np.maximum(frame['peak_occupancy'], closing.shift(fill_value=opening))
+        frame.index.name = 'hour'
+        return frame.reset_index()
+
+    def daily(self, start_day, end_day):
+        """Per-day totals in [start_day, end_day] rolled up from the hourly table."""
+        return self.db.fetch_dataframe(
+            """SELECT substr(hour, 1, 10) AS day, SUM(entries) AS entries, SUM(exits) AS exits,
+                      SUM(dwell_seconds) AS dwell_seconds, SUM(male_entries) AS male_entries,
+                      SUM(female_entries) AS female_entries, SUM(passenger_entries) AS passenger_entries,
+                      MAX(peak_occupancy) AS peak_occupancy
+               FROM hourly_movement_stats
+               WHERE hour >= ? AND hour < date(?, '+1 day')
+               GROUP BY 1 ORDER BY 1""",
+            (start_day, end_day), ttl=ROLLUP_TTL
+        )
+
+    def dwell_histogram(self, start_day, end_day):
+        """Exits per dwell bucket for checkouts on days in [start_day, end_day]."""
+        frame = self.db.fetch_dataframe(
+            "SELECT bucket, SUM(exits) AS exits FROM dwell_histogram WHERE day BETWEEN ? AND ? GROUP BY bucket",
+            (start_day, end_day), ttl=ROLLUP_TTL
+        )
+        counts = np.zeros(len(DWELL_BUCKET_LABELS), dtype=np.int64)
+        counts[frame['bucket'].to_numpy(dtype=np.int64)] = frame['exits'].to_numpy(dtype=np.int64)
+        return pd.DataFrame({'bucket': DWELL_BUCKET_LABELS, 'exits': counts})
+
+    def range_summary(self, start, end):
+        """Statistics for an arbitrary [start, end) computed from raw movements.
+
+        `start` and `end` are anything timeutil.to_epoch accepts. Returns a dict
+        with entries, exits, average_dwell_minutes, peak_occupancy, the dwell
+        histogram and the occupancy curve (one point per movement). The range
+        filter is an index range scan and the rest is NumPy over epoch seconds.
+        """
+        lo, hi = timeutil.to_epoch(start), timeutil.to_epoch(end)
+        frame = self.db.fetch_dataframe(
+            """SELECT checkin_time, checkout_time, owner_gender, passengers FROM VehicleMovements
+               WHERE checkin_time < ? AND (state = 'in' OR checkout_time >= ?)""",
+            (hi, lo)
+        )
+        if self.archive is not None:
+            archived = self.archive.archived_overlapping(lo, hi, list(frame.columns))
+            if not archived.empty:
+                frame = pd.concat([frame, archived], ignore_index=True)
+        # NaN marks a missing time; it compares False with everything
+        checkin = frame['checkin_time'].to_numpy(dtype=np.float64)
+        checkout = frame['checkout_time'].to_numpy(dtype=np.float64)
+
+        entered = (checkin >= lo) & (checkin < hi)
+        left = (checkout >= lo) & (checkout < hi)
+        dwell = checkout[left] - checkin[left]
+        dwell = np.clip(dwell[~np.isnan(dwell)], 0, None)
+        histogram = np.bincount(np.searchsorted(DWELL_BUCKET_EDGES, dwell, side='right'),
+                                minlength=len(DWELL_BUCKET_LABELS))
+
+        # Occupancy: sessions open at `start`, then +1/-1 per movement in time order
+        open_at_start = int(np.sum((checkin < lo) & ~(checkout < lo)))
+        times = np.concatenate([checkin[entered], checkout[left]])
+        deltas = np.concatenate([np.ones(entered.sum(), dtype=np.int64), -np.ones(left.sum(), dtype=np.int64)])
+        order = np.lexsort((deltas, times))
+        occupancy = open_at_start + np.cumsum(deltas[order])
+        curve = timeutil.localize_columns(pd.DataFrame({'time': times[order], 'occupancy': occupancy}), 'time')
+
+        gender = frame.loc[entered, 'owner_gender'].fillna('Unknown').value_counts()
+        passengers = frame.loc[entered, 'passengers'].fillna('Unknown').value_counts()
+        return {
+            'entries': int(entered.sum()),
+            'exits': int(left.sum()),
+            'average_dwell_minutes': float(dwell.mean() / 60) if dwell.size else 0.0,
+            'peak_occupancy': int(max(occupancy.max(initial=0), open_at_start)),
+            'dwell_histogram': pd.DataFrame({'bucket': DWELL_BUCKET_LABELS, 'exits': histogram}),
+            'occupancy': curve,
+            'gender': gender.rename_axis('owner_gender').reset_index(name='entries'),
+            'passengers': passengers.rename_axis('passengers').reset_index(name='entries'),
+        }
+
+
+def movements_chart(frame, time_column):
+    """Entries and exits per period as grouped bars."""
+    data = frame.melt(id_vars=[time_column], value_vars=['entries', 'exits'], var_name='movement', value_name='vehicles')
+    return alt.Chart(data).mark_bar().encode(
+        x=alt.X(f'{time_column}:T', title=None),
+        y=alt.Y('vehicles:Q', title='Vehicles'),
+        color=alt.Color('movement:N', title=None),
+        xOffset='movement:N',
+        tooltip=[f'{time_column}:T', 'movement:N', 'vehicles:Q'],
+    )
+
+
+def occupancy_chart(frame, time_column, value_column='peak_occupancy'):
+    return alt.Chart(frame).mark_line(interpolate='step-after').encode(
+        x=alt.X(f'{time_column}:T', title=None),
+        y=alt.Y(f'{value_column}:Q', title='Vehicles parked'),
+        tooltip=[f'{time_column}:T', f'{value_column}:Q'],
+    )
+
+
+def dwell_chart(frame):
+    return alt.Chart(frame).mark_bar().encode(
+        x=alt.X('bucket:N', sort=list(DWELL_BUCKET_LABELS), title='Length of stay'),
+        y=alt.Y('exits:Q', title='Vehicles'),
+        tooltip=['bucket:N', 'exits:Q'],
+    )
+
+
+def breakdown_chart(frame, time_column):
+    """Entries split by driver gender, with passenger-carrying entries as a line."""
+    data = frame.rename(columns={'male_entries': 'Male', 'female_entries': 'Female'}).melt(
+        id_vars=[time_column], value_vars=['Male', 'Female'], var_name='gender', value_name='vehicles'
+    )
+    bars = alt.Chart(data).mark_bar().encode(
+        x=alt.X(f'{time_column}:T', title=None),
+        y=alt.Y('vehicles:Q', stack=True, title='Entries'),
+        color=alt.Color('gender:N', title=None),
+        tooltip=[f'{time_column}:T', 'gender:N', 'vehicles:Q'],
+    )
+    line = alt.Chart(frame).mark_line(color='black').encode(
+        x=f'{time_column}:T',
+        y='passenger_entries:Q',
+        tooltip=[f'{time_column}:T', alt.Tooltip('passenger_entries:Q', title='with passengers')],
+    )
+    return bars + line
+
+
+def main():
+    from connection import get_pool
+    import migrations
+
+    parser = argparse.ArgumentParser(description="Maintain the movement analytics rollups.")
+    parser.add_argument('db_file', nargs='?', default='car_park_management.db')
+    parser.add_argument('--rebuild', action='store_true', help="recompute all rollups from live and archived movements")
+    args = parser.parse_args()
+
+    pool = get_pool(args.db_file)
+    migrations.bootstrap(pool)
+    if args.rebuild:
+        from archive import MovementArchive
+
+        MovementArchive(pool).rebuild_rollups()
+        print("Rollups rebuilt.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""Cold storage for closed vehicle movements.
+
+Closed movements that left more than ARCHIVE_AFTER_DAYS ago are moved out of
+the hot VehicleMovements table into one partition per local month of
+check-in, listed in the movement_archive catalog. A partition is kept as
+
+- 'table': a movements_YYYY_MM table in the main database
+- 'sqlite': a movements_YYYY_MM.db file in the archive directory
+- 'parquet': a zstd-compressed movements_YYYY_MM.parquet file (needs pyarrow)
+
+and stays in the storage it was created with. history() answers lookups
+over the hot table plus only the partitions whose check-in range overlaps
+the requested one. Rollups and movement_stats are left as they are, so the
+dashboard keeps counting archived history.
+
+Usage: python archive.py [db_file] [--days N] [--storage table|sqlite|parquet] [--list] [--rebuild-rollups]
+"""
+import argparse
+import os
+import sqlite3
+
+import pandas as pd
+
+import timeutil
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+ARCHIVE_AFTER_DAYS = 90
+# Movements moved per transaction, so check-ins are never held up for long
+ARCHIVE_BATCH = 5000
+STORAGES = ('table', 'sqlite', 'parquet')
+COLUMNS = ('id', 'license_plate', 'owner_gender', 'checked_in', 'checked_out', 'passengers', 'state',
+           'slot_number', 'checkin_time', 'checkout_time', 'image_sha256')
+PARTITION_SCHEMA = '''(
+    id INTEGER PRIMARY KEY,
+    license_plate TEXT,
+    owner_gender TEXT,
+    checked_in BOOLEAN,
+    checked_out BOOLEAN,
+    passengers TEXT,
+    state TEXT,
+    slot_number INTEGER,
+    checkin_time INTEGER,
+    checkout_time INTEGER,
+    image_sha256 TEXT
+)'''
+# Table name inside each archived SQLite file
+FILE_TABLE = 'movements'
+
+
+def movement_filter(plate_prefix=None, checkin_from=None, checkin_to=None, checkout_from=None):
+    """WHERE clause and parameters shared by the hot table and every partition."""
+    where, params = [], []
+    prefix = (plate_prefix or '').strip().upper()
+    if prefix:
+        where.append("upper(license_plate) >= ? AND upper(license_plate) < ?")
+        params.extend([prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)])
+    if checkin_from is not None:
+        where.append("checkin_time >= ?")
+        params.append(checkin_from)
+    if checkin_to is not None:
+        where.append("checkin_time < ?")
+        params.append(checkin_to)
+    if checkout_from is not None:
+        where.append("(state = 'in' OR checkout_time >= ?)")
+        params.append(checkout_from)
+    return ' AND '.join(where) or '1', params
+
+
+def sql_rows(frame):
+    """Rows of a partition frame as plain Python values SQLite can bind."""
+    frame = frame.reindex(columns=list(COLUMNS)).astype(object)
+    return list(frame.where(frame.notna(), None).itertuples(index=False, name=None))
+
+
+class MovementArchive:
+    """Moves old closed movements into monthly partitions and reads them back.
+
+    `storage` only applies to months that have no partition yet. File
+    partitions live in `directory`, by default '<db name>_archive' beside the
+    database, and are read through their own read-only connections rather
+    than ATTACH, which is limited to ten databases and not allowed inside the
+    pool's transactions.
+    """
+
+    def __init__(self, pool, storage='table', directory=None):
+        if storage not in STORAGES:
+            raise ValueError(f"Unknown archive storage {storage!r}")
+        if storage == 'parquet' and pq is None:
+            raise ValueError("Parquet archives need pyarrow installed")
+        if storage != 'table' and pool.in_memory:
+            raise ValueError("An in-memory database can only archive to tables")
+        self.pool = pool
+        self.storage = storage
+        self.base = '' if pool.in_memory else os.path.dirname(os.path.abspath(pool.db_file))
+        if directory is None:
+            directory = os.path.splitext(os.path.basename(pool.db_file))[0] + '_archive'
+        self.directory = directory
+
+    def archive(self, days=ARCHIVE_AFTER_DAYS, now=None):
+        """Moves movements closed more than `days` ago into their partitions; returns how many moved.
+
+        Callers using a query cache invalidate VehicleMovements afterwards.
+        """
+        cutoff = (timeutil.now() if now is None else now) - days * 86400
+        month = timeutil.local_month_sql('COALESCE(checkin_time, checkout_time)')
+        moved = 0
+        while True:
+            with self.pool.reader() as conn:
+                rows = conn.execute(
+                    f"""SELECT {month}, {', '.join(COLUMNS)} FROM VehicleMovements
+                        WHERE state = 'out' AND checkout_time < ?
+                        ORDER BY checkout_time LIMIT ?""",
+                    (cutoff, ARCHIVE_BATCH)
+                ).fetchall()
+            by_month = {}
+            for row in rows:
+                by_month.setdefault(row[0], []).append(row[1:])
+            for key, month_rows in sorted(by_month.items()):
+                self._archive_month(key, month_rows)
+                moved += len(month_rows)
+            if len(rows) < ARCHIVE_BATCH:
+                return moved
+
+    def _archive_month(self, month, rows):
+        with self.pool.reader() as conn:
+            found = conn.execute("SELECT storage, location FROM movement_archive WHERE month = ?", (month,)).fetchone()
+        storage, location = found or self._new_partition(month)
+
+        # File partitions are written first; a crash before the delete below
+        # only means the rows are copied again next time, replacing themselves.
+        if storage == 'sqlite':
+            kept = self._write_sqlite(self._path(location), rows)
+        elif storage == 'parquet':
+            kept = self._write_parquet(self._path(location), rows)
+
+        with self.pool.transaction() as conn:
+            if storage == 'table':
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {location} {PARTITION_SCHEMA}")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{location}_plate "
+                             f"ON {location} (upper(license_plate), checkin_time)")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{location}_checkin ON {location} (checkin_time)")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {location} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows
+                )
+                kept = conn.execute(f"SELECT COUNT(*) FROM {location}").fetchone()[0]
+            conn.executemany("DELETE FROM VehicleMovements WHERE id = ? AND state = 'out'", [(row[0],) for row in rows])
+            checkin, checkout = COLUMNS.index('checkin_time'), COLUMNS.index('checkout_time')
+            checkins = [row[checkin] if row[checkin] is not None else row[checkout] for row in rows]
+            conn.execute(
+                """INSERT INTO movement_archive
+                       (month, storage, location, row_count, first_checkin, last_checkin, last_checkout, archived_on)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (month) DO UPDATE SET
+                       row_count = excluded.row_count,
+                       first_checkin = MIN(first_checkin, excluded.first_checkin),
+                       last_checkin = MAX(last_checkin, excluded.last_checkin),
+                       last_checkout = MAX(last_checkout, excluded.last_checkout),
+                       archived_on = excluded.archived_on""",
+                (month, storage, location, kept, min(checkins), max(checkins),
+                 max(row[checkout] for row in rows), timeutil.now())
+            )
+
+    def _new_partition(self, month):
+        name = 'movements_' + month.replace('-', '_')
+        if self.storage == 'table':
+            return 'table', name
+        suffix = '.db' if self.storage == 'sqlite' else '.parquet'
+        return self.storage, os.path.join(self.directory, name + suffix)
+
+    def _path(self, location):
+        return os.path.join(self.base, location)
+
+    def _write_sqlite(self, path, rows):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path)
+        try:
+            with conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {FILE_TABLE} {PARTITION_SCHEMA}")
+                # Files written before a column was added to COLUMNS gain it here
+                present = {row[1] for row in conn.execute(f"PRAGMA table_info({FILE_TABLE})")}
+                for column in COLUMNS:
+                    if column not in present:
+                        conn.execute(f"ALTER TABLE {FILE_TABLE} ADD COLUMN {column}")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FILE_TABLE}_plate "
+                             f"ON {FILE_TABLE} (upper(license_plate), checkin_time)")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{FILE_TABLE}_checkin ON {FILE_TABLE} (checkin_time)")
+                conn.executemany(
+                    f"INSERT OR REPLACE INTO {FILE_TABLE} ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows
+                )
+            return conn.execute(f"SELECT COUNT(*) FROM {FILE_TABLE}").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _write_parquet(self, path, rows):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        frame = pd.DataFrame(rows, columns=COLUMNS)
+        if os.path.exists(path):
+            frame = pd.concat([pd.read_parquet(path), frame], ignore_index=True)
+            frame = frame.drop_duplicates('id', keep='last')
+        # Sorted by check-in so row group statistics prune date filters
+        frame = frame.sort_values(['checkin_time', 'id'])
+        frame['slot_number'] = frame['slot_number'].astype('Int64')
+        temporary = path + '.tmp'
+        frame.to_parquet(temporary, compression='zstd', index=False)
+        os.replace(temporary, path)
+        return len(frame)
+
+    def partitions(self, checkin_to=None, checkout_from=None, checkin_from=None):
+        """Catalog rows (month, storage, location, row_count) that can hold matching movements, newest first."""
+        with self.pool.reader() as conn:
+            return conn.execute(
+                """SELECT month, storage, location, row_count FROM movement_archive
+                   WHERE (?1 IS NULL OR first_checkin < ?1)
+                     AND (?2 IS NULL OR last_checkout >= ?2)
+                     AND (?3 IS NULL OR last_checkin >= ?3)
+                   ORDER BY month DESC""",
+                (checkin_to, checkout_from, checkin_from)
+            ).fetchall()
+
+    def _read_file(self, storage, location, plate_prefix=None, checkin_from=None, checkin_to=None,
+                   checkout_from=None, limit=None):
+        path = self._path(location)
+        if storage == 'sqlite':
+            where, params = movement_filter(plate_prefix, checkin_from, checkin_to, checkout_from)
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                frame = pd.read_sql_query(
+                    f"""SELECT * FROM {FILE_TABLE} WHERE {where}
+                        ORDER BY checkin_time DESC, id DESC LIMIT ?""",
+                    conn, params=params + [-1 if limit is None else limit]
+                )
+            finally:
+                conn.close()
+            return frame.reindex(columns=list(COLUMNS))
+
+        filters = []
+        if checkin_from is not None:
+            filters.append(('checkin_time', '>=', checkin_from))
+        if checkin_to is not None:
+            filters.append(('checkin_time', '<', checkin_to))
+        if checkout_from is not None:
+            filters.append(('checkout_time', '>=', checkout_from))
+        frame = pq.read_table(path, filters=filters or None).to_pandas().reindex(columns=list(COLUMNS))
+        prefix = (plate_prefix or '').strip().upper()
+        if prefix:
+            frame = frame[frame['license_plate'].str.upper().str.startswith(prefix, na=False)]
+        frame = frame.sort_values(['checkin_time', 'id'], ascending=False)
+        return frame if limit is None else frame.head(limit)
+
+    def history(self, plate_prefix=None, start=None, end=None, limit=500):
+        """Movements checked in within [start, end), live and archived, newest first.
+
+        `start` and `end` are anything timeutil.to_epoch accepts, or None for
+        no bound. The archive_month column names the partition a row came
+        from (None for the hot table). Only partitions whose check-in range
+        overlaps the requested one are read.
+        """
+        start, end = timeutil.to_epoch(start), timeutil.to_epoch(end)
+        where, params = movement_filter(plate_prefix, start, end)
+        partitions = self.partitions(checkin_to=end, checkin_from=start)
+
+        # The hot table and in-database partitions answer as one UNION ALL,
+        # each branch already trimmed to `limit` rows
+        branches = [(None, 'VehicleMovements')] + [
+            (month, location) for month, storage, location, _ in partitions if storage == 'table'
+        ]
+        query = ' UNION ALL '.join(
+            f"""SELECT * FROM (SELECT {', '.join(COLUMNS)}, ? AS archive_month FROM {table} WHERE {where}
+                              ORDER BY checkin_time DESC, id DESC LIMIT ?)"""
+            for _, table in branches
+        )
+        query_params = []
+        for month, _ in branches:
+            query_params += [month] + params + [limit]
+        with self.pool.reader() as conn:
+            frames = [pd.read_sql_query(
+                f"{query} ORDER BY checkin_time DESC, id DESC LIMIT ?", conn, params=query_params + [limit]
+            )]
+
+        for month, storage, location, _ in partitions:
+            if storage != 'table':
+                frame = self._read_file(storage, location, plate_prefix, start, end, limit=limit)
+                frames.append(frame.assign(archive_month=month))
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            return pd.DataFrame(columns=list(COLUMNS) + ['archive_month'])
+        history = pd.concat(frames, ignore_index=True)
+        return history.sort_values(['checkin_time', 'id'], ascending=False).head(limit).reset_index(drop=True)
+
+    def archived_overlapping(self, start, end, columns=COLUMNS):
+        """Archived movements that were parked at some point in [start, end) epoch seconds."""
+        frames = []
+        for _, storage, location, _ in self.partitions(checkin_to=end, checkout_from=start):
+            if storage == 'table':
+                where, params = movement_filter(checkin_to=end, checkout_from=start)
+                with self.pool.reader() as conn:
+                    frames.append(pd.read_sql_query(
+                        f"SELECT {', '.join(columns)} FROM {location} WHERE {where}", conn, params=params
+                    ))
+            else:
+                frames.append(self._read_file(storage, location, checkin_to=end, checkout_from=start)[list(columns)])
+        frames = [frame for frame in frames if not frame.empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(columns))
+
+    def rebuild_rollups(self):
+        """analytics.rebuild_rollups over the hot table and every partition."""
+        import analytics
+
+        columns = ', '.join(COLUMNS)
+        with self.pool.transaction() as conn:
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS archived_movements {PARTITION_SCHEMA}")
+            conn.execute("DELETE FROM temp.archived_movements")
+            sources = [f"SELECT {columns} FROM VehicleMovements", f"SELECT {columns} FROM temp.archived_movements"]
+            for _, storage, location, _ in self.partitions():
+                if storage == 'table':
+                    sources.append(f"SELECT {columns} FROM {location}")
+                else:
+                    conn.executemany(
+                        f"INSERT OR REPLACE INTO temp.archived_movements VALUES ({', '.join('?' * len(COLUMNS))})",
+                        sql_rows(self._read_file(storage, location))
+                    )
+            analytics.rebuild_rollups(conn, f"({' UNION ALL '.join(sources)})")
+            conn.execute("DROP TABLE temp.archived_movements")
+
+
+def main():
+    from connection import get_pool
+    import migrations
+
+    parser = argparse.ArgumentParser(description="Archive old closed vehicle movements.")
+    parser.add_argument('db_file', nargs='?', default='car_park_management.db')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="archive movements that left more than this many days ago")
+    parser.add_argument('--storage', choices=STORAGES, default='table', help="storage for new monthly partitions")
+    parser.add_argument('--list', action='store_true', help="only list the archived partitions")
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help="recompute the analytics rollups from live and archived movements")
+    args = parser.parse_args()
+
+    pool = get_pool(args.db_file)
+    migrations.bootstrap(pool)
+    archive = MovementArchive(pool, args.storage)
+    if not args.list:
+        print(f"Archived {archive.archive(args.days)} movements.")
+    if args.rebuild_rollups:
+        archive.rebuild_rollups()
+        print("Rollups rebuilt.")
+    for month, storage, location, row_count in archive.partitions():
+        print(f"{month}  {storage:<8} {row_count:>9}  {location}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Check-in/check-out throughput: legacy multi-commit flow vs single transactions.
+
+The legacy flow mirrors the original VehicleManagement code:
+SELECT-then-INSERT and SELECT-then-UPDATE with a commit after every
+statement. The current flow calls
+VehicleManagement.insert_vehicle_and_checkin/update_vehicle_checkout.
+
+Both run against a Database schema through its ConnectionPool, so they
+share its pragmas, indexes and triggers, and only the transaction
+structure differs. Commits are counted from the pool's statement metrics.
+Check-in and check-out are one commit each, so a round trip takes two.
+
+Under the pool's default synchronous=NORMAL a WAL commit does not fsync,
+so the saved commit is cheap and the two flows run at about the same
+speed; the current flow also pays for slot allocation and the in-memory
+indexes. --synchronous FULL fsyncs every commit, which is where the saved
+commit shows.
+
+Usage: python benchmarks/checkin_commits.py [--vehicles N] [--synchronous NORMAL|FULL]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connection
+from carpark import Database, VehicleManagement
+import timeutil
+
+
+def legacy_round_trip(pool, plate):
+    """One check-in and check-out the way the code did before single-transaction writes."""
+    def execute(query, params):
+        with pool.transaction() as conn:
+            conn.execute(query, params)
+
+    def select(query, params):
+        with pool.reader() as conn:
+            return conn.execute(query, params).fetchall()
+
+    if not select("SELECT * FROM Vehicles WHERE license_plate = ?", (plate,)):
+        execute("INSERT INTO Vehicles (license_plate, vehicle_type) VALUES (?, ?)", (plate, 'Toyota Corolla'))
+    if not select(
+        "SELECT * FROM VehicleMovements WHERE license_plate = ? AND checked_in = TRUE AND checked_out = FALSE", (plate,)
+    ):
+        execute(
+            "INSERT INTO VehicleMovements (license_plate, owner_gender, checked_in, state, checkin_time, passengers) "
+            "VALUES (?, 'Male', TRUE, 'in', ?, 'N')", (plate, timeutil.now())
+        )
+    if select(
+        "SELECT checked_in FROM VehicleMovements WHERE license_plate=? AND checked_in=? AND checked_out=?", (plate, True, False)
+    ):
+        execute(
+            "UPDATE VehicleMovements SET checked_out = ?, checked_in = ?, state = 'out', checkout_time = ? "
+            "WHERE license_plate=? AND checked_in=? AND checked_out=?", (True, False, timeutil.now(), plate, True, False)
+        )
+
+
+def commits(pool):
+    histogram = pool.metrics.statements.get('COMMIT')
+    return histogram.count if histogram else 0
+
+
+def bench_legacy(path, vehicles):
+    """Returns (seconds, commits) for `vehicles` legacy round trips."""
+    db = Database(path)
+    before = commits(db.pool)
+    started = time.perf_counter()
+    for i in range(vehicles):
+        legacy_round_trip(db.pool, f"LEG{i:06d}")
+    elapsed = time.perf_counter() - started
+    counted = commits(db.pool) - before
+    db.close_connection()
+    return elapsed, counted
+
+
+def bench_current(path, vehicles):
+    """Returns (seconds, commits) for `vehicles` check-in/check-out round trips."""
+    db = Database(path)
+    vehicle_mgmt = VehicleManagement(db)
+    before = commits(db.pool)
+    started = time.perf_counter()
+    for i in range(vehicles):
+        plate = f"CUR{i:06d}"
+        vehicle_mgmt.insert_vehicle_and_checkin(plate, 'Toyota Corolla', 'Male', 'N', None)
+        vehicle_mgmt.update_vehicle_checkout(plate)
+    elapsed = time.perf_counter() - started
+    counted = commits(db.pool) - before
+    db.close_connection()
+    return elapsed, counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vehicles', type=int, default=500)
+    parser.add_argument('--synchronous', choices=('NORMAL', 'FULL'), default=connection.PRAGMAS['synchronous'])
+    args = parser.parse_args()
+    connection.PRAGMAS['synchronous'] = args.synchronous
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy, legacy_commits = bench_legacy(os.path.join(tmp, 'legacy.db'), args.vehicles)
+        current, current_commits = bench_current(os.path.join(tmp, 'current.db'), args.vehicles)
+
+    report = {
+        'vehicles': args.vehicles,
+        'synchronous': args.synchronous,
+        'legacy': {
+            'seconds': round(legacy, 3), 'round_trips_per_sec': round(args.vehicles / legacy, 1),
+            'commits_per_round_trip': round(legacy_commits / args.vehicles, 2),
+        },
+        'current': {
+            'seconds': round(current, 3), 'round_trips_per_sec': round(args.vehicles / current, 1),
+            'commits_per_round_trip': round(current_commits / args.vehicles, 2),
+        },
+        'speedup': round(legacy / current, 2),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
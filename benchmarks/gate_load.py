@@ -0,0 +1,145 @@
+"""Sustained load against the gate event service.
+
+Keeps --connections keep-alive HTTP connections busy posting --batch events
+per request for --duration seconds. Each connection owns its own plates and
+alternates their entries and exits, so every event is applicable. Without
+--url a service is started in-process on a temporary database.
+
+Reports accepted (durably queued) and applied events per second as JSON.
+
+Usage: python benchmarks/gate_load.py [--url HOST:PORT] [--connections N] [--batch N] [--duration S] [--plates N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gateway import GateService
+
+
+async def request(reader, writer, method, path, body=b''):
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: gate\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+    )
+    await writer.drain()
+    status = (await reader.readline()).decode('latin-1').split(' ', 2)[1]
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    payload = json.loads(await reader.readexactly(length)) if length else None
+    return status, payload
+
+
+async def gate(host, port, number, args, deadline, totals):
+    """One gate device: posts batches of entries and exits for its own plates until the deadline."""
+    reader, writer = await asyncio.open_connection(host, port)
+    plates = [f"G{number:02d}{i:05d}" for i in range(args.plates)]
+    inside = set()
+    cursor = 0
+    try:
+        while time.monotonic() < deadline:
+            events = []
+            for _ in range(args.batch):
+                plate = plates[cursor % len(plates)]
+                cursor += 1
+                kind = 'out' if plate in inside else 'in'
+                inside.symmetric_difference_update({plate})
+                events.append({'event': kind, 'license_plate': plate, 'owner_gender': 'Male', 'passengers': 'N'})
+            started = time.perf_counter()
+            status, payload = await request(reader, writer, 'POST', '/events', json.dumps(events).encode())
+            totals['latencies'].append(time.perf_counter() - started)
+            if status == '202':
+                totals['accepted'] += payload['queued']
+            else:
+                totals['errors'] += 1
+    finally:
+        writer.close()
+
+
+async def run(host, port, args):
+    reader, writer = await asyncio.open_connection(host, port)
+    _, before = await request(reader, writer, 'GET', '/stats')
+    totals = {'accepted': 0, 'errors': 0, 'latencies': []}
+    started = time.monotonic()
+    await asyncio.gather(*(
+        gate(host, port, number, args, started + args.duration, totals) for number in range(args.connections)
+    ))
+    sent_seconds = time.monotonic() - started
+    # Give the consumer time to drain what was accepted
+    while True:
+        _, after = await request(reader, writer, 'GET', '/stats')
+        if after['queue_depth'] == 0 or time.monotonic() - started > args.duration * 3:
+            break
+        await asyncio.sleep(0.2)
+    applied_seconds = time.monotonic() - started
+    writer.close()
+
+    latencies = sorted(totals['latencies']) or [0.0]
+    applied = after['applied'] - before['applied']
+    commits = after['commits'] - before['commits']
+    return {
+        'connections': args.connections,
+        'events_per_request': args.batch,
+        'accepted_events': totals['accepted'],
+        'accepted_per_sec': round(totals['accepted'] / sent_seconds, 1),
+        'applied_events': applied,
+        'applied_per_sec': round(applied / applied_seconds, 1),
+        'queue_commits': commits,
+        'events_per_queue_commit': round((after['queued'] - before['queued']) / commits, 1) if commits else 0,
+        'request_p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+        'request_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 2),
+        'errors': totals['errors'],
+        'outcomes': after['outcomes'],
+    }
+
+
+def start_local_service(db_file):
+    """Runs a GateService on an ephemeral port in a background thread; returns (host, port)."""
+    from carpark import Database, VehicleManagement
+
+    service = GateService(VehicleManagement(Database(db_file)))
+    ready = threading.Event()
+    address = []
+
+    def on_ready(sockname):
+        address.extend(sockname[:2])
+        ready.set()
+
+    threading.Thread(target=asyncio.run, args=(service.serve('127.0.0.1', 0, on_ready),), daemon=True).start()
+    ready.wait(30)
+    return address[0], address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help="HOST:PORT of a running gateway.py; default starts one locally")
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--batch', type=int, default=20, help="events per request")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds to send for")
+    parser.add_argument('--plates', type=int, default=500, help="plates per connection")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.url:
+            host, _, port = args.url.rpartition(':')
+            port = int(port)
+        else:
+            host, port = start_local_service(os.path.join(tmp, 'gate.db'))
+        report = asyncio.run(run(host, port, args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,228 @@
+"""Data layer benchmark suite.
+
+For each dataset size, a synthetic database (see synthetic.py) is generated
+once into benchmarks/data/, copied to a scratch directory and timed on:
+
+- cold_start: Database + VehicleManagement construction (migrations check,
+  occupancy, reservation and slot indexes)
+- checkin / checkout: insert_vehicle_and_checkin and update_vehicle_checkout
+- search: ranked plate and model search
+- metrics: the dashboard figures (get_metrics)
+- dashboard: everything the dashboard reads, charts data included
+- availability: get_available_slots for upcoming windows
+- history: plate history across live and archived movements
+- range_summary: ad-hoc statistics over the last 30 days
+
+The query cache is cleared before every read so each timing is a real
+query. Results go to a JSON report; with --baseline, median times are
+compared against an earlier report and the run fails on regressions.
+
+Usage: python benchmarks/run.py [--sizes 10k,1m,10m] [--output FILE] [--baseline FILE] [--threshold 1.25]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS))
+
+import analytics
+import timeutil
+from carpark import Database, VehicleManagement
+from synthetic import generate, parse_size
+
+DATA_DIR = os.path.join(BENCHMARKS, 'data')
+RESULTS_DIR = os.path.join(BENCHMARKS, 'results')
+# Timed repetitions per operation
+REPEATS = {
+    'checkin': 200, 'checkout': 200, 'search': 100, 'metrics': 50, 'dashboard': 20,
+    'availability': 100, 'history': 20, 'range_summary': 5,
+}
+
+
+def summarize(seconds):
+    """Latency statistics in milliseconds for a list of timings."""
+    ms = np.array(seconds) * 1000
+    return {
+        'n': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'max_ms': round(float(ms.max()), 3),
+        'ops_per_sec': round(float(1000 / ms.mean()), 1) if ms.mean() else None,
+    }
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def dataset(label, seed):
+    """Path of the cached synthetic database for a size, generating it on first use."""
+    path = os.path.join(DATA_DIR, f"synthetic-{label}-seed{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        print(f"Generating {label} dataset...", file=sys.stderr)
+        partial = path + '.partial'
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(partial + suffix):
+                os.remove(partial + suffix)
+        generate(partial, parse_size(label), seed)
+        os.replace(partial, path)
+    return path
+
+
+def bench_size(path, seed):
+    rng = random.Random(seed)
+    operations = {}
+    started = time.perf_counter()
+    db = Database(path)
+    vm = VehicleManagement(db)
+    operations['cold_start'] = summarize([time.perf_counter() - started])
+    reports = analytics.Analytics(db, vm.archive)
+
+    def read(func, *args):
+        db.cache.clear()
+        return timed(func, *args)
+
+    with db.pool.reader() as conn:
+        plates = [row[0] for row in conn.execute("SELECT license_plate FROM Vehicles ORDER BY random() LIMIT 500")]
+        models = [row[0] for row in conn.execute("SELECT model FROM car_models")]
+
+    checkins, checkouts = [], []
+    for i in range(REPEATS['checkin']):
+        plate = f"BENCH {i:04d}"
+        checkins.append(timed(vm.insert_vehicle_and_checkin, plate, 'Toyota Corolla', 'Male', 'N', None))
+        checkouts.append(timed(vm.update_vehicle_checkout, plate))
+    operations['checkin'] = summarize(checkins)
+    operations['checkout'] = summarize(checkouts)
+
+    queries = [rng.choice(plates)[:rng.randint(3, 6)] if i % 4 else rng.choice(models) for i in range(REPEATS['search'])]
+    operations['search'] = summarize([read(vm.search, query) for query in queries])
+    operations['metrics'] = summarize([read(vm.get_metrics) for _ in range(REPEATS['metrics'])])
+
+    now = timeutil.now()
+
+    def dashboard():
+        vm.get_metrics()
+        reports.hourly(timeutil.format_local(now - 86400), timeutil.format_local(now))
+        reports.daily(timeutil.local_day(now - 30 * 86400), timeutil.local_day(now))
+        reports.dwell_histogram(timeutil.local_day(now - 30 * 86400), timeutil.local_day(now))
+        vm.query_movements('in', limit=25)
+        vm.count_movements('in')
+        vm.get_zone_usage()
+
+    operations['dashboard'] = summarize([read(dashboard) for _ in range(REPEATS['dashboard'])])
+
+    windows = []
+    for _ in range(REPEATS['availability']):
+        start = now + rng.randint(0, 3 * 86400)
+        windows.append((start, start + rng.choice((1, 2, 4)) * 3600))
+    operations['availability'] = summarize([read(vm.get_available_slots, start, end) for start, end in windows])
+
+    operations['history'] = summarize([
+        read(vm.get_movement_history, rng.choice(plates)[:4], now - 90 * 86400, now)
+        for _ in range(REPEATS['history'])
+    ])
+    operations['range_summary'] = summarize([
+        read(reports.range_summary, now - 30 * 86400, now) for _ in range(REPEATS['range_summary'])
+    ])
+    db.close_connection()
+    return operations
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Prints p50 ratios against the baseline; returns the (size, operation) pairs slower than `threshold`."""
+    regressions = []
+    for label, result in report['sizes'].items():
+        before = baseline.get('sizes', {}).get(label)
+        if before is None:
+            continue
+        for name, stats in result['operations'].items():
+            old = before['operations'].get(name)
+            if not old or not old['p50_ms']:
+                continue
+            ratio = stats['p50_ms'] / old['p50_ms']
+            flag = '  REGRESSION' if ratio > threshold else ''
+            print(f"{label:>4} {name:<14} {old['p50_ms']:>10.3f} -> {stats['p50_ms']:>10.3f} ms  x{ratio:.2f}{flag}")
+            if ratio > threshold:
+                regressions.append((label, name))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the car park data layer on synthetic datasets.")
+    parser.add_argument('--sizes', default='10k', help="comma-separated sizes: 10k, 1m, 10m or movement counts")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="report file; default benchmarks/results/report-<time>.json")
+    parser.add_argument('--baseline', help="earlier report to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25, help="p50 slowdown ratio that counts as a regression")
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'seed': args.seed,
+        },
+        'sizes': {},
+    }
+    for label in args.sizes.split(','):
+        label = label.strip().lower()
+        source = dataset(label, args.seed)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, os.path.basename(source))
+            shutil.copyfile(source, path)
+            print(f"Benchmarking {label}...", file=sys.stderr)
+            report['sizes'][label] = {
+                'movements': parse_size(label),
+                'db_bytes': os.path.getsize(source),
+                'operations': bench_size(path, args.seed),
+            }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"report-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for label, result in report['sizes'].items():
+        for name, stats in result['operations'].items():
+            print(f"{label:>4} {name:<14} p50 {stats['p50_ms']:>10.3f} ms  p95 {stats['p95_ms']:>10.3f} ms")
+    print(f"Report written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(f"{len(regressions)} regressions over x{args.threshold}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Synthetic car park databases for benchmarks.
+
+Builds a fully migrated database with a realistic history:
+- plates in the local 'KAB 123C' format, with regulars visiting far more
+  often than occasional visitors (Pareto);
+- vehicle models drawn from car_models;
+- arrivals following a weekday profile with morning and evening peaks,
+  quieter weekends, and log-normal stays (median about 90 minutes);
+- a set of vehicles currently parked, one per plate and bay;
+- past and upcoming reservations, non-overlapping per bay;
+- staff and three shifts a day of allocations.
+
+Rows go in through executemany in large transactions with the triggers
+live, then the rollups are rebuilt, since imported history arrives out of
+time order.
+
+Usage: python benchmarks/synthetic.py DB_FILE --size 10k|1m|10m [--seed N]
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+import slots
+import timeutil
+from connection import close_pool, get_pool
+import migrations
+
+SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+# Relative arrivals per local hour of a weekday
+ARRIVALS_BY_HOUR = np.array([1, 1, 1, 1, 2, 4, 9, 16, 18, 13, 10, 10, 11, 10, 9, 9, 10, 12, 10, 7, 5, 4, 2, 1], dtype=float)
+WEEKEND_FACTOR = 0.6
+MEDIAN_STAY = 90 * 60
+LETTERS = np.array(list('ABCDEFGHJKLMNPQRSTUVWXYZ'))
+CHUNK = 200_000
+STAFF_ROLES = ('Entry gate A staff', 'Entry gate B staff', 'Exit gate staff', 'Cashier')
+SHIFTS = (('Morning shift', 6), ('Day shift', 14), ('Night shift', 22))
+
+
+def make_plates(rng, count):
+    """`count` distinct plates such as 'KCA 123D', in random order."""
+    codes = rng.permutation(len(LETTERS) ** 3 * 1000)[:count]
+    digits, codes = codes % 1000, codes // 1000
+    first, codes = LETTERS[codes % len(LETTERS)], codes // len(LETTERS)
+    second, last = LETTERS[codes % len(LETTERS)], LETTERS[codes // len(LETTERS)]
+    return [f"K{a}{b} {d:03d}{c}" for a, b, d, c in zip(first, second, digits, last)]
+
+
+def arrival_times(rng, count, days, end):
+    """`count` epoch arrival times over the `days` before `end`, following ARRIVALS_BY_HOUR."""
+    first_day = timeutil.to_local(end - days * 86400).replace(hour=0, minute=0, second=0, microsecond=0)
+    day_starts = timeutil.to_epoch(first_day.replace(tzinfo=None)) + np.arange(days) * 86400
+    weekday = (first_day.weekday() + np.arange(days)) % 7
+    day_weights = np.where(weekday >= 5, WEEKEND_FACTOR, 1.0)
+    day = rng.choice(days, count, p=day_weights / day_weights.sum())
+    hour = rng.choice(24, count, p=ARRIVALS_BY_HOUR / ARRIVALS_BY_HOUR.sum())
+    return day_starts[day] + hour * 3600 + rng.integers(0, 3600, count)
+
+
+def stays(rng, count):
+    return np.clip(rng.lognormal(np.log(MEDIAN_STAY), 0.9, count), 300, 3 * 86400).astype(np.int64)
+
+
+def seed_slots(conn, count):
+    """Spreads `count` bays over two levels, with some EV and disabled bays."""
+    numbers = np.arange(1, count + 1)
+    for level, part in enumerate(np.array_split(numbers, 2)):
+        zone_id = slots.seed_zone(conn, 'main', level, 'A' if level == 0 else f"L{level}")
+        special = max(1, len(part) // 20)
+        slots.seed_zone_slots(conn, zone_id, part[:special].tolist(), 'disabled')
+        slots.seed_zone_slots(conn, zone_id, part[special:2 * special].tolist(), 'ev')
+        slots.seed_zone_slots(conn, zone_id, part[2 * special:].tolist(), 'standard')
+
+
+def generate(db_file, movements, seed=0, now=None):
+    """Creates db_file with `movements` movements and matching reference data; returns a summary dict."""
+    if os.path.exists(db_file):
+        raise FileExistsError(db_file)
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    now = timeutil.now() if now is None else now
+    pool = get_pool(db_file)
+    migrations.migrate(pool)
+
+    slot_count = int(np.clip(movements // 2000, 50, 2000))
+    plate_count = max(1000, movements // 20)
+    days = int(np.clip(movements // 1500, 30, 730))
+    plates = make_plates(rng, plate_count)
+
+    with pool.transaction() as conn:
+        seed_slots(conn, slot_count)
+        models = [row[0] for row in conn.execute("SELECT brand || ' ' || model FROM car_models")]
+        conn.executemany(
+            "INSERT INTO Vehicles (license_plate, vehicle_type) VALUES (?, ?)",
+            zip(plates, rng.choice(models, plate_count).tolist())
+        )
+
+    # Closed history, ending a day ago so nothing in it is still open
+    history_end = now - 86400
+    for offset in range(0, movements, CHUNK):
+        count = min(CHUNK, movements - offset)
+        checkin = np.sort(arrival_times(rng, count, days, history_end))
+        checkout = np.minimum(checkin + stays(rng, count), history_end)
+        visitor = np.minimum((rng.pareto(1.2, count) * plate_count / 50).astype(np.int64), plate_count - 1)
+        rows = zip(
+            (plates[i] for i in visitor.tolist()),
+            rng.choice(['Male', 'Female'], count, p=[0.62, 0.38]).tolist(),
+            rng.choice(['Y', 'N'], count, p=[0.4, 0.6]).tolist(),
+            rng.integers(1, slot_count + 1, count).tolist(),
+            checkin.tolist(), checkout.tolist(),
+        )
+        with pool.transaction() as conn:
+            conn.executemany(
+                """INSERT INTO VehicleMovements
+                   (license_plate, owner_gender, passengers, slot_number, checkin_time, checkout_time,
+                    checked_in, checked_out, state)
+                   VALUES (?, ?, ?, ?, ?, ?, FALSE, TRUE, 'out')""",
+                rows
+            )
+
+    # Vehicles parked now: distinct plates in distinct bays
+    parked = int(slot_count * 0.6)
+    with pool.transaction() as conn:
+        conn.executemany(
+            """INSERT INTO VehicleMovements
+               (license_plate, owner_gender, passengers, slot_number, checkin_time, checked_in, checked_out, state)
+               VALUES (?, 'Male', 'N', ?, ?, TRUE, FALSE, 'in')""",
+            zip(plates[:parked], (rng.permutation(slot_count)[:parked] + 1).tolist(),
+                (now - rng.integers(60, 6 * 3600, parked)).tolist())
+        )
+        conn.execute(
+            """UPDATE ParkingSlots SET status = 'occupied'
+               WHERE slot_number IN (SELECT slot_number FROM VehicleMovements WHERE state = 'in')"""
+        )
+
+    # Reservations: a history of finished ones, then back-to-back upcoming
+    # windows per bay that never overlap
+    past = max(100, movements // 50)
+    starts = arrival_times(rng, past, days, history_end)
+    upcoming = []
+    for slot_number in range(1, slot_count + 1):
+        start = now + int(rng.integers(3600, 6 * 3600))
+        for _ in range(int(rng.integers(2, 12))):
+            end = start + int(rng.integers(1, 5)) * 3600
+            upcoming.append((slot_number, start, end))
+            start = end + int(rng.integers(1, 24)) * 3600
+    with pool.transaction() as conn:
+        conn.executemany(
+            """INSERT INTO Reservations (license_plate, slot_number, status, reservation_start, reservation_end, reserved_on)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            zip(rng.choice(plates, past).tolist(), rng.integers(1, slot_count + 1, past).tolist(),
+                rng.choice(['completed', 'no_show', 'cancelled'], past, p=[0.85, 0.1, 0.05]).tolist(),
+                starts.tolist(), (starts + 7200).tolist(), (starts - 86400).tolist())
+        )
+        conn.executemany(
+            """INSERT INTO Reservations (license_plate, slot_number, status, reservation_start, reservation_end, reserved_on)
+               VALUES (?, ?, 'active', ?, ?, ?)""",
+            [(plates[parked + i % (plate_count - parked)], slot_number, start, end, now)
+             for i, (slot_number, start, end) in enumerate(upcoming)]
+        )
+
+        conn.executemany(
+            "INSERT INTO staff (name, employee_id, contact_info) VALUES (?, ?, ?)",
+            [(f"Staff {i}", f"E{i:04d}", f"07{i:08d}") for i in range(1, 31)]
+        )
+        first_day = timeutil.to_local(now - days * 86400).date()
+        allocations = []
+        for offset in range(days + 1):
+            shift_date = (first_day + timedelta(days=offset)).isoformat()
+            for shift, hour in SHIFTS:
+                start = timeutil.to_epoch(f"{shift_date} {hour:02d}:00")
+                for role in STAFF_ROLES:
+                    allocations.append((int(rng.integers(1, 31)), role, shift, shift_date,
+                                        start, start + 8 * 3600, start - 86400))
+        conn.executemany(
+            """INSERT INTO staff_allocation (staff_id, role, shift, shift_date, start_time, end_time, allocation_time)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            allocations
+        )
+
+    with pool.transaction() as conn:
+        analytics.rebuild_rollups(conn)
+    with pool.reader() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    close_pool(db_file)
+    return {
+        'movements': movements,
+        'plates': plate_count,
+        'slots': slot_count,
+        'days': days,
+        'reservations': past + len(upcoming),
+        'staff_allocations': len(allocations),
+        'seconds': round(time.perf_counter() - started, 1),
+        'bytes': os.path.getsize(db_file),
+    }
+
+
+def parse_size(text):
+    """Movement count for a size label ('10k', '1m', '10m') or a plain number."""
+    return SIZES.get(text.lower()) or int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic car park database.")
+    parser.add_argument('db_file')
+    parser.add_argument('--size', default='10k', help="10k, 1m, 10m or a movement count")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(generate(args.db_file, parse_size(args.size), args.seed))
+
+
+if __name__ == '__main__':
+    main()
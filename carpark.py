@@ -1,285 +1,641 @@
 import sqlite3
+import itertools
 import pandas as pd
 from sqlite3 import Error
-from datetime import datetime
-import pytz
+from datetime import timedelta
+import timeutil
+from connection import get_pool, close_pool
+import migrations
+import occupancy
+import inventory
+import images
+import instrumentation
+from slots import SLOT_TYPES
+import reservations
+import scheduler
+from archive import MovementArchive
+from query_cache import QueryCache, read_tables, written_tables
+
+# Cache lifetimes for read queries, in seconds. Writes made through
+# Database.execute_query invalidate dependent entries immediately; the TTL
+# only bounds staleness from writes made by other processes.
+REFERENCE_TTL = 3600
+LIVE_TTL = 10
+# How long a new arrival is assumed to stay when keeping it off bays that
+# are reserved for later, in seconds
+EXPECTED_STAY = 2 * 3600
 
 class Database:
     def __init__(self, db_file):
-        self.conn = self.create_connection(db_file)
+        self.db_file = db_file
+        self.pool = self.create_connection(db_file)
+        self.cache = QueryCache()
+        self.metrics = self.pool.metrics
         self.create_tables()
 
     def create_connection(self, db_file):
         try:
-            conn = sqlite3.connect(db_file)
-            return conn
+            return get_pool(db_file)
         except Error as e:
             print(e)
         return None
-        
-    def create_tables(self):
-        try:
-            c = self.conn.cursor()
-
-            # Create Vehicles table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS Vehicles (
-                id INTEGER PRIMARY KEY,
-                license_plate TEXT UNIQUE,
-                vehicle_type TEXT
-            )
-            ''')
-
-            # Create VehicleMovements table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS VehicleMovements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                license_plate TEXT,
-                owner_gender TEXT,
-                checked_in BOOLEAN DEFAULT FALSE,
-                checked_out BOOLEAN DEFAULT FALSE,
-                checkin_time TEXT,
-                checkout_time TEXT,
-                passengers TEXT,
-                FOREIGN KEY (license_plate) REFERENCES Vehicles(license_plate)
-            )
-            ''')
-
-            # Create Transactions table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS Transactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                vehicle_id INTEGER NOT NULL,
-                slot_id INTEGER NOT NULL,
-                entry_time TEXT NOT NULL,
-                exit_time TEXT,
-                FOREIGN KEY (vehicle_id) REFERENCES Vehicles (id),
-                FOREIGN KEY (slot_id) REFERENCES ParkingSlots (id)
-            )
-            ''')
-
-            # Create Users table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS Users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL UNIQUE,
-                password TEXT NOT NULL,
-                role TEXT NOT NULL
-            )
-            ''')
-
-            # Create Payments table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS Payments (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                transaction_id INTEGER NOT NULL,
-                amount REAL NOT NULL,
-                payment_time TEXT NOT NULL,
-                FOREIGN KEY (transaction_id) REFERENCES Transactions (id)
-            )
-            ''')
-
-            # Create Car Models table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS car_models (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                brand TEXT NOT NULL,
-                model TEXT NOT NULL
-            )
-            ''')
-
-            # Create Reservations table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS Reservations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                license_plate TEXT NOT NULL,
-                reservation_start TIMESTAMP NOT NULL,
-                reservation_end TIMESTAMP NOT NULL,
-                slot_number INTEGER NOT NULL,
-                reserved_on TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'active'
-            )
-            ''')
 
-            # Create Parking Slots table
-            c.execute('''
-            CREATE TABLE IF NOT EXISTS ParkingSlots (
-                slot_number INTEGER PRIMARY KEY,
-                status TEXT DEFAULT 'available'
-            )
-            ''')
-
-            # Prepopulate car models table
-            car_models = [
-                ('Toyota', 'Corolla'), ('Toyota', 'Camry'), ('Toyota', 'RAV4'),
-                ('Honda', 'Civic'), ('Honda', 'Accord'), ('Honda', 'CR-V'),
-                ('Ford', 'Focus'), ('Ford', 'Fusion'), ('Ford', 'Mustang'),
-                ('Chevrolet', 'Malibu'), ('Chevrolet', 'Cruze'), ('Chevrolet', 'Equinox'),
-                ('Nissan', 'Altima'), ('Nissan', 'Sentra'), ('Nissan', 'Maxima'),
-                ('BMW', '3 Series'), ('BMW', '5 Series'), ('BMW', '7 Series'),
-                ('Mercedes-Benz', 'C-Class'), ('Mercedes-Benz', 'E-Class'), ('Mercedes-Benz', 'S-Class'),
-                ('Audi', 'A3'), ('Audi', 'A4'), ('Audi', 'A6'),
-                ('Volkswagen', 'Golf'), ('Volkswagen', 'Passat'), ('Volkswagen', 'Jetta'),
-                ('Hyundai', 'Elantra'), ('Hyundai', 'Sonata'), ('Hyundai', 'Tucson'),
-                ('Kia', 'Optima'), ('Kia', 'Forte'), ('Kia', 'Sportage'),
-                ('Subaru', 'Impreza'), ('Subaru', 'Legacy'), ('Subaru', 'Outback'),
-                ('Tesla', 'Model S'), ('Tesla', 'Model 3'), ('Tesla', 'Model X')
-            ]
-            c.executemany('INSERT INTO car_models (brand, model) VALUES (?, ?)', car_models)
-
-            # Prepopulate parking slots table
-            parking_slots = [
-                (1, 'available'), (2, 'available'), (3, 'available'), (4, 'available'), (5, 'available'),
-                (6, 'available'), (7, 'available'), (8, 'available'), (9, 'available'), (10, 'available')
-            ]
-            c.executemany('INSERT INTO ParkingSlots (slot_number, status) VALUES (?, ?)', parking_slots)
-
-            self.conn.commit()
+    def transaction(self):
+        """Explicit write scope: statements inside commit or roll back together."""
+        return self.pool.transaction()
 
+    def create_tables(self):
+        try:
+            migrations.bootstrap(self.pool)
+            with self.pool.reader() as conn:
+                self.cache.load_trigger_dependencies(conn)
         except sqlite3.Error as e:
             print(f"An error occurred while creating the tables: {e}")
             
     def close_connection(self):
-        if self.conn:
-            self.conn.close()
+        if self.pool:
+            close_pool(self.db_file)
 
     def execute_query(self, query, params=()):
         try:
-            c = self.conn.cursor()
-            c.execute(query, params)
-            self.conn.commit()
+            with self.transaction() as conn:
+                cur = conn.execute(query, params)
+            return cur
         except Error as e:
             print(e)
-
-    def fetch_all(self, query, params=()):
+        finally:
+            self.invalidate(*written_tables(query))
+
+    def invalidate(self, *tables):
+        """Drops cached reads of `tables`; call after writing through transaction() directly."""
+        self.cache.invalidate(tables)
+
+    def fetch_all(self, query, params=(), ttl=None):
+        """Runs a read query; with a ttl the rows are served from the shared query cache."""
+        key = ('rows', query, tuple(params))
+        if ttl:
+            found, rows = self.cache.get(key)
+            if found:
+                return list(rows)
         try:
-            c = self.conn.cursor()
-            c.execute(query, params)
-            rows = c.fetchall()
-            return rows
+            with self.pool.reader() as conn:
+                rows = conn.execute(query, params).fetchall()
         except Error as e:
             print(e)
             return []
-
-    def fetch_dataframe(self, query):
+        if ttl:
+            self.cache.put(key, rows, ttl, read_tables(query))
+        return rows
+
+    def metrics_snapshot(self):
+        """Statement timings, slow queries, lock waits, traces and cache counters as JSON-ready data."""
+        return self.metrics.snapshot(self.cache)
+
+    def metrics_prometheus(self):
+        return self.metrics.prometheus(self.cache)
+
+    def fetch_dataframe(self, query, params=(), ttl=None):
+        key = ('frame', query, tuple(params))
+        if ttl:
+            found, frame = self.cache.get(key)
+            if found:
+                return frame.copy()
         try:
-            return pd.read_sql_query(query, self.conn)
+            with self.pool.reader() as conn:
+                frame = pd.read_sql_query(query, conn, params=params)
         except Error as e:
             print(e)
             return pd.DataFrame()
+        if ttl:
+            self.cache.put(key, frame.copy(), ttl, read_tables(query))
+        return frame
+
+def normalize_plate(text):
+    """Canonical plate form used by the search index: no spaces or dashes, upper case."""
+    return (text or '').replace(' ', '').replace('-', '').upper()
+
+def event_text(value):
+    """A gate event field as stripped text: strings and numbers are kept, anything else (or blank) is None."""
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    return str(value).strip() or None
+
+INGEST_WRITES = {
+    'in': """INSERT INTO VehicleMovements
+             (license_plate, owner_gender, checked_in, checked_out, checkin_time, passengers, state, slot_number)
+             VALUES (:license_plate, :owner_gender, TRUE, FALSE, :checkin_time, :passengers, 'in', :slot_number)""",
+    'out': """UPDATE VehicleMovements
+              SET state = 'out', checked_out = TRUE, checked_in = FALSE, checkout_time = ?
+              WHERE license_plate = ? AND state = 'in'""",
+}
+
+MOVEMENT_SORT_COLUMNS = ('checkin_time', 'checkout_time', 'license_plate', 'id')
+RESERVATION_SORT_COLUMNS = ('reservation_start', 'reservation_end', 'reserved_on', 'license_plate', 'slot_number', 'id')
 
 class VehicleManagement:
     def __init__(self, database):
         self.db = database
-        self.local_tz = pytz.timezone('Africa/Nairobi')
+        self.local_tz = timeutil.LOCAL_TZ
+        self.occupancy = occupancy.get_index(database.pool)
+        self.reservation_engine = reservations.get_engine(database.pool)
+        self.inventory = inventory.get_inventory(database.pool)
+        self.archive = MovementArchive(database.pool)
+        self.images = images.get_store(database.pool)
 
     def get_vehicle_models(self):
         """Fetches vehicle models from the database."""
-        query = "SELECT brand || ' ' || model AS full_model FROM car_models"
+        query = "SELECT brand || ' ' || model AS full_model FROM car_models ORDER BY brand, model"
+        return [row[0] for row in self.db.fetch_all(query, ttl=REFERENCE_TTL)]
+
+    def insert_vehicle_and_checkin(self, license_plate, vehicle_type, owner_gender, passengers, image_sha256,
+                                   slot_type='standard'):
+        """Registers the vehicle if needed, allocates a bay and opens a session, in one transaction.
+
+        `image_sha256` is the key ImageStore.put returned for the photo, or None.
+
+        The partial unique indexes on open sessions make a concurrent second
+        check-in of the same plate a no-op, and a bay taken by another process
+        in the meantime an IntegrityError, after which another bay is tried.
+        The occupancy index is only a hint: it may miss check-outs made by
+        other processes, so a hit is confirmed against the database.
+        """
+        if self.occupancy.is_checked_in(license_plate) and self.occupancy.refresh_plate(license_plate):
+            return "Vehicle is already checked in."
+        checkin_time = timeutil.now()
+        for attempt in range(3):
+            slot_number = self.allocate_slot(license_plate, slot_type)
+            try:
+                with self.db.transaction() as conn:
+                    conn.execute(
+                        "INSERT INTO Vehicles (license_plate, vehicle_type) VALUES (?, ?) ON CONFLICT (license_plate) DO NOTHING",
+                        (license_plate, vehicle_type)
+                    )
+                    opened = conn.execute(
+                        '''INSERT INTO VehicleMovements
+                               (license_plate, owner_gender, checked_in, checkin_time, passengers, state, slot_number, image_sha256)
+                           VALUES (?, ?, TRUE, ?, ?, 'in', ?, ?)
+                           ON CONFLICT (license_plate) WHERE state = 'in' DO NOTHING
+                           RETURNING id''',
+                        (license_plate, owner_gender, checkin_time, passengers, slot_number, image_sha256)
+                    ).fetchone()
+                    if opened is not None and image_sha256:
+                        self.images.link(conn, image_sha256, checkin_time)
+                    if opened is not None and slot_number is not None:
+                        conn.execute("UPDATE ParkingSlots SET status = 'occupied' WHERE slot_number = ?", (slot_number,))
+                break
+            except sqlite3.IntegrityError:
+                # Another process filled the bay; relearn the free bays and retry
+                self.inventory.load()
+            except sqlite3.Error as e:
+                print(f"An error occurred while checking in {license_plate}: {e}")
+                self.release_slot(slot_number)
+                return "Vehicle could not be checked in."
+            finally:
+                self.db.invalidate('Vehicles', 'VehicleMovements', 'ParkingSlots', 'images')
+        else:
+            return "Vehicle could not be checked in; no free slot could be held."
+
+        if opened is None:
+            self.release_slot(slot_number)
+            self.occupancy.refresh_plate(license_plate)
+            return "Vehicle is already checked in."
+        self.occupancy.checked_in(license_plate, opened[0], checkin_time)
+        if slot_number is None:
+            return f"Vehicle checked in, but no {slot_type} slot is free."
+        self.occupancy.slot_status_changed(slot_number, 'occupied')
+        return f"Vehicle checked in successfully! Park in slot {slot_number}."
+
+    def update_vehicle_checkout(self, license_plate):
+        """Closes the plate's open session with a single UPDATE ... RETURNING."""
+        checkout_time = timeutil.now()
         try:
-            c = self.db.conn.cursor()
-            c.execute(query)
-            models = [row[0] for row in c.fetchall()]
-            return models
+            with self.db.transaction() as conn:
+                closed = conn.execute(
+                    """
+                    UPDATE VehicleMovements 
+                    SET state = 'out', checked_out = TRUE, checked_in = FALSE, checkout_time = ? 
+                    WHERE license_plate=? AND state='in'
+                    RETURNING id, slot_number
+                    """, 
+                    (checkout_time, license_plate)
+                ).fetchall()
+                for _, slot_number in closed:
+                    conn.execute(
+                        "UPDATE ParkingSlots SET status = 'available' WHERE slot_number = ? AND status = 'occupied'",
+                        (slot_number,)
+                    )
         except sqlite3.Error as e:
-            print(f"An error occurred while fetching vehicle models: {e}")
-            return []
-
-    def insert_vehicle_and_checkin(self, license_plate, vehicle_type, owner_gender, passengers, image_path):
-        vehicle = self.db.fetch_all("SELECT * FROM Vehicles WHERE license_plate = ?", (license_plate,))
-        if not vehicle:
-            self.db.execute_query(
-                "INSERT INTO Vehicles (license_plate, vehicle_type, image_path) VALUES (?, ?, ?)",
-                (license_plate, vehicle_type, image_path)
-            )
+            print(f"An error occurred while checking out {license_plate}: {e}")
+            closed = []
+        finally:
+            self.db.invalidate('VehicleMovements', 'ParkingSlots')
+
+        if not closed:
+            if self.occupancy.is_checked_in(license_plate):
+                # Another process closed the session first; resync the index
+                self.occupancy.load()
+            return "Vehicle is not currently checked in or already checked out."
+        self.occupancy.checked_out(license_plate)
+        for _, slot_number in closed:
+            self.release_slot(slot_number)
+        return "Vehicle checked out successfully!"
 
-        active_checkin = self.db.fetch_all(
-            "SELECT * FROM VehicleMovements WHERE license_plate = ? AND checked_in = TRUE AND checked_out = FALSE",
-            (license_plate,)
+    def allocate_slot(self, license_plate, slot_type='standard', zone_id=None):
+        """Holds a bay for the vehicle and returns its number, or None if none is free.
+
+        A vehicle whose reservation window covers now gets its reserved bay.
+        Everyone else gets the nearest free bay of the slot type with no
+        reservation during the next EXPECTED_STAY seconds, or failing that
+        one that is not reserved right now.
+        """
+        now = timeutil.now()
+        reserved = self.occupancy.reserved_slot(license_plate, now)
+        if reserved is not None and self.inventory.claim(reserved):
+            return reserved
+        blocked = self.reservation_engine.reserved_slots(now, now + EXPECTED_STAY)
+        slot_number = self.inventory.allocate(slot_type, zone_id, blocked)
+        if slot_number is None:
+            blocked = self.reservation_engine.reserved_slots(now, now + 1)
+            slot_number = self.inventory.allocate(slot_type, zone_id, blocked)
+        return slot_number
+
+    def release_slot(self, slot_number):
+        """Returns a bay held by allocate_slot to the free pool."""
+        if slot_number is not None:
+            self.inventory.release(slot_number)
+            self.occupancy.slot_status_changed(slot_number, 'available')
+
+    def get_zone_usage(self):
+        """Bays, occupied bays and capacity per site, level and zone."""
+        return pd.DataFrame(
+            self.inventory.zone_usage(),
+            columns=['site', 'level', 'zone', 'slots', 'occupied', 'capacity']
         )
-        if active_checkin:
-            return "Vehicle is already checked in."
-        else:
-            checkin_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            self.db.execute_query(
-                '''INSERT INTO VehicleMovements (license_plate, owner_gender, checked_in, checkin_time, passengers)
-                   VALUES (?, ?, TRUE, ?, ?)''',
-                (license_plate, owner_gender, checkin_time, passengers)
-            )
-            return "Vehicle checked in successfully!"
 
-    def update_vehicle_checkout(self, license_plate):
-        checked_in = self.db.fetch_all(
-            "SELECT checked_in FROM VehicleMovements WHERE license_plate=? AND checked_in=? AND checked_out=?", 
-            (license_plate, True, False)
+    def ingest_movements(self, events, chunk_size=5000, reload=False):
+        """Applies a stream of gate events set-wise, in chunked transactions.
+
+        Each event is a dict with 'event' ('in' or 'out'), 'license_plate' and
+        optionally 'time' (anything timeutil.to_epoch accepts; local time for
+        strings), 'vehicle_type', 'owner_gender' and 'passengers'. Events are
+        applied in order. Sessions still open at the end of a chunk get a bay
+        through allocate_slot. Yields one (index, license_plate, event, outcome)
+        tuple per event, where outcome is 'checked in', 'checked out',
+        'already checked in', 'not checked in' or 'invalid'.
+
+        The occupancy index and slot inventory are updated per chunk; with
+        `reload` they are also rebuilt from the database at the end, as a
+        bulk import does.
+        """
+        chunk = []
+        for index, event in enumerate(events):
+            chunk.append((index, event))
+            if len(chunk) >= chunk_size:
+                yield from self._ingest_chunk(chunk)
+                chunk = []
+        if chunk:
+            yield from self._ingest_chunk(chunk)
+        if reload:
+            self.occupancy.load()
+            self.inventory.load()
+
+    def _ingest_chunk(self, chunk):
+        now = timeutil.now()
+        plates = {event_text(event.get('license_plate')) for _, event in chunk} - {None}
+        vehicles = {}
+        for _, event in chunk:
+            plate = event_text(event.get('license_plate'))
+            vehicle_type = event_text(event.get('vehicle_type'))
+            if plate and vehicle_type:
+                vehicles.setdefault(plate, vehicle_type)
+
+        outcomes, held = [], []
+        try:
+            with self.db.transaction() as conn:
+                freed, sessions = self._write_chunk(conn, chunk, now, plates, vehicles, outcomes, held)
+        except BaseException:
+            for slot_number in held:
+                self.release_slot(slot_number)
+            raise
+        finally:
+            self.db.invalidate('Vehicles', 'VehicleMovements', 'ParkingSlots')
+        self.occupancy.sessions_changed(
+            plates, sessions, sum(outcome == 'checked out' for _, _, _, outcome in outcomes)
+        )
+        for slot_number in held:
+            self.occupancy.slot_status_changed(slot_number, 'occupied')
+        for slot_number in freed:
+            self.release_slot(slot_number)
+        return outcomes
+
+    def _write_chunk(self, conn, chunk, now, plates, vehicles, outcomes, held):
+        """Applies the chunk inside the caller's transaction, filling `outcomes` and the bays
+        `held` for new sessions; returns (bays freed by check-outs, plate -> (id, checkin_time)
+        of the chunk's plates still checked in)."""
+        conn.executemany(
+            "INSERT INTO Vehicles (license_plate, vehicle_type) VALUES (?, ?) ON CONFLICT (license_plate) DO NOTHING",
+            vehicles.items()
         )
-        if not checked_in:
-            return "Vehicle is not currently checked in or already checked out."
 
-        checkout_time = datetime.now(self.local_tz).strftime('%Y-%m-%d %H:%M:%S')
-        self.db.execute_query(
+        # Sessions already open for the plates in this chunk, in one indexed join
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS ingest_plates (plate TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM ingest_plates")
+        conn.executemany("INSERT INTO ingest_plates (plate) VALUES (?)", [(p,) for p in plates])
+        open_sessions = dict(conn.execute(
+            """SELECT m.license_plate, m.slot_number FROM ingest_plates p
+               JOIN VehicleMovements m ON m.license_plate = p.plate AND m.state = 'in'"""
+        ).fetchall())
+
+        # Replay the chunk in memory, then write it in event order so the
+        # rollup triggers see occupancy change as it happened. A check-in
+        # closed later in the same chunk is inserted open, then closed.
+        writes, freed = [], []
+        for index, event in chunk:
+            plate = event_text(event.get('license_plate'))
+            kind = event.get('event')
+            try:
+                when = timeutil.to_epoch(event.get('time') or now)
+            except (TypeError, ValueError, OverflowError):
+                # Lists, dicts, NaN and the like are reported, not raised
+                when = None
+            if not plate or kind not in ('in', 'out') or when is None:
+                outcome = 'invalid'
+            elif kind == 'in':
+                if plate in open_sessions:
+                    outcome = 'already checked in'
+                else:
+                    row = {
+                        'license_plate': plate, 'owner_gender': event_text(event.get('owner_gender')),
+                        'passengers': event_text(event.get('passengers')), 'checkin_time': when,
+                        'slot_number': None,
+                    }
+                    writes.append(('in', row))
+                    open_sessions[plate] = row
+                    outcome = 'checked in'
+            elif plate not in open_sessions:
+                outcome = 'not checked in'
+            else:
+                session = open_sessions.pop(plate)
+                if not isinstance(session, dict) and session is not None:
+                    freed.append(session)
+                writes.append(('out', (when, plate)))
+                outcome = 'checked out'
+            outcomes.append((index, plate, kind, outcome))
+
+        # Bays for the check-ins still open at the end of the chunk. Bays this
+        # chunk frees only return to the pool after it commits, so no insert
+        # can take a bay whose session has not been closed yet.
+        self._hold_bays(conn, [row for row in open_sessions.values() if isinstance(row, dict)], held)
+        conn.executemany(
+            "UPDATE ParkingSlots SET status = 'available' WHERE slot_number = ? AND status = 'occupied'",
+            [(slot_number,) for slot_number in freed]
+        )
+        # Consecutive writes of one kind still go out as one executemany
+        for kind, run in itertools.groupby(writes, key=lambda write: write[0]):
+            conn.executemany(INGEST_WRITES[kind], [params for _, params in run])
+        conn.executemany(
+            "UPDATE ParkingSlots SET status = 'occupied' WHERE slot_number = ?", [(slot_number,) for slot_number in held]
+        )
+        sessions = {
+            plate: (movement_id, checkin_time) for plate, movement_id, checkin_time in conn.execute(
+                """SELECT m.license_plate, m.id, m.checkin_time FROM ingest_plates p
+                   JOIN VehicleMovements m ON m.license_plate = p.plate AND m.state = 'in'"""
+            )
+        }
+        return freed, sessions
+
+    def _hold_bays(self, conn, rows, held):
+        """Allocates a bay to each new session row inside the write transaction, adding it to `held`."""
+        for row in rows:
+            for attempt in range(3):
+                slot_number = self.allocate_slot(row['license_plate'])
+                # The write lock is held, so the database is authoritative: skip
+                # bays another process filled since the inventory last loaded
+                if slot_number is None or not conn.execute(
+                    "SELECT 1 FROM VehicleMovements WHERE state = 'in' AND slot_number = ?", (slot_number,)
+                ).fetchone():
+                    break
+            else:
+                slot_number = None
+            row['slot_number'] = slot_number
+            if slot_number is not None:
+                held.append(slot_number)
+
+    def query_movements(self, state, plate_prefix=None, sort_by='checkin_time', descending=True,
+                        limit=25, offset=0, after=None):
+        """Returns one page of movements in the given state ('in' or 'out'), filtered and sorted in SQL.
+
+        Pass the (sort value, id) of the last row of the previous page as
+        `after` to page with a keyset instead of an offset.
+        """
+        if sort_by not in MOVEMENT_SORT_COLUMNS:
+            raise ValueError(f"Cannot sort movements by {sort_by!r}")
+        where, params = ["state = 'in'" if state == 'in' else "state = 'out'"], []
+        self._add_plate_prefix(where, params, plate_prefix)
+        return self._fetch_page('VehicleMovements', where, params, sort_by, descending, limit, offset, after)
+
+    def count_movements(self, state, plate_prefix=None):
+        where, params = ["state = 'in'" if state == 'in' else "state = 'out'"], []
+        self._add_plate_prefix(where, params, plate_prefix)
+        query = f"SELECT COUNT(*) FROM VehicleMovements WHERE {' AND '.join(where)}"
+        return self.db.fetch_all(query, params, ttl=LIVE_TTL)[0][0]
+
+    def query_reservations(self, plate_prefix=None, sort_by='reservation_start', descending=True,
+                           limit=25, offset=0, after=None):
+        """Returns one page of reservations, filtered and sorted in SQL."""
+        if sort_by not in RESERVATION_SORT_COLUMNS:
+            raise ValueError(f"Cannot sort reservations by {sort_by!r}")
+        where, params = [], []
+        self._add_plate_prefix(where, params, plate_prefix)
+        return self._fetch_page('Reservations', where, params, sort_by, descending, limit, offset, after)
+
+    def count_reservations(self, plate_prefix=None):
+        where, params = [], []
+        self._add_plate_prefix(where, params, plate_prefix)
+        query = f"SELECT COUNT(*) FROM Reservations WHERE {' AND '.join(where) or '1'}"
+        return self.db.fetch_all(query, params, ttl=LIVE_TTL)[0][0]
+
+    def _add_plate_prefix(self, where, params, plate_prefix):
+        # A range on upper(license_plate) lets SQLite use the expression index
+        prefix = (plate_prefix or '').strip().upper()
+        if prefix:
+            where.append("upper(license_plate) >= ? AND upper(license_plate) < ?")
+            params.extend([prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)])
+
+    def _fetch_page(self, table, where, params, sort_by, descending, limit, offset, after):
+        order = 'DESC' if descending else 'ASC'
+        if after is not None:
+            where.append(f"({sort_by}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+            offset = 0
+        query = f"""
+            SELECT * FROM {table}
+            WHERE {' AND '.join(where) or '1'}
+            ORDER BY {sort_by} {order}, id {order}
+            LIMIT ? OFFSET ?
+        """
+        return self.db.fetch_dataframe(query, params + [limit, offset], ttl=LIVE_TTL)
+
+    def search(self, text, limit=20):
+        """Ranked full-text matches on plates and models across movements, vehicles, reservations and car models."""
+        term = normalize_plate(text)
+        if not term:
+            return pd.DataFrame()
+        if len(term) >= 3:
+            match, rank = "search_index MATCH ?", "bm25(search_index, 10.0, 1.0)"
+            param = '"' + term.replace('"', '""') + '"'
+        else:
+            # Trigrams need at least three characters; fall back to a prefix scan
+            match, rank, param = "search_index.plate LIKE ?", "0", term + '%'
+        query = f"""
+            WITH hits AS (
+                SELECT rowid, {rank} AS rank FROM search_index
+                WHERE {match}
+                ORDER BY rank LIMIT ?
+            )
+            SELECT CASE hits.rowid % 4
+                       WHEN 0 THEN 'movement' WHEN 1 THEN 'vehicle'
+                       WHEN 2 THEN 'reservation' ELSE 'car model' END AS kind,
+                   hits.rowid / 4 AS id,
+                   COALESCE(m.license_plate, v.license_plate, r.license_plate) AS license_plate,
+                   COALESCE(v.vehicle_type, cm.brand || ' ' || cm.model, 'slot ' || r.slot_number) AS detail,
+                   COALESCE(m.state, r.status) AS status,
+                   COALESCE(m.checkin_time, r.reservation_start) AS time,
+                   hits.rank
+            FROM hits
+            LEFT JOIN VehicleMovements m ON hits.rowid % 4 = 0 AND m.id = hits.rowid / 4
+            LEFT JOIN Vehicles v ON hits.rowid % 4 = 1 AND v.id = hits.rowid / 4
+            LEFT JOIN Reservations r ON hits.rowid % 4 = 2 AND r.id = hits.rowid / 4
+            LEFT JOIN car_models cm ON hits.rowid % 4 = 3 AND cm.id = hits.rowid / 4
+            ORDER BY hits.rank
+        """
+        return self.db.fetch_dataframe(query, (param, limit), ttl=LIVE_TTL)
+
+    def get_metrics(self):
+        """Dashboard figures read from the trigger-maintained summary tables."""
+        today = timeutil.local_day(timeutil.now())
+        rows = self.db.fetch_all(
             """
-            UPDATE VehicleMovements 
-            SET checked_out = ?, checked_in = ?, checkout_time = ? 
-            WHERE license_plate=? AND checked_in=? AND checked_out=?
-            """, 
-            (True, False, checkout_time, license_plate, True, False)
+            SELECT s.checked_in, s.checked_out, s.reservations, s.dwell_seconds,
+                   COALESCE(d.entries, 0), COALESCE(d.exits, 0)
+            FROM movement_stats s
+            LEFT JOIN daily_movement_stats d ON d.day = ?
+            WHERE s.id = 1
+            """,
+            (today,),
+            ttl=LIVE_TTL
         )
-        return "Vehicle checked out successfully!"
+        checked_in, checked_out, reservations, dwell_seconds, entries, exits = rows[0] if rows else (0,) * 6
+        return {
+            'checked_in': checked_in,
+            'checked_out': checked_out,
+            'reservations': reservations,
+            'entries_today': entries,
+            'exits_today': exits,
+            'average_dwell_minutes': dwell_seconds / checked_out / 60 if checked_out else 0.0,
+        }
 
     def get_checked_in_vehicles(self):
-        return self.db.fetch_dataframe("SELECT * FROM VehicleMovements WHERE checked_in = TRUE AND checked_out = FALSE")
+        return self.db.fetch_dataframe("SELECT * FROM VehicleMovements WHERE state = 'in'")
 
     def get_checked_out_vehicles(self):
-        return self.db.fetch_dataframe("SELECT * FROM VehicleMovements WHERE checked_in = FALSE AND checked_out = TRUE")
+        """Closed movements still in the hot table; older ones are read through get_movement_history."""
+        return self.db.fetch_dataframe("SELECT * FROM VehicleMovements WHERE state = 'out'")
+
+    def get_movement_history(self, plate_prefix=None, start=None, end=None, limit=500):
+        """Movements checked in within [start, end), including archived months, newest first."""
+        return self.archive.history(plate_prefix, start, end, limit)
 
     def get_all_reservations(self):
-        return self.db.fetch_dataframe("SELECT * FROM Reservations")
+        return self.db.fetch_dataframe("SELECT * FROM Reservations", ttl=LIVE_TTL)
 
     def add_reservation(self, license_plate, reservation_start, reservation_end, slot_number):
-        count = self.db.fetch_all(
-            "SELECT COUNT(*) FROM Reservations WHERE license_plate = ? AND status = 'active'",
-            (license_plate,)
-        )[0][0]
-        if count > 0:
+        """Books the slot for [start, end); times are anything timeutil.to_epoch accepts."""
+        reservation_start, reservation_end = timeutil.to_epoch(reservation_start), timeutil.to_epoch(reservation_end)
+        if reservation_end <= reservation_start:
+            return "Reservation must end after it starts."
+        if self.occupancy.has_active_reservation(license_plate):
             return "Vehicle is already reserved."
+        if self.reservation_engine.conflicts(slot_number, reservation_start, reservation_end):
+            return f"Slot {slot_number} is already reserved for part of that time."
 
-        reserved_on = datetime.now(self.local_tz).strftime('%Y-%m-%d %H:%M:%S')
-        self.db.execute_query(
-            """INSERT INTO Reservations (license_plate, reservation_start, reservation_end, slot_number, status)
-               VALUES (?, ?, ?, ?, 'active')""",
-            (license_plate, reservation_start, reservation_end, slot_number)
-        )
-        self.update_slot_status(slot_number, 'occupied')
+        try:
+            # The R*Tree check and the insert share one write transaction, so two
+            # sessions cannot book overlapping windows on the same slot.
+            with self.db.transaction() as conn:
+                if self.reservation_engine.find_conflict(conn, slot_number, reservation_start, reservation_end):
+                    return f"Slot {slot_number} is already reserved for part of that time."
+                reservation_id = conn.execute(
+                    """INSERT INTO Reservations (license_plate, reservation_start, reservation_end, slot_number, status, reserved_on)
+                       VALUES (?, ?, ?, ?, 'active', ?) RETURNING id""",
+                    (license_plate, reservation_start, reservation_end, slot_number, timeutil.now())
+                ).fetchone()[0]
+        except Error as e:
+            print(f"Error: {e}")
+            return "Reservation could not be saved."
+        finally:
+            self.db.invalidate('Reservations')
+        self.reservation_engine.added(reservation_id, slot_number, reservation_start, reservation_end)
+        self.occupancy.reservation_added(license_plate, slot_number, reservation_start, reservation_end)
         return "Reservation added successfully!"
 
     def cancel_reservation(self, license_plate, slot_number):
-        self.db.execute_query("UPDATE Reservations SET status=? WHERE license_plate=?", ('cancelled', license_plate))
-        self.update_slot_status(slot_number, 'available')
+        try:
+            with self.db.transaction() as conn:
+                cancelled = conn.execute(
+                    "UPDATE Reservations SET status = 'cancelled' WHERE license_plate = ? AND status = 'active' RETURNING id",
+                    (license_plate,)
+                ).fetchall()
+        except Error as e:
+            print(f"Error: {e}")
+            return "Reservation could not be cancelled."
+        finally:
+            self.db.invalidate('Reservations')
+        if not cancelled:
+            return f"No active reservation found for {license_plate}."
+        self.reservation_engine.removed(reservation_id for (reservation_id,) in cancelled)
+        self.occupancy.reservation_cancelled(license_plate)
         return f"Reservation {license_plate} cancelled successfully."
 
     def update_slot_status(self, slot_number, status):
-        self.db.execute_query("UPDATE ParkingSlots SET status=? WHERE slot_number=?", (status, slot_number))
-
-    def get_available_slots(self):
-        """Fetches available parking slots from the database."""
-        query = "SELECT slot_number FROM ParkingSlots WHERE status = 'available'"
-        try:
-            c = self.db.conn.cursor()
-            c.execute(query)
-            slots = [row[0] for row in c.fetchall()]
-            return slots
-        except sqlite3.Error as e:
-            print(f"An error occurred while fetching available slots: {e}")
-            return []
-
+        if self.db.execute_query("UPDATE ParkingSlots SET status=? WHERE slot_number=?", (status, slot_number)) is not None:
+            self.occupancy.slot_status_changed(slot_number, status)
+
+    def get_available_slots(self, start=None, end=None):
+        """Slots that are open and unreserved for [start, end), defaulting to right now."""
+        now = timeutil.now()
+        start = now if start is None else timeutil.to_epoch(start)
+        end = timeutil.to_epoch(end)
+        if end is None or end <= start:
+            end = start + 1
+        unreserved = self.reservation_engine.available_slots(start, end)
+        if start > now:
+            # Current slot status says nothing about a window in the future
+            return unreserved
+        open_now = set(self.occupancy.available_slots())
+        return [slot for slot in unreserved if slot in open_now]
+
+import json
 import streamlit as st
 from streamlit_option_menu import option_menu
-import os
+import analytics
+
+# Rows fetched from SQLite per table page
+PAGE_SIZE = 25
+HISTORY_LIMIT = 500
+# Rows shown in the admin panel's statement and trace tables
+ADMIN_ROWS = 50
+# Epoch columns shown in local time
+TIME_COLUMNS = ('checkin_time', 'checkout_time', 'reservation_start', 'reservation_end', 'reserved_on', 'time')
+
+
+def local_times(frame):
+    return timeutil.localize_columns(frame, *TIME_COLUMNS)
 
 class ParkingManagementApp:
     def __init__(self, vehicle_management):
         self.vehicle_management = vehicle_management
+        self.analytics = analytics.Analytics(vehicle_management.db, vehicle_management.archive)
         st.set_page_config(page_title='Alfakher Parking Management', page_icon=':coin:', layout='wide')
         self.setup_ui()
 
@@ -287,11 +643,11 @@ class ParkingManagementApp:
         self.display_menu()
 
     def display_menu(self):
-        menu_tabs = ['Dashboard', 'Vehicles', 'CheckIN/OUT']
+        menu_tabs = ['Dashboard', 'Vehicles', 'CheckIN/OUT', 'Admin']
         selected_tab = option_menu(
             menu_title=None,
             options=menu_tabs,
-            icons=['house-dash', 'car-front', 'check-circle'],
+            icons=['house-dash', 'car-front', 'check-circle', 'speedometer2'],
             orientation='horizontal'
         )
         if selected_tab == "Dashboard":
@@ -300,54 +656,230 @@ class ParkingManagementApp:
             self.manage_vehicles()
         elif selected_tab == "CheckIN/OUT":
             self.check_in_out()
+        elif selected_tab == "Admin":
+            self.show_admin()
 
     def show_dashboard(self):
         st.markdown('<p class="big-font">Overall Summary</p>', unsafe_allow_html=True)
-        col1, col2, col3 = st.columns(3)
-
-        with col1:
-            total_vehicles_checked_in = len(self.vehicle_management.get_checked_in_vehicles())
-            st.markdown(f"<div class='metric-card'>Total Vehicles Checked In: {total_vehicles_checked_in}</div>", unsafe_allow_html=True)
-
-        with col2:
-            total_vehicles_checked_out = len(self.vehicle_management.get_checked_out_vehicles())
-            st.markdown(f"<div class='metric-card'>Total Vehicles Checked Out: {total_vehicles_checked_out}</div>", unsafe_allow_html=True)
-
-        with col3:
-            total_reservations = len(self.vehicle_management.get_all_reservations())
-            st.markdown(f"<div class='metric-card'>Total Reservations: {total_reservations}</div>", unsafe_allow_html=True)
+        metrics = self.vehicle_management.get_metrics()
+        cards = [
+            ("Total Vehicles Checked In", metrics['checked_in']),
+            ("Total Vehicles Checked Out", metrics['checked_out']),
+            ("Total Reservations", metrics['reservations']),
+            ("Entries Today", metrics['entries_today']),
+            ("Exits Today", metrics['exits_today']),
+            ("Average Stay", f"{metrics['average_dwell_minutes']:.0f} min"),
+        ]
+        for row in (cards[:3], cards[3:]):
+            for col, (label, value) in zip(st.columns(3), row):
+                with col:
+                    st.markdown(f"<div class='metric-card'>{label}: {value}</div>", unsafe_allow_html=True)
+
+        self.show_trends()
 
         st.markdown('<p class="big-font">Recent Check-INs</p>', unsafe_allow_html=True)
-        checked_in_vehicles = self.vehicle_management.get_checked_in_vehicles()
-        st.dataframe(checked_in_vehicles, use_container_width=True)
+        recent_checkins = self.vehicle_management.query_movements('in', limit=PAGE_SIZE)
+        self.show_table(recent_checkins)
+
+        st.markdown('<p class="big-font">Zones</p>', unsafe_allow_html=True)
+        st.dataframe(self.vehicle_management.get_zone_usage(), use_container_width=True)
+
+        with st.expander("Background jobs"):
+            jobs = scheduler.start_scheduler(self.vehicle_management).stats()
+            st.dataframe(pd.DataFrame.from_dict(jobs, orient='index'), use_container_width=True)
+
+    def show_trends(self):
+        st.markdown('<p class="big-font">Trends</p>', unsafe_allow_html=True)
+        period = st.selectbox("Period", ['Last 24 hours', 'Last 7 days', 'Last 30 days'])
+        now = timeutil.to_local(timeutil.now()).replace(tzinfo=None)
+        days = {'Last 24 hours': 1, 'Last 7 days': 7, 'Last 30 days': 30}[period]
+        start = now - timedelta(days=days)
+        if days <= 7:
+            frame = self.analytics.hourly(start.strftime('%Y-%m-%d %H:%M:%S'), now.strftime('%Y-%m-%d %H:%M:%S'))
+            time_column = 'hour'
+        else:
+            frame = self.analytics.daily(start.strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d'))
+            time_column = 'day'
+        dwell = self.analytics.dwell_histogram(start.strftime('%Y-%m-%d'), now.strftime('%Y-%m-%d'))
+
+        left, right = st.columns(2)
+        with left:
+            st.altair_chart(analytics.movements_chart(frame, time_column), use_container_width=True)
+            st.altair_chart(analytics.dwell_chart(dwell), use_container_width=True)
+        with right:
+            st.altair_chart(analytics.occupancy_chart(frame, time_column), use_container_width=True)
+            st.altair_chart(analytics.breakdown_chart(frame, time_column), use_container_width=True)
+
+        with st.expander("Custom range"):
+            first_day = st.date_input("From", value=start.date(), key='analytics_from')
+            last_day = st.date_input("To", value=now.date(), key='analytics_to')
+            if st.button("Compute", key='analytics_compute'):
+                summary = self.analytics.range_summary(
+                    f"{first_day} 00:00:00", f"{last_day + timedelta(days=1)} 00:00:00"
+                )
+                st.write(
+                    f"{summary['entries']} entries, {summary['exits']} exits, "
+                    f"peak occupancy {summary['peak_occupancy']}, "
+                    f"average stay {summary['average_dwell_minutes']:.0f} min"
+                )
+                st.altair_chart(analytics.occupancy_chart(summary['occupancy'], 'time', 'occupancy'), use_container_width=True)
+                st.altair_chart(analytics.dwell_chart(summary['dwell_histogram']), use_container_width=True)
 
     def manage_vehicles(self):
-        vehicle_expand = ['Checked-IN', 'Checked-OUT']
+        vehicle_expand = ['Checked-IN', 'Checked-OUT', 'Search', 'History']
         vehicle_tab = option_menu(
             menu_title=None,
             options=vehicle_expand,
-            icons=['car-front', 'car-front'],
+            icons=['car-front', 'car-front', 'search', 'clock-history'],
             orientation='horizontal'
         )
         if vehicle_tab == "Checked-IN":
             st.subheader('Checked-In Vehicles')
-            checked_in_vehicles = self.vehicle_management.get_checked_in_vehicles()
-            self.display_vehicle_table(checked_in_vehicles)
+            self.display_vehicle_table('in')
         elif vehicle_tab == "Checked-OUT":
             st.subheader('Checked-Out Vehicles')
-            checked_out_vehicles = self.vehicle_management.get_checked_out_vehicles()
-            self.display_vehicle_table(checked_out_vehicles)
-
-    def display_vehicle_table(self, vehicles):
-        search_query = st.text_input("Search Vehicles")
-        if not vehicles.empty:
+            self.display_vehicle_table('out')
+        elif vehicle_tab == "Search":
+            st.subheader('Search Plates and Models')
+            search_query = st.text_input("Plate or model (partial matches allowed)")
             if search_query:
-                filtered_vehicles = vehicles[vehicles.apply(lambda row: search_query.lower() in row.to_string().lower(), axis=1)]
-                st.dataframe(filtered_vehicles, use_container_width=True)
-            else:
-                st.dataframe(vehicles, use_container_width=True)
+                results = self.vehicle_management.search(search_query, limit=50)
+                if results.empty:
+                    st.info("No matches found.")
+                else:
+                    st.dataframe(local_times(results), use_container_width=True)
+        elif vehicle_tab == "History":
+            st.subheader('Movement History')
+            plate = st.text_input("Plate prefix", key="history_plate").strip()
+            today = timeutil.to_local(timeutil.now()).date()
+            days = st.date_input("Checked in between", (today - timedelta(days=30), today), key="history_days")
+            if len(days) == 2:
+                start = timeutil.to_epoch(days[0])
+                end = timeutil.to_epoch(days[1] + timedelta(days=1))
+                history = self.vehicle_management.get_movement_history(plate, start, end, limit=HISTORY_LIMIT)
+                if history.empty:
+                    st.info("No movements found.")
+                else:
+                    self.show_table(history)
+                    st.caption(f"Newest {len(history)} movements, archived months included")
+
+    def display_vehicle_table(self, state):
+        self.display_paged_table(
+            f"vehicles_{state}", "Search Vehicles",
+            lambda plate: self.vehicle_management.count_movements(state, plate),
+            lambda plate, limit, offset: self.vehicle_management.query_movements(state, plate, limit=limit, offset=offset),
+            "No vehicles found."
+        )
+
+    def display_paged_table(self, key, search_label, count_rows, fetch_page, empty_message):
+        """Renders a plate search box and the visible page of matching rows; returns (search, page)."""
+        search_query = st.text_input(search_label, key=f"{key}_search").strip()
+        total = count_rows(search_query)
+        if not total:
+            st.info(empty_message)
+            return search_query, pd.DataFrame()
+
+        pages = (total - 1) // PAGE_SIZE + 1
+        page = 1
+        if pages > 1:
+            page = st.number_input(f"Page (1-{pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+        rows = fetch_page(search_query, PAGE_SIZE, (page - 1) * PAGE_SIZE)
+        self.show_table(rows)
+        st.caption(f"{total} matching rows")
+        return search_query, rows
+
+    def show_table(self, frame):
+        """Shows a table with local times and, for movements, a photo thumbnail column."""
+        frame = local_times(frame)
+        column_config = {}
+        if 'image_sha256' in frame:
+            thumbnails = frame.pop('image_sha256').map(self.vehicle_management.images.thumbnail_uri)
+            frame.insert(0, 'photo', thumbnails)
+            column_config['photo'] = st.column_config.ImageColumn('Photo')
+        st.dataframe(frame, column_config=column_config, use_container_width=True)
+
+    def display_reservation_table(self, key):
+        return self.display_paged_table(
+            key, "Search Reservations",
+            self.vehicle_management.count_reservations,
+            lambda plate, limit, offset: self.vehicle_management.query_reservations(plate, limit=limit, offset=offset),
+            "No reservations found."
+        )
+
+    def show_admin(self):
+        """Database instrumentation: statement latencies, slow queries, lock waits and method traces."""
+        db = self.vehicle_management.db
+        metrics = db.metrics
+        st.subheader('Database Performance')
+
+        left, middle, right = st.columns(3)
+        with left:
+            metrics.tracing = st.toggle("Trace VehicleManagement and StaffModel calls", value=metrics.tracing)
+        with middle:
+            threshold = st.number_input(
+                "Slow query threshold (ms)", min_value=1, value=int(metrics.slow_seconds * 1000), step=10
+            )
+            metrics.slow_seconds = threshold / 1000
+        with right:
+            if st.button("Reset statistics"):
+                metrics.reset()
+                db.cache.reset_stats()
+
+        snapshot = db.metrics_snapshot()
+        counters = snapshot['counters']
+        cache = snapshot['query_cache']
+        statements = pd.DataFrame.from_dict(snapshot['statements'], orient='index')
+        cards = [
+            ("Statements", int(statements['calls'].sum()) if len(statements) else 0),
+            ("Errors", int(statements['errors'].sum()) if len(statements) else 0),
+            ("Slow queries", counters['slow_queries']),
+            ("Write lock waits", f"{counters['lock_waits']} ({counters['lock_wait_seconds'] * 1000:.0f} ms)"),
+            ("Busy errors", counters['busy_errors']),
+            ("Query cache hit rate", f"{cache['hits'] / max(cache['hits'] + cache['misses'], 1):.0%}"),
+        ]
+        for row in (cards[:3], cards[3:]):
+            for col, (label, value) in zip(st.columns(3), row):
+                with col:
+                    st.markdown(f"<div class='metric-card'>{label}: {value}</div>", unsafe_allow_html=True)
+
+        st.markdown('<p class="big-font">Statements</p>', unsafe_allow_html=True)
+        if len(statements):
+            statements = statements.drop(columns='buckets').sort_values('total_seconds', ascending=False)
+            statements.index.name = 'statement'
+            st.dataframe(statements.head(ADMIN_ROWS).round(3), use_container_width=True)
+        else:
+            st.info("No statements recorded yet.")
+
+        st.markdown('<p class="big-font">Slow Queries</p>', unsafe_allow_html=True)
+        if snapshot['slow_queries']:
+            for entry in reversed(snapshot['slow_queries']):
+                with st.expander(f"{entry['ms']:.0f} ms, {entry['rows']} rows at {entry['time']}: {entry['statement'][:100]}"):
+                    st.code(entry['statement'], language='sql')
+                    st.caption(f"Parameters: {entry['params']}")
+                    st.code(entry['plan'], language='text')
         else:
-            st.info("No vehicles found.")
+            st.info("No statements over the threshold.")
+
+        st.markdown('<p class="big-font">Traced Calls</p>', unsafe_allow_html=True)
+        if snapshot['methods']:
+            methods = pd.DataFrame.from_dict(snapshot['methods'], orient='index').drop(columns=['buckets', 'rows'])
+            methods.index.name = 'method'
+            st.dataframe(methods.sort_values('total_seconds', ascending=False).round(3), use_container_width=True)
+            traces = pd.DataFrame(list(reversed(snapshot['traces']))[:ADMIN_ROWS])
+            traces['slowest'] = traces['slowest'].map(
+                lambda calls: '; '.join(f"{call['ms']:.1f} ms {call['statement'][:80]}" for call in calls)
+            )
+            st.dataframe(traces.round(3), use_container_width=True)
+        else:
+            st.info("Switch tracing on to time VehicleManagement and StaffModel calls.")
+
+        left, right = st.columns(2)
+        with left:
+            st.download_button(
+                "Download JSON", json.dumps(snapshot, indent=2), 'carpark-metrics.json', 'application/json'
+            )
+        with right:
+            st.download_button("Download Prometheus text", db.metrics_prometheus(), 'carpark-metrics.prom', 'text/plain')
 
     def check_in_out(self):
         check_expand = ['IN', 'OUT', 'Reserve']
@@ -360,38 +892,31 @@ class ParkingManagementApp:
 
         if check_tab == "IN":
             license_plate = st.text_input("License Plate:")
-            vehicle_type = st.selectbox("Vehicle Model:", [])  # Needs to be populated with models
+            vehicle_type = st.selectbox("Vehicle Model:", self.vehicle_management.get_vehicle_models())
             owner_gender = st.selectbox("Driver Gender:", ["Male", "Female"])
             passengers = st.selectbox("Passengers:", ["Y", "N"])
+            slot_type = st.selectbox("Slot Type:", SLOT_TYPES)
             vehicle_image = st.camera_input("Take a picture of the vehicle")
 
             if st.button('Check-IN'):
                 if license_plate and vehicle_type and owner_gender and vehicle_image:
-                    image_path = f"vehicle_images/{license_plate}.png"
-                    os.makedirs("vehicle_images", exist_ok=True)
-                    with open(image_path, "wb") as f:
-                        f.write(vehicle_image.getvalue())
-
-                    result = self.vehicle_management.insert_vehicle_and_checkin(license_plate, vehicle_type, owner_gender, passengers, image_path)
+                    # Encoded and written in the background; only the key is needed here
+                    image_sha256 = self.vehicle_management.images.put(vehicle_image.getvalue())
+                    result = self.vehicle_management.insert_vehicle_and_checkin(license_plate, vehicle_type, owner_gender, passengers, image_sha256, slot_type)
                     st.success(result)
                 else:
                     st.error('Please provide all required information.')
 
         elif check_tab == 'OUT':
             st.subheader('Checked-In Vehicles')
-            checked_in_vehicles = self.vehicle_management.get_checked_in_vehicles()
-
-            search_query = st.text_input("Search Checked-In Vehicles")
-
-            if not checked_in_vehicles.empty:
-                if search_query:
-                    filtered_vehicles = checked_in_vehicles[checked_in_vehicles.apply(lambda row: search_query.lower() in row.to_string().lower(), axis=1)]
-                    st.dataframe(filtered_vehicles, use_container_width=True)
-                    st.session_state['searched_vehicle'] = search_query
-                else:
-                    st.dataframe(checked_in_vehicles, use_container_width=True)
-            else:
-                st.info("No vehicles are currently checked in.")
+            search_query, _ = self.display_paged_table(
+                "checkout", "Search Checked-In Vehicles",
+                lambda plate: self.vehicle_management.count_movements('in', plate),
+                lambda plate, limit, offset: self.vehicle_management.query_movements('in', plate, limit=limit, offset=offset),
+                "No vehicles are currently checked in."
+            )
+            if search_query:
+                st.session_state['searched_vehicle'] = search_query
 
             if 'searched_vehicle' in st.session_state and st.session_state['searched_vehicle']:
                 if st.button('Checkout'):
@@ -405,55 +930,35 @@ class ParkingManagementApp:
 
             if reserve_tab == "Reservations":
                 st.subheader('All Reservations')
-                reservations = self.vehicle_management.get_all_reservations()
-
-                search_query = st.text_input("Search Reservations")
-
-                if not reservations.empty:
-                    if search_query:
-                        filtered_reservations = reservations[reservations.apply(lambda row: search_query.lower() in row.to_string().lower(), axis=1)]
-                        st.dataframe(filtered_reservations, use_container_width=True)
-                    else:
-                        st.dataframe(reservations, use_container_width=True)
-                else:
-                    st.info("No reservations found.")
+                self.display_reservation_table("reservations")
 
             elif reserve_tab == "Add":
                 st.subheader('Reserve Parking Slot')
-                available_slots = self.vehicle_management.get_available_slots()
+                reservation_license_plate = st.text_input('License Plate for Reservation')
+                reservation_start = st.date_input('Reservation Start Date')
+                reservation_start_time = st.time_input('Reservation Start Time')
+                reservation_end = st.date_input('Reservation End Date')
+                reservation_end_time = st.time_input('Reservation End Time')
+                start_datetime = timeutil.from_local(reservation_start, reservation_start_time)
+                end_datetime = timeutil.from_local(reservation_end, reservation_end_time)
+                available_slots = self.vehicle_management.get_available_slots(start_datetime, end_datetime)
 
                 if available_slots:
-                    reservation_license_plate = st.text_input('License Plate for Reservation')
-                    reservation_start = st.date_input('Reservation Start Date')
-                    reservation_start_time = st.time_input('Reservation Start Time')
-                    reservation_end = st.date_input('Reservation End Date')
-                    reservation_end_time = st.time_input('Reservation End Time')
                     slot_number = st.selectbox('Slot Number', available_slots)
 
                     if st.button('Add Reservation'):
-                        start_datetime = datetime.combine(reservation_start, reservation_start_time).strftime('%Y-%m-%d %H:%M:%S')
-                        end_datetime = datetime.combine(reservation_end, reservation_end_time).strftime('%Y-%m-%d %H:%M:%S')
                         result = self.vehicle_management.add_reservation(reservation_license_plate, start_datetime, end_datetime, slot_number)
                         st.success(result)
                 else:
-                    st.write("No available slots")
+                    st.write("No slots available for that time")
 
             elif reserve_tab == "Cancel":
                 st.subheader('Cancel Reservations')
-                reservations = self.vehicle_management.get_all_reservations()
-
-                search_query = st.text_input("Search Reservations")
-
-                if not reservations.empty:
-                    if search_query:
-                        filtered_reservations = reservations[reservations.apply(lambda row: search_query.lower() in row.to_string().lower(), axis=1)]
-                        st.dataframe(filtered_reservations, use_container_width=True)
-                        st.session_state['searched_vehicle'] = search_query
-                        st.session_state['slot_number'] = filtered_reservations.iloc[0]['slot_number']
-                    else:
-                        st.dataframe(reservations, use_container_width=True)
-                else:
-                    st.info("No reservations found.")
+                search_query, reservations = self.display_reservation_table("cancel")
+
+                if search_query and not reservations.empty:
+                    st.session_state['searched_vehicle'] = search_query
+                    st.session_state['slot_number'] = reservations.iloc[0]['slot_number']
 
                 if 'searched_vehicle' in st.session_state and st.session_state['searched_vehicle']:
                     if st.button('Cancel'):
@@ -464,7 +969,14 @@ class ParkingManagementApp:
                         st.session_state['searched_vehicle'] = None
 
 
+@st.cache_resource
+def get_database(db_file):
+    """One Database (and so one warm query cache) shared by every browser session."""
+    return Database(db_file)
+
+
 if __name__ == '__main__':
-    db = Database("car_park_management.db")
-    vehicle_mgmt = VehicleManagement(db)
+    db = get_database("car_park_management.db")
+    vehicle_mgmt = instrumentation.trace(VehicleManagement(db), db.metrics)
+    scheduler.start_scheduler(vehicle_mgmt)
     ParkingManagementApp(vehicle_mgmt)
@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+import time
+import queue
+from contextlib import contextmanager
+
+from instrumentation import InstrumentedConnection, QueryMetrics
+
+# Pragmas applied to every connection handed out by a pool. WAL lets the
+# dashboard keep reading while a gate clerk is writing; NORMAL sync is safe
+# under WAL and avoids an fsync on every commit.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,          # ~64 MB page cache per connection
+    'mmap_size': 268435456,        # 256 MB memory-mapped I/O
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,
+}
+
+
+class ConnectionPool:
+    """Process-wide set of SQLite connections for one database file.
+
+    All writes go through a single writer connection guarded by a lock, so
+    writers queue in Python instead of fighting over the file lock. Reads are
+    served from a small pool of reader connections that never block on the
+    writer thanks to WAL.
+
+    Every statement on the pool's connections is timed into `metrics`,
+    together with waits for the write lock and for a free reader.
+    """
+
+    def __init__(self, db_file, max_readers=4):
+        self.db_file = db_file
+        self.max_readers = max_readers
+        self.in_memory = db_file == ':memory:'
+        self._write_lock = threading.RLock()
+        self._depth = 0
+        self._owner = None
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+        self._closed = False
+        self.metrics = QueryMetrics()
+        self._writer = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_file, check_same_thread=False, isolation_level=None, factory=InstrumentedConnection
+        )
+        conn.metrics = self.metrics
+        for name, value in PRAGMAS.items():
+            if self.in_memory and name in ('journal_mode', 'mmap_size'):
+                continue
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Yields the writer connection inside an explicit write transaction.
+
+        Nested scopes on the same thread join the outermost transaction, which
+        commits on exit or rolls back if an exception escapes.
+        """
+        if not self._write_lock.acquire(blocking=False):
+            started = time.perf_counter()
+            self._write_lock.acquire()
+            self.metrics.lock_wait(time.perf_counter() - started)
+        try:
+            conn = self._writer
+            if self._depth:
+                self._depth += 1
+                try:
+                    yield conn
+                finally:
+                    self._depth -= 1
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            self._depth = 1
+            self._owner = threading.get_ident()
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+            finally:
+                self._depth = 0
+                self._owner = None
+        finally:
+            self._write_lock.release()
+
+    @contextmanager
+    def reader(self):
+        """Yields a read-only connection from the pool."""
+        if self.in_memory or self._owner == threading.get_ident():
+            # An in-memory database only exists on the writer connection, and a
+            # thread inside a transaction must see its own uncommitted writes.
+            with self._write_lock:
+                yield self._writer
+            return
+        conn = self._acquire_reader()
+        try:
+            yield conn
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                self._readers.put(conn)
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                return self._connect()
+        started = time.perf_counter()
+        conn = self._readers.get()
+        self.metrics.reader_wait(time.perf_counter() - started)
+        return conn
+
+    def close(self):
+        """Closes every idle connection; the pool must not be used afterwards."""
+        self._closed = True
+        with self._write_lock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_file):
+    """Returns the shared connection pool for db_file, creating it on first use."""
+    with _pools_lock:
+        pool = _pools.get(db_file)
+        if pool is None or pool._closed:
+            pool = ConnectionPool(db_file)
+            _pools[db_file] = pool
+        return pool
+
+
+def close_pool(db_file):
+    """Closes and forgets the shared pool for db_file, if any."""
+    with _pools_lock:
+        pool = _pools.pop(db_file, None)
+    if pool is not None:
+        pool.close()
@@ -0,0 +1,360 @@
+"""Headless gate event service.
+
+Gate devices POST movement events over HTTP; nothing waits on a Streamlit
+rerun. Requests are acknowledged once their events are committed to the
+gate_events queue table. Many concurrent requests share one commit: the
+writer takes everything that arrived while the previous commit ran, and
+waits up to `max_delay` for more. A consumer thread drains the queue in
+micro-batches through VehicleManagement.ingest_movements. Applying a batch
+and deleting it from the queue happen in one transaction, so events queued
+before a crash are applied exactly once on the next start. If a batch fails,
+its events are applied one at a time and any event that still fails is
+moved to gate_events_rejected, so one bad event cannot stall the queue.
+
+Endpoints:
+    POST /events   a JSON object, a JSON array or JSON Lines of events in the
+                   format ingest.py reads; an optional X-Gate-Device header
+                   names the sender. Events without a time get the time
+                   they were received. Answers 202 {"queued": n}, or 400
+                   naming the first malformed event, queueing none.
+    GET /stats     counters and queue depth as JSON
+    GET /health    {"status": "ok"}
+    GET /metrics   database statement timings in the Prometheus text format
+
+Usage: python gateway.py [--db FILE] [--host HOST] [--port PORT] [--batch-size N] [--max-delay-ms MS]
+"""
+import argparse
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import timeutil
+from ingest import normalize_event
+
+# Largest request body accepted, in bytes
+MAX_BODY = 4 * 1024 * 1024
+DEFAULT_PORT = 8600
+
+
+class GateService:
+    """Durable queue plus micro-batch consumer in front of one VehicleManagement."""
+
+    def __init__(self, vehicle_management, batch_size=1000, max_delay=0.002, apply_batch=2000):
+        self.vm = vehicle_management
+        self.pool = vehicle_management.db.pool
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.apply_batch = apply_batch
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.consumer = None
+        self.incoming = None
+        self.stats_data = {
+            'received': 0, 'queued': 0, 'applied': 0, 'rejected': 0, 'commits': 0, 'apply_batches': 0,
+            'max_commit_events': 0, 'last_apply_seconds': 0.0, 'started': time.time(),
+        }
+        self.outcomes = Counter()
+
+    # Queue side, on the event loop
+
+    async def enqueue(self, events, device=None):
+        """Queues events and returns once they are committed to gate_events.
+
+        Raises ValueError, before anything is queued, if any event is malformed.
+        """
+        received = timeutil.now()
+        rows = []
+        for index, event in enumerate(events):
+            event = validate_event(normalize_event(event), received, index)
+            rows.append((received, device, json.dumps(event)))
+        if not rows:
+            return 0
+        future = asyncio.get_running_loop().create_future()
+        await self.incoming.put((rows, future))
+        with self.lock:
+            self.stats_data['received'] += len(rows)
+        return await future
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.incoming.get()]
+            if self.max_delay and self.incoming.qsize() < self.batch_size:
+                await asyncio.sleep(self.max_delay)
+            count = len(batch[0][0])
+            while count < self.batch_size and not self.incoming.empty():
+                batch.append(self.incoming.get_nowait())
+                count += len(batch[-1][0])
+            try:
+                await loop.run_in_executor(None, self._persist, [row for rows, _ in batch for row in rows])
+            except Exception as e:
+                print(f"Error: could not queue {count} gate events: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for rows, future in batch:
+                # The request may have gone away (and cancelled its future) meanwhile
+                if not future.done():
+                    future.set_result(len(rows))
+
+    def _persist(self, rows):
+        with self.pool.transaction() as conn:
+            conn.executemany("INSERT INTO gate_events (received_on, device, payload) VALUES (?, ?, ?)", rows)
+        with self.lock:
+            self.stats_data['queued'] += len(rows)
+            self.stats_data['commits'] += 1
+            self.stats_data['max_commit_events'] = max(self.stats_data['max_commit_events'], len(rows))
+        self.wake.set()
+
+    # Consumer side, on its own thread
+
+    def start_consumer(self):
+        self.stopping.clear()
+        self.consumer = threading.Thread(target=self._consume, name='carpark-gate-consumer', daemon=True)
+        self.consumer.start()
+
+    def stop_consumer(self, timeout=30):
+        """Stops the consumer after it has applied everything already queued."""
+        self.stopping.set()
+        self.wake.set()
+        if self.consumer is not None:
+            self.consumer.join(timeout)
+
+    def _consume(self):
+        while True:
+            self.wake.wait(1.0)
+            self.wake.clear()
+            try:
+                while self.apply_pending():
+                    pass
+            except Exception as e:
+                print(f"Error: applying gate events failed: {e}")
+                time.sleep(1.0)
+                continue
+            if self.stopping.is_set():
+                return
+
+    def apply_pending(self):
+        """Applies one micro-batch from the queue; returns how many events it held.
+
+        If the batch fails, its events are retried one at a time and those that
+        still fail are moved to gate_events_rejected. sqlite3.OperationalError
+        (locked or unavailable database) is raised instead, to retry later.
+        """
+        started = time.perf_counter()
+        try:
+            count, outcomes = self._apply(self.apply_batch)
+        except sqlite3.OperationalError:
+            raise
+        except Exception as e:
+            print(f"Error: applying gate events failed, retrying one at a time: {e}")
+            # The rolled back batch may have updated the in-memory indexes
+            self.vm.occupancy.load()
+            self.vm.inventory.load()
+            count, outcomes = 0, Counter()
+            for _ in range(self.apply_batch):
+                try:
+                    applied, single = self._apply(1)
+                except sqlite3.OperationalError:
+                    raise
+                except Exception as e:
+                    applied, single = self._reject_next(e)
+                if not applied:
+                    break
+                count += applied
+                outcomes.update(single)
+            if outcomes['rejected']:
+                self.vm.occupancy.load()
+                self.vm.inventory.load()
+        if not count:
+            return 0
+        with self.lock:
+            self.outcomes.update(outcomes)
+            self.stats_data['applied'] += count - outcomes['rejected']
+            self.stats_data['rejected'] += outcomes['rejected']
+            self.stats_data['apply_batches'] += 1
+            self.stats_data['last_apply_seconds'] = time.perf_counter() - started
+        return count
+
+    def _apply(self, limit):
+        """Applies and dequeues up to `limit` events in one transaction; returns (count, outcomes)."""
+        with self.vm.db.transaction() as conn:
+            rows = conn.execute("SELECT id, payload FROM gate_events ORDER BY id LIMIT ?", (limit,)).fetchall()
+            if not rows:
+                return 0, Counter()
+            events = [json.loads(payload) for _, payload in rows]
+            # ingest_movements' own transactions join this one
+            outcomes = Counter(
+                outcome for _, _, _, outcome in self.vm.ingest_movements(events, chunk_size=len(events))
+            )
+            conn.execute("DELETE FROM gate_events WHERE id <= ?", (rows[-1][0],))
+        return len(rows), outcomes
+
+    def _reject_next(self, error):
+        """Moves the oldest queued event to gate_events_rejected; returns (count, outcomes)."""
+        with self.vm.db.transaction() as conn:
+            row = conn.execute(
+                """DELETE FROM gate_events WHERE id = (SELECT MIN(id) FROM gate_events)
+                   RETURNING id, received_on, device, payload"""
+            ).fetchone()
+            if row is None:
+                return 0, Counter()
+            conn.execute(
+                """INSERT INTO gate_events_rejected (id, received_on, device, payload, error, rejected_on)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (*row, f"{type(error).__name__}: {error}", timeutil.now())
+            )
+        print(f"Error: gate event {row[0]} rejected: {error}")
+        return 1, Counter({'rejected': 1})
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.stats_data, outcomes=dict(self.outcomes))
+        with self.pool.reader() as conn:
+            stats['queue_depth'] = conn.execute("SELECT COUNT(*) FROM gate_events").fetchone()[0]
+        stats['uptime_seconds'] = time.time() - stats.pop('started')
+        return stats
+
+    # HTTP
+
+    async def route(self, method, path, headers, body):
+        path = path.split('?', 1)[0]
+        if method == 'POST' and path == '/events':
+            try:
+                events = parse_events(body)
+            except ValueError as e:
+                return '400 Bad Request', {'error': str(e)}
+            try:
+                queued = await self.enqueue(events, headers.get('x-gate-device'))
+            except ValueError as e:
+                return '400 Bad Request', {'error': str(e)}
+            except sqlite3.Error as e:
+                return '503 Service Unavailable', {'error': str(e)}
+            except Exception as e:
+                print(f"Error: could not queue gate events: {e}")
+                return '500 Internal Server Error', {'error': str(e)}
+            return '202 Accepted', {'queued': queued}
+        if method == 'GET' and path == '/stats':
+            try:
+                return '200 OK', await asyncio.get_running_loop().run_in_executor(None, self.stats)
+            except sqlite3.Error as e:
+                return '503 Service Unavailable', {'error': str(e)}
+            except Exception as e:
+                print(f"Error: could not read gateway stats: {e}")
+                return '500 Internal Server Error', {'error': str(e)}
+        if method == 'GET' and path == '/metrics':
+            return '200 OK', self.vm.db.metrics_prometheus()
+        if method == 'GET' and path == '/health':
+            return '200 OK', {'status': 'ok'}
+        return '404 Not Found', {'error': f"No route for {method} {path}"}
+
+    async def handle(self, reader, writer):
+        """Serves HTTP/1.1 requests on one keep-alive connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY:
+                    status, payload = '413 Payload Too Large', {'error': f"Body over {MAX_BODY} bytes"}
+                    headers['connection'] = 'close'
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.route(method.upper(), path, headers, body)
+                if isinstance(payload, str):
+                    data, content_type = payload.encode(), 'text/plain; version=0.0.4'
+                else:
+                    data, content_type = json.dumps(payload).encode(), 'application/json'
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, ready=None):
+        """Runs the HTTP endpoint and consumer until cancelled."""
+        self.incoming = asyncio.Queue()
+        self.start_consumer()
+        writer_task = asyncio.create_task(self._writer())
+        server = await asyncio.start_server(self.handle, host, port)
+        if ready is not None:
+            ready(server.sockets[0].getsockname())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            self.stop_consumer()
+
+
+def validate_event(event, received, index):
+    """A normalized event ready to queue, with its time as epoch seconds; raises ValueError if malformed."""
+    if event['event'] not in ('in', 'out'):
+        raise ValueError(f"Event {index}: 'event' must be 'in' or 'out'")
+    if not event['license_plate']:
+        raise ValueError(f"Event {index}: 'license_plate' is missing or not text")
+    try:
+        event['time'] = timeutil.to_epoch(event['time']) if event['time'] else received
+    except (TypeError, ValueError, OverflowError) as e:
+        raise ValueError(f"Event {index}: bad 'time': {e}")
+    return event
+
+
+def parse_events(body):
+    """Events from a JSON object, a JSON array or JSON Lines."""
+    text = body.decode('utf-8').strip()
+    if not text:
+        return []
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        try:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Body is not JSON or JSON Lines: {e}")
+    events = parsed if isinstance(parsed, list) else [parsed]
+    if not all(isinstance(event, dict) for event in events):
+        raise ValueError("Each event must be a JSON object")
+    return events
+
+
+def main():
+    from carpark import Database, VehicleManagement
+
+    parser = argparse.ArgumentParser(description="Accept gate movement events over HTTP.")
+    parser.add_argument('--db', default='car_park_management.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--batch-size', type=int, default=1000, help="most events per queue commit")
+    parser.add_argument('--max-delay-ms', type=float, default=2.0, help="longest wait to fill a queue commit")
+    args = parser.parse_args()
+
+    service = GateService(VehicleManagement(Database(args.db)), args.batch_size, args.max_delay_ms / 1000)
+    try:
+        asyncio.run(service.serve(args.host, args.port, lambda address: print(f"Listening on {address[0]}:{address[1]}")))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Content-addressed store for vehicle check-in photos.
+
+A capture is keyed by the SHA-256 of the uploaded bytes, so the key is known
+before anything is written and a repeated capture is stored once. Encoding
+runs on a small worker pool off the request thread: the image is re-encoded
+to WebP (JPEG where Pillow lacks WebP) with its longest side capped at
+MAX_SIDE, and a THUMBNAIL_SIZE thumbnail is written next to it. Files are
+sharded by hash prefix, e.g. ab/cd/abcd...webp and abcd..._thumb.webp.
+
+The images table holds one row per stored image; movements reference it by
+VehicleMovements.image_sha256. collect() deletes images not used by a
+check-in for IMAGE_RETENTION_DAYS, and captures whose encoding never
+finished, clearing the references to them.
+
+Usage: python images.py [db_file] [--retention-days N]
+"""
+import argparse
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+import timeutil
+
+IMAGE_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+EXTENSIONS = {'WEBP': '.webp', 'JPEG': '.jpg'}
+MAX_SIDE = 1600
+THUMBNAIL_SIZE = (160, 120)
+QUALITY = 80
+THUMBNAIL_QUALITY = 60
+IMAGE_RETENTION_DAYS = 180
+# Captures not stored within this many seconds are treated as failed
+PENDING_GRACE = 24 * 3600
+WORKERS = 2
+# Thumbnail data URIs kept in memory, most recently shown first (~7 KB each)
+THUMBNAIL_CACHE_SIZE = 1024
+
+
+class ImageStore:
+    """Stores photos under `root` and records them in the images table."""
+
+    def __init__(self, pool, root=None, thumbnail_cache_size=THUMBNAIL_CACHE_SIZE):
+        self.pool = pool
+        if root is None:
+            base = '' if pool.in_memory else os.path.dirname(os.path.abspath(pool.db_file))
+            root = os.path.join(base, 'vehicle_images')
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='carpark-images')
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.thumbnails = OrderedDict()
+        self.thumbnail_cache_size = thumbnail_cache_size
+
+    def path(self, sha256, image_format=IMAGE_FORMAT, thumbnail=False):
+        suffix = '_thumb' if thumbnail else ''
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256 + suffix + EXTENSIONS[image_format])
+
+    def put(self, data):
+        """Queues raw image bytes for encoding and returns their key straight away."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if sha256 not in self.pending:
+                self.pending[sha256] = self.executor.submit(self._store, sha256, data)
+        return sha256
+
+    def wait(self, timeout=None):
+        """Blocks until every queued image has been written."""
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            future.result(timeout)
+
+    def _store(self, sha256, data):
+        try:
+            path = self.path(sha256)
+            if not os.path.exists(path):
+                with Image.open(io.BytesIO(data)) as source:
+                    image = ImageOps.exif_transpose(source).convert('RGB')
+                image.thumbnail((MAX_SIDE, MAX_SIDE))
+                width, height = image.size
+                self._write(path, image, QUALITY)
+                image.thumbnail(THUMBNAIL_SIZE)
+                self._write(self.path(sha256, thumbnail=True), image, THUMBNAIL_QUALITY)
+            else:
+                with Image.open(path) as stored:
+                    width, height = stored.size
+            with self.pool.transaction() as conn:
+                conn.execute(
+                    """INSERT INTO images (sha256, format, width, height, bytes, source_bytes, stored_on, last_used)
+                       VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?7)
+                       ON CONFLICT (sha256) DO UPDATE SET
+                           format = excluded.format, width = excluded.width, height = excluded.height,
+                           bytes = excluded.bytes, source_bytes = excluded.source_bytes,
+                           stored_on = excluded.stored_on""",
+                    (sha256, IMAGE_FORMAT, width, height, os.path.getsize(path), len(data), timeutil.now())
+                )
+        except Exception as e:
+            print(f"Error: could not store image {sha256}: {e}")
+        finally:
+            with self.lock:
+                self.pending.pop(sha256, None)
+
+    def _write(self, path, image, quality):
+        # Written under a temporary name so readers never see a partial file
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + '.tmp'
+        image.save(temporary, IMAGE_FORMAT, quality=quality)
+        os.replace(temporary, path)
+
+    def link(self, conn, sha256, used_at):
+        """Records a check-in's use of an image; called inside its transaction."""
+        conn.execute(
+            """INSERT INTO images (sha256, last_used) VALUES (?, ?)
+               ON CONFLICT (sha256) DO UPDATE SET last_used = MAX(last_used, excluded.last_used)""",
+            (sha256, used_at)
+        )
+
+    def thumbnail_uri(self, sha256):
+        """data: URI of the image's thumbnail for table cells, or None while it is not written."""
+        if not sha256:
+            return None
+        with self.lock:
+            uri = self.thumbnails.get(sha256)
+            if uri is not None:
+                self.thumbnails.move_to_end(sha256)
+        if uri is None:
+            path = self.path(sha256, thumbnail=True)
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return None
+            # Content never changes under a key, so hits stay valid until evicted
+            mime = 'image/webp' if IMAGE_FORMAT == 'WEBP' else 'image/jpeg'
+            uri = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+            with self.lock:
+                self.thumbnails[sha256] = uri
+                while len(self.thumbnails) > self.thumbnail_cache_size:
+                    self.thumbnails.popitem(last=False)
+        return uri
+
+    def collect(self, retention_days=IMAGE_RETENTION_DAYS, now=None):
+        """Deletes images unused for `retention_days` and failed captures; returns how many went."""
+        now = timeutil.now() if now is None else now
+        params = (now - retention_days * 86400, now - PENDING_GRACE)
+        expired = "last_used < ?1 OR (stored_on IS NULL AND last_used < ?2)"
+        with self.pool.transaction() as conn:
+            conn.execute(
+                f"""UPDATE VehicleMovements SET image_sha256 = NULL
+                    WHERE image_sha256 IN (SELECT sha256 FROM images WHERE {expired})""",
+                params
+            )
+            removed = conn.execute(f"DELETE FROM images WHERE {expired} RETURNING sha256, format", params).fetchall()
+        for sha256, image_format in removed:
+            with self.lock:
+                self.thumbnails.pop(sha256, None)
+            for thumbnail in (False, True):
+                try:
+                    os.remove(self.path(sha256, image_format or IMAGE_FORMAT, thumbnail))
+                except OSError:
+                    pass
+        return len(removed)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(pool):
+    """Returns the process-wide image store (and its worker pool) for the pool's database."""
+    with _stores_lock:
+        store = _stores.get(pool.db_file)
+        if store is None or store.pool is not pool:
+            store = ImageStore(pool)
+            _stores[pool.db_file] = store
+        return store
+
+
+def main():
+    from connection import get_pool
+    import migrations
+
+    parser = argparse.ArgumentParser(description="Delete vehicle images past their retention.")
+    parser.add_argument('db_file', nargs='?', default='car_park_management.db')
+    parser.add_argument('--retention-days', type=int, default=IMAGE_RETENTION_DAYS)
+    args = parser.parse_args()
+
+    pool = get_pool(args.db_file)
+    migrations.bootstrap(pool)
+    print(f"Deleted {get_store(pool).collect(args.retention_days)} images.")
+
+
+if __name__ == '__main__':
+    main()
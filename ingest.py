@@ -0,0 +1,90 @@
+"""Bulk import of gate camera (ANPR) movement logs.
+
+Reads CSV or JSON Lines files of entry/exit events and applies them through
+VehicleManagement.ingest_movements in chunked transactions.
+
+Usage: python ingest.py LOG [LOG ...] [--db FILE] [--chunk-size N] [--rejects FILE]
+
+Each record needs `event` (in/out, entry/exit or checkin/checkout) and
+`license_plate`; `time` (local 'YYYY-MM-DD HH:MM:SS' or epoch seconds),
+`vehicle_type`, `owner_gender` and `passengers` are optional.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+from collections import Counter
+
+from carpark import Database, VehicleManagement, event_text
+
+EVENT_ALIASES = {
+    'in': 'in', 'entry': 'in', 'checkin': 'in', 'check-in': 'in',
+    'out': 'out', 'exit': 'out', 'checkout': 'out', 'check-out': 'out',
+}
+
+
+def normalize_event(record):
+    """Maps a raw log record onto the event dict ingest_movements expects.
+
+    Text fields are coerced to str (numeric plates included); values of any
+    other type become None, so the event is reported as invalid downstream.
+    """
+    kind = (event_text(record.get('event')) or '').lower()
+    return {
+        'event': EVENT_ALIASES.get(kind, kind),
+        'license_plate': event_text(record.get('license_plate')) or event_text(record.get('plate')),
+        'time': record.get('time') or record.get('timestamp') or None,
+        'vehicle_type': event_text(record.get('vehicle_type')),
+        'owner_gender': event_text(record.get('owner_gender')),
+        'passengers': event_text(record.get('passengers')),
+    }
+
+
+def read_events(path):
+    """Yields normalized events from a .csv or .jsonl file, streaming."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            yield normalize_event(record)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import gate movement logs into the car park database.")
+    parser.add_argument('logs', nargs='+', help="CSV or JSONL files, applied in the given order")
+    parser.add_argument('--db', default='car_park_management.db')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--rejects', help="write events that were not applied to this CSV file")
+    args = parser.parse_args()
+
+    vehicle_mgmt = VehicleManagement(Database(args.db))
+    events = (event for path in args.logs for event in read_events(path))
+
+    totals = Counter()
+    rejects_file = open(args.rejects, 'w', newline='') if args.rejects else None
+    rejects = csv.writer(rejects_file) if rejects_file else None
+    if rejects:
+        rejects.writerow(['index', 'license_plate', 'event', 'outcome'])
+
+    started = time.perf_counter()
+    try:
+        for outcome in vehicle_mgmt.ingest_movements(events, chunk_size=args.chunk_size, reload=True):
+            totals[outcome[3]] += 1
+            if rejects and outcome[3] not in ('checked in', 'checked out'):
+                rejects.writerow(outcome)
+    finally:
+        if rejects_file:
+            rejects_file.close()
+    elapsed = time.perf_counter() - started
+
+    processed = sum(totals.values())
+    for outcome, count in totals.most_common():
+        print(f"{outcome:<20} {count}")
+    print(f"{processed} events in {elapsed:.1f}s ({processed / max(elapsed, 1e-9):.0f} events/s)", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,417 @@
+"""Query and method instrumentation for the car park database.
+
+Every connection a ConnectionPool hands out is an InstrumentedConnection.
+Each statement is timed from execute() through its first fetch, so reads
+include the time to fetch their rows. Timings are recorded in the pool's
+QueryMetrics, per normalized statement:
+- a latency histogram (Prometheus-style cumulative buckets);
+- call, row and error counts;
+- for statements slower than `slow_seconds`, an entry in the slow-query
+  log with the EXPLAIN QUERY PLAN output.
+The pool adds waits for the write lock, busy database errors and waits for
+a free reader connection.
+
+trace() wraps the public methods of an object such as VehicleManagement or
+StaffModel. While tracing is switched on (CARPARK_TRACE=1, or from the admin
+panel), each call is timed with the
+statements it ran, and the most recent calls are kept as traces.
+
+Both views export as JSON (snapshot) or Prometheus text (prometheus).
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import timeutil
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_QUERY_SECONDS = 0.1
+SLOW_LOG_SIZE = 100
+TRACE_LOG_SIZE = 200
+# Query plans are captured again for a statement after this many seconds
+PLAN_TTL = 300
+STATEMENT_LABEL_LENGTH = 160
+# Distinct statements tracked; later ones share the '(other)' entry
+MAX_STATEMENTS = 2000
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """One-line form of a statement, used as its metrics key."""
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total', 'max', 'rows', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.errors = 0
+
+    def observe(self, seconds, rows=0):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+
+    def quantile(self, q):
+        """Estimate of the q-quantile in seconds, interpolated within its bucket."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = BUCKETS[i - 1] if i else 0.0
+                high = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(low + (high - low) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def as_dict(self):
+        return {
+            'calls': self.count,
+            'rows': self.rows,
+            'errors': self.errors,
+            'total_seconds': self.total,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.quantile(0.5) * 1000,
+            'p95_ms': self.quantile(0.95) * 1000,
+            'max_ms': self.max * 1000,
+            'buckets': dict(zip([str(b) for b in BUCKETS] + ['+Inf'], self.counts)),
+        }
+
+
+class QueryMetrics:
+    """Per-statement and per-method timings for one database, shared by its pool's connections."""
+
+    def __init__(self, slow_seconds=SLOW_QUERY_SECONDS):
+        self.slow_seconds = slow_seconds
+        self.tracing = os.environ.get('CARPARK_TRACE') == '1'
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.statements = {}
+            self.methods = {}
+            self.slow_log = deque(maxlen=SLOW_LOG_SIZE)
+            self.traces = deque(maxlen=TRACE_LOG_SIZE)
+            self.plans = {}
+            self.counters = {
+                'lock_waits': 0, 'lock_wait_seconds': 0.0, 'busy_errors': 0,
+                'reader_waits': 0, 'reader_wait_seconds': 0.0, 'slow_queries': 0,
+            }
+
+    def record(self, conn, sql, params, seconds, rows, error=None):
+        key = normalize_sql(sql)
+        with self.lock:
+            histogram = self.statements.get(key)
+            if histogram is None:
+                if len(self.statements) >= MAX_STATEMENTS:
+                    key = '(other)'
+                histogram = self.statements.setdefault(key, Histogram())
+            if error is None:
+                histogram.observe(seconds, rows)
+            else:
+                histogram.errors += 1
+                if isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error)):
+                    self.counters['busy_errors'] += 1
+        calls = getattr(self.local, 'calls', None)
+        if calls:
+            calls[-1].append((key, seconds))
+        if seconds >= self.slow_seconds and error is None:
+            self._log_slow(conn, key, sql, params, seconds, rows)
+
+    def _log_slow(self, conn, key, sql, params, seconds, rows):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.plans.get(key)
+        if cached is None or now - cached[0] > PLAN_TTL:
+            try:
+                # A plain cursor, so the plan query is not recorded itself
+                plan_rows = sqlite3.Connection.cursor(conn).execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                plan = '\n'.join(f"{'  ' * depth(plan_rows, row)}{row[3]}" for row in plan_rows)
+            except (sqlite3.Error, ValueError) as e:
+                plan = f"(no plan: {e})"
+            cached = (now, plan)
+        with self.lock:
+            self.plans[key] = cached
+            self.counters['slow_queries'] += 1
+            self.slow_log.append({
+                'time': timeutil.format_local(timeutil.now()),
+                'statement': key,
+                'params': repr(params)[:200],
+                'ms': seconds * 1000,
+                'rows': rows,
+                'plan': cached[1],
+            })
+
+    def lock_wait(self, seconds):
+        with self.lock:
+            self.counters['lock_waits'] += 1
+            self.counters['lock_wait_seconds'] += seconds
+
+    def reader_wait(self, seconds):
+        with self.lock:
+            self.counters['reader_waits'] += 1
+            self.counters['reader_wait_seconds'] += seconds
+
+    def record_call(self, name, seconds, calls, error=None):
+        with self.lock:
+            histogram = self.methods.get(name)
+            if histogram is None:
+                histogram = self.methods[name] = Histogram()
+            if error is None:
+                histogram.observe(seconds)
+            else:
+                histogram.errors += 1
+            slowest = sorted(calls, key=lambda call: call[1], reverse=True)[:5]
+            self.traces.append({
+                'time': timeutil.format_local(timeutil.now()),
+                'method': name,
+                'ms': seconds * 1000,
+                'queries': len(calls),
+                'query_ms': sum(call[1] for call in calls) * 1000,
+                'slowest': [{'statement': key, 'ms': s * 1000} for key, s in slowest],
+                'error': None if error is None else repr(error),
+            })
+
+    def snapshot(self, cache=None):
+        """Everything recorded, as plain JSON-serializable data."""
+        with self.lock:
+            snapshot = {
+                'counters': dict(self.counters),
+                'slow_seconds': self.slow_seconds,
+                'tracing': self.tracing,
+                'statements': {key: h.as_dict() for key, h in self.statements.items()},
+                'methods': {name: h.as_dict() for name, h in self.methods.items()},
+                'slow_queries': list(self.slow_log),
+                'traces': list(self.traces),
+            }
+        if cache is not None:
+            snapshot['query_cache'] = cache.stats()
+        return snapshot
+
+    def prometheus(self, cache=None):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def histograms(name, help_text, label, items):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, h in items:
+                value = label_value(key)
+                cumulative = 0
+                for bound, count in zip([str(b) for b in BUCKETS] + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {h.total}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {h.count}')
+
+        def counter(name, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{labels} {value}" for labels, value in samples)
+
+        with self.lock:
+            statements = sorted(self.statements.items())
+            methods = sorted(self.methods.items())
+            histograms('carpark_query_duration_seconds', 'SQL statement latency, execute to first fetch.',
+                       'statement', statements)
+            counter('carpark_query_rows_total', 'Rows returned or changed by SQL statements.',
+                    [(f'{{statement="{label_value(key)}"}}', h.rows) for key, h in statements])
+            counter('carpark_query_errors_total', 'Failed SQL statements.',
+                    [(f'{{statement="{label_value(key)}"}}', h.errors) for key, h in statements])
+            histograms('carpark_method_duration_seconds', 'Traced method latency.', 'method', methods)
+            counter('carpark_db_lock_waits_total', 'Write transactions that waited for the write lock.',
+                    [('', self.counters['lock_waits'])])
+            counter('carpark_db_lock_wait_seconds_total', 'Time spent waiting for the write lock.',
+                    [('', self.counters['lock_wait_seconds'])])
+            counter('carpark_db_busy_errors_total', 'Statements that failed with a locked or busy database.',
+                    [('', self.counters['busy_errors'])])
+            counter('carpark_db_reader_waits_total', 'Reads that waited for a free reader connection.',
+                    [('', self.counters['reader_waits'])])
+            counter('carpark_slow_queries_total', 'Statements slower than the slow-query threshold.',
+                    [('', self.counters['slow_queries'])])
+        if cache is not None:
+            for name, value in cache.stats().items():
+                kind = 'gauge' if name == 'entries' else 'counter'
+                metric = f"carpark_query_cache_{name}" + ('' if kind == 'gauge' else '_total')
+                lines.append(f"# TYPE {metric} {kind}")
+                lines.append(f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def depth(plan_rows, row):
+    """Nesting level of an EXPLAIN QUERY PLAN row (id, parent, notused, detail)."""
+    parents = {r[0]: r[1] for r in plan_rows}
+    level, parent = 0, row[1]
+    while parent in parents:
+        level += 1
+        parent = parents[parent]
+    return level
+
+
+def label_value(text):
+    text = text[:STATEMENT_LABEL_LENGTH]
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that reports each statement's time and rows to its connection's metrics."""
+
+    pending = None
+
+    def execute(self, sql, parameters=()):
+        self._flush()
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except Exception as e:
+            self.connection.metrics.record(self.connection, sql, parameters, time.perf_counter() - started, 0, e)
+            raise
+        self._executed(sql, parameters, started)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._flush()
+        started = time.perf_counter()
+        try:
+            super().executemany(sql, seq_of_parameters)
+        except Exception as e:
+            self.connection.metrics.record(self.connection, sql, (), time.perf_counter() - started, 0, e)
+            raise
+        self.connection.metrics.record(self.connection, sql, (), time.perf_counter() - started, max(self.rowcount, 0))
+        return self
+
+    def _executed(self, sql, parameters, started):
+        if self.description is None:
+            self.connection.metrics.record(
+                self.connection, sql, parameters, time.perf_counter() - started, max(self.rowcount, 0)
+            )
+        else:
+            # Reads are recorded at their first fetch, with its time and rows
+            self.pending = (sql, parameters, time.perf_counter() - started)
+
+    def _flush(self, fetch_seconds=0.0, rows=0):
+        if self.pending is not None:
+            sql, parameters, seconds = self.pending
+            self.pending = None
+            self.connection.metrics.record(self.connection, sql, parameters, seconds + fetch_seconds, rows)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._flush(time.perf_counter() - started, len(rows))
+        return rows
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._flush(time.perf_counter() - started, len(rows))
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._flush(time.perf_counter() - started, row is not None)
+        return row
+
+    def __iter__(self):
+        self._flush()
+        return super().__iter__()
+
+    def close(self):
+        self._flush()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors are timed; `metrics` is set by the pool."""
+
+    metrics = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def trace(obj, metrics, methods=None):
+    """Wraps the public methods of `obj` (an instance) to time them while metrics.tracing is on.
+
+    Traced names are qualified by the class, e.g. 'VehicleManagement.search'.
+    Generator methods are timed until they are exhausted. Returns `obj`.
+    """
+    cls = type(obj).__name__
+    names = methods or [name for name in dir(type(obj)) if not name.startswith('_')]
+    for name in names:
+        method = getattr(obj, name, None)
+        if not callable(method) or getattr(method, 'traced', False):
+            continue
+        setattr(obj, name, _traced(method, f"{cls}.{name}", metrics))
+    return obj
+
+
+def _traced(method, name, metrics):
+    import inspect
+
+    if inspect.isgeneratorfunction(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if not metrics.tracing:
+                yield from method(*args, **kwargs)
+                return
+            with _Call(metrics, name):
+                yield from method(*args, **kwargs)
+    else:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            if not metrics.tracing:
+                return method(*args, **kwargs)
+            with _Call(metrics, name):
+                return method(*args, **kwargs)
+    wrapper.traced = True
+    return wrapper
+
+
+class _Call:
+    """Times one traced call and collects the statements it runs on this thread."""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(self.metrics.local, 'calls', None)
+        if stack is None:
+            stack = self.metrics.local.calls = []
+        stack.append([])
+        self.started = time.perf_counter()
+
+    def __exit__(self, kind, error, tb):
+        seconds = time.perf_counter() - self.started
+        calls = self.metrics.local.calls.pop()
+        # Statements also count towards the enclosing traced call
+        if self.metrics.local.calls:
+            self.metrics.local.calls[-1].extend(calls)
+        self.metrics.record_call(self.name, seconds, calls, error)
+        return False
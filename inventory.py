@@ -0,0 +1,131 @@
+import threading
+import time
+
+import numpy as np
+
+# Slot types a vehicle may use, in order of preference
+SLOT_FALLBACKS = {
+    'standard': ('standard',),
+    'ev': ('ev', 'standard'),
+    'disabled': ('disabled', 'standard'),
+    'motorbike': ('motorbike',),
+}
+
+
+class SlotInventory:
+    """Every bay of every site as NumPy arrays, for allocation without SQL scans.
+
+    Bays are held sorted by exit distance, so the best free bay of a type is
+    the first True in a boolean mask. Per-zone occupancy is a bincount over
+    the taken bays. Like the occupancy index it is shared per process, kept
+    current write-through and reloaded after `max_age` seconds; the unique
+    index on open sessions per slot catches races with other processes.
+    """
+
+    def __init__(self, pool, max_age=60):
+        self.pool = pool
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """Rebuilds the arrays from ParkingSlots, zones and open sessions."""
+        with self.pool.reader() as conn:
+            slots = conn.execute(
+                """SELECT s.slot_number, s.slot_type, COALESCE(s.zone_id, 0), s.exit_distance,
+                          s.status IN ('available', 'reserved') AND m.id IS NULL
+                   FROM ParkingSlots s
+                   LEFT JOIN VehicleMovements m ON m.slot_number = s.slot_number AND m.state = 'in'
+                   ORDER BY s.exit_distance, s.slot_number"""
+            ).fetchall()
+            zones = conn.execute("SELECT id, site, level, name, capacity FROM zones").fetchall()
+
+        type_names = sorted({row[1] for row in slots} | set(SLOT_FALLBACKS))
+        with self.lock:
+            self.type_codes = {name: code for code, name in enumerate(type_names)}
+            self.numbers = np.array([row[0] for row in slots], dtype=np.int64)
+            self.types = np.array([self.type_codes[row[1]] for row in slots], dtype=np.int16)
+            self.zone_ids = np.array([row[2] for row in slots], dtype=np.int64)
+            self.free = np.array([bool(row[4]) for row in slots], dtype=bool)
+            self.position = {int(number): i for i, number in enumerate(self.numbers)}
+            self.zones = {zone[0]: zone[1:] for zone in zones}
+            size = max([int(self.zone_ids.max(initial=0))] + list(self.zones)) + 1
+            self.zone_capacity = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+            for zone_id, (_, _, _, capacity) in self.zones.items():
+                if capacity is not None:
+                    self.zone_capacity[zone_id] = capacity
+            self.loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    def _zone_taken(self):
+        return np.bincount(self.zone_ids[~self.free], minlength=len(self.zone_capacity))
+
+    def allocate(self, slot_type='standard', zone_id=None, blocked=()):
+        """Takes the free bay nearest the exit for the slot type and returns its number, or None.
+
+        Falls back along SLOT_FALLBACKS, skips zones at capacity and any slot
+        numbers in `blocked`. Bays marked 'reserved' count as free here, so
+        callers block the ones reserved for someone else.
+        """
+        with self.lock:
+            self._fresh()
+            open_zones = self._zone_taken() < self.zone_capacity
+            candidates = self.free & open_zones[self.zone_ids]
+            if zone_id is not None:
+                candidates &= self.zone_ids == zone_id
+            if blocked:
+                candidates &= ~np.isin(self.numbers, np.fromiter(blocked, dtype=np.int64))
+            for name in SLOT_FALLBACKS.get(slot_type, (slot_type,)):
+                code = self.type_codes.get(name)
+                if code is None:
+                    continue
+                matches = np.flatnonzero(candidates & (self.types == code))
+                if matches.size:
+                    self.free[matches[0]] = False
+                    return int(self.numbers[matches[0]])
+            return None
+
+    def claim(self, slot_number):
+        """Takes a specific bay (a reserved one); returns False if it is not free."""
+        with self.lock:
+            self._fresh()
+            i = self.position.get(slot_number)
+            if i is None or not self.free[i]:
+                return False
+            self.free[i] = False
+            return True
+
+    def release(self, slot_number):
+        with self.lock:
+            i = self.position.get(slot_number)
+            if i is not None:
+                self.free[i] = True
+
+    def zone_usage(self):
+        """Rows of (site, level, zone, slots, occupied, capacity) per zone."""
+        with self.lock:
+            self._fresh()
+            taken = self._zone_taken()
+            bays = np.bincount(self.zone_ids, minlength=len(self.zone_capacity))
+            return [
+                (site, level, name, int(bays[zone_id]), int(taken[zone_id]),
+                 capacity if capacity is not None else int(bays[zone_id]))
+                for zone_id, (site, level, name, capacity) in sorted(self.zones.items())
+            ]
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_inventory(pool):
+    """Returns the process-wide slot inventory for the pool's database."""
+    with _inventories_lock:
+        inventory = _inventories.get(pool.db_file)
+        if inventory is None or inventory.pool is not pool:
+            inventory = SlotInventory(pool)
+            _inventories[pool.db_file] = inventory
+        return inventory
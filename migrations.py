@@ -0,0 +1,806 @@
+"""Versioned schema migrations for the car park database.
+
+Each migration runs once per database, in version order, inside its own
+transaction. Applied versions are recorded in the schema_version table, so
+existing databases are upgraded in place. Reference data (car models,
+parking slots) is seeded by a migration too, which keeps app start-up free
+of DDL and inserts once a database is current.
+
+Usage: python migrations.py [db_file] [--status]
+"""
+import argparse
+import sqlite3
+import threading
+from connection import get_pool
+import timeutil
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Registers the decorated function as schema migration `version`."""
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+
+@migration(1, 'Base schema')
+def base_schema(c):
+    # Create Vehicles table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Vehicles (
+        id INTEGER PRIMARY KEY,
+        license_plate TEXT UNIQUE,
+        vehicle_type TEXT
+    )
+    ''')
+
+    # Create VehicleMovements table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS VehicleMovements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        license_plate TEXT,
+        owner_gender TEXT,
+        checked_in BOOLEAN DEFAULT FALSE,
+        checked_out BOOLEAN DEFAULT FALSE,
+        checkin_time TEXT,
+        checkout_time TEXT,
+        passengers TEXT,
+        FOREIGN KEY (license_plate) REFERENCES Vehicles(license_plate)
+    )
+    ''')
+
+    # Create Transactions table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vehicle_id INTEGER NOT NULL,
+        slot_id INTEGER NOT NULL,
+        entry_time TEXT NOT NULL,
+        exit_time TEXT,
+        FOREIGN KEY (vehicle_id) REFERENCES Vehicles (id),
+        FOREIGN KEY (slot_id) REFERENCES ParkingSlots (id)
+    )
+    ''')
+
+    # Create Users table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        role TEXT NOT NULL
+    )
+    ''')
+
+    # Create Payments table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        transaction_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        payment_time TEXT NOT NULL,
+        FOREIGN KEY (transaction_id) REFERENCES Transactions (id)
+    )
+    ''')
+
+    # Create Car Models table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS car_models (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        brand TEXT NOT NULL,
+        model TEXT NOT NULL
+    )
+    ''')
+
+    # Create Reservations table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS Reservations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        license_plate TEXT NOT NULL,
+        reservation_start TIMESTAMP NOT NULL,
+        reservation_end TIMESTAMP NOT NULL,
+        slot_number INTEGER NOT NULL,
+        reserved_on TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'active'
+    )
+    ''')
+
+    # Create Parking Slots table
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS ParkingSlots (
+        slot_number INTEGER PRIMARY KEY,
+        status TEXT DEFAULT 'available'
+    )
+    ''')
+
+
+@migration(2, 'Movement state column and lookup indexes')
+def movement_state(c):
+    # A single state column ('in' or 'out') replaces the checked_in/checked_out
+    # pair in queries. The boolean columns are still written for old readers.
+    c.execute("ALTER TABLE VehicleMovements ADD COLUMN state TEXT")
+    c.execute('''
+    UPDATE VehicleMovements
+    SET state = CASE WHEN checked_in AND NOT checked_out THEN 'in' ELSE 'out' END
+    ''')
+
+    # Active sessions by plate: tiny partial index used by check-in/check-out
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movements_active_plate
+    ON VehicleMovements (license_plate) WHERE state = 'in'
+    ''')
+
+    # Listing current and past sessions in time order
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movements_state_checkin
+    ON VehicleMovements (state, checkin_time)
+    ''')
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movements_closed_checkout
+    ON VehicleMovements (checkout_time) WHERE state = 'out'
+    ''')
+
+    # History of one plate
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movements_plate_checkin
+    ON VehicleMovements (license_plate, checkin_time)
+    ''')
+
+    # Active reservation lookups by plate
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reservations_plate_status
+    ON Reservations (license_plate, status)
+    ''')
+
+
+@migration(3, 'Unique car models and parking slot seed data')
+def seed_reference_data(c):
+    import models
+    import slots
+
+    # Earlier versions re-seeded car_models on every app start
+    c.execute('''
+    DELETE FROM car_models
+    WHERE id NOT IN (SELECT MIN(id) FROM car_models GROUP BY brand, model)
+    ''')
+    c.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_car_models_brand_model
+    ON car_models (brand, model)
+    ''')
+    models.seed_car_models(c)
+    slots.seed_parking_slots(c, range(1, slots.DEFAULT_SLOT_COUNT + 1))
+
+
+@migration(4, 'Staff tables')
+def staff_tables(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS staff (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        employee_id TEXT,
+        contact_info TEXT
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS staff_allocation (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        staff_id INTEGER,
+        role TEXT,
+        shift TEXT,
+        shift_date DATE,
+        start_time DATETIME,
+        end_time DATETIME,
+        allocation_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (staff_id) REFERENCES staff(id)
+    )
+    ''')
+
+
+@migration(5, 'Plate prefix search indexes')
+def plate_search_indexes(c):
+    # Case-insensitive plate prefix search is a range scan on upper(license_plate)
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movements_state_plate
+    ON VehicleMovements (state, upper(license_plate))
+    ''')
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reservations_plate
+    ON Reservations (upper(license_plate))
+    ''')
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reservations_start
+    ON Reservations (reservation_start)
+    ''')
+
+
+# SQL twin of carpark.normalize_plate, applied when rows are indexed
+NORMALIZE_PLATE_SQL = "upper(replace(replace(coalesce({0}, ''), ' ', ''), '-', ''))"
+
+# search_index rowids encode the source row: rowid = source id * 4 + kind
+SEARCH_SOURCES = [
+    # (kind, table, indexed plate, indexed body, columns that feed the index)
+    (0, 'VehicleMovements', '{row}.license_plate', "''", 'license_plate'),
+    (1, 'Vehicles', '{row}.license_plate', '{row}.vehicle_type', 'license_plate, vehicle_type'),
+    (2, 'Reservations', '{row}.license_plate', "''", 'license_plate'),
+    (3, 'car_models', "''", '{row}.brand || {row}.model', 'brand, model'),
+]
+
+
+@migration(6, 'Full-text trigram search index')
+def search_index(c):
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index
+    USING fts5(plate, body, tokenize = 'trigram')
+    ''')
+    for kind, table, plate, body, columns in SEARCH_SOURCES:
+        def values(row):
+            return ", ".join([
+                f"{row}.id * 4 + {kind}",
+                NORMALIZE_PLATE_SQL.format(plate.format(row=row)),
+                NORMALIZE_PLATE_SQL.format(body.format(row=row)),
+            ])
+
+        c.execute(f"INSERT INTO search_index (rowid, plate, body) SELECT {values(table)} FROM {table}")
+        c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_search_insert AFTER INSERT ON {table}
+        BEGIN
+            INSERT INTO search_index (rowid, plate, body) VALUES ({values('new')});
+        END
+        ''')
+        c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_search_update AFTER UPDATE OF {columns} ON {table}
+        BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 4 + {kind};
+            INSERT INTO search_index (rowid, plate, body) VALUES ({values('new')});
+        END
+        ''')
+        c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_search_delete AFTER DELETE ON {table}
+        BEGIN
+            DELETE FROM search_index WHERE rowid = old.id * 4 + {kind};
+        END
+        ''')
+
+
+# Seconds between two 'YYYY-MM-DD HH:MM:SS' columns, never negative
+DWELL_SQL = "MAX(0, COALESCE(strftime('%s', {1}) - strftime('%s', {0}), 0))"
+
+
+@migration(7, 'Movement summary tables')
+def movement_summary(c):
+    # Running totals; a single row so the dashboard reads it in one lookup
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS movement_stats (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        checked_in INTEGER NOT NULL DEFAULT 0,
+        checked_out INTEGER NOT NULL DEFAULT 0,
+        dwell_seconds INTEGER NOT NULL DEFAULT 0,
+        reservations INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    # Entries and exits per calendar day (the day part of the stored local time)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS daily_movement_stats (
+        day TEXT PRIMARY KEY,
+        entries INTEGER NOT NULL DEFAULT 0,
+        exits INTEGER NOT NULL DEFAULT 0,
+        dwell_seconds INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+    dwell = DWELL_SQL.format('checkin_time', 'checkout_time')
+    c.execute(f'''
+    INSERT INTO movement_stats (id, checked_in, checked_out, dwell_seconds, reservations)
+    SELECT 1,
+           COALESCE(SUM(state = 'in'), 0),
+           COALESCE(SUM(state = 'out'), 0),
+           COALESCE(SUM(CASE WHEN state = 'out' THEN {dwell} ELSE 0 END), 0),
+           (SELECT COUNT(*) FROM Reservations)
+    FROM VehicleMovements
+    ''')
+    c.execute('''
+    INSERT INTO daily_movement_stats (day, entries)
+    SELECT date(checkin_time), COUNT(*) FROM VehicleMovements
+    WHERE checkin_time IS NOT NULL GROUP BY 1
+    ''')
+    c.execute(f'''
+    INSERT INTO daily_movement_stats (day, exits, dwell_seconds)
+    SELECT date(checkout_time), COUNT(*), SUM({dwell}) FROM VehicleMovements
+    WHERE state = 'out' AND checkout_time IS NOT NULL GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET exits = excluded.exits, dwell_seconds = excluded.dwell_seconds
+    ''')
+
+    new_dwell = DWELL_SQL.format('new.checkin_time', 'new.checkout_time')
+    record_exit = f'''
+            UPDATE movement_stats
+            SET checked_out = checked_out + 1, dwell_seconds = dwell_seconds + {new_dwell}
+            WHERE id = 1;
+            INSERT INTO daily_movement_stats (day, exits, dwell_seconds)
+            VALUES (date(new.checkout_time), 1, {new_dwell})
+            ON CONFLICT (day) DO UPDATE SET exits = exits + 1, dwell_seconds = dwell_seconds + excluded.dwell_seconds;
+    '''
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_movements_stats_entry AFTER INSERT ON VehicleMovements
+    BEGIN
+        UPDATE movement_stats SET checked_in = checked_in + (new.state = 'in') WHERE id = 1;
+        INSERT INTO daily_movement_stats (day, entries) VALUES (date(new.checkin_time), 1)
+        ON CONFLICT (day) DO UPDATE SET entries = entries + 1;
+    END
+    ''')
+    # Rows inserted already closed (imports, backfills) count as an exit too
+    c.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_movements_stats_closed_insert AFTER INSERT ON VehicleMovements
+    WHEN new.state = 'out'
+    BEGIN
+        {record_exit}
+    END
+    ''')
+    c.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_movements_stats_exit AFTER UPDATE OF state ON VehicleMovements
+    WHEN old.state = 'in' AND new.state = 'out'
+    BEGIN
+        UPDATE movement_stats SET checked_in = checked_in - 1 WHERE id = 1;
+        {record_exit}
+    END
+    ''')
+    # Closed movements keep counting towards history when they are deleted
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_movements_stats_delete AFTER DELETE ON VehicleMovements
+    WHEN old.state = 'in'
+    BEGIN
+        UPDATE movement_stats SET checked_in = checked_in - 1 WHERE id = 1;
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_reservations_stats AFTER INSERT ON Reservations
+    BEGIN
+        UPDATE movement_stats SET reservations = reservations + 1 WHERE id = 1;
+    END
+    ''')
+
+
+@migration(8, 'One open session per plate')
+def unique_open_session(c):
+    # Close all but the newest open session of plates checked in twice by racing terminals
+    c.execute('''
+    UPDATE VehicleMovements
+    SET state = 'out', checked_in = FALSE, checked_out = TRUE, checkout_time = checkin_time
+    WHERE state = 'in' AND id NOT IN (
+        SELECT MAX(id) FROM VehicleMovements WHERE state = 'in' GROUP BY license_plate
+    )
+    ''')
+    c.execute("DROP INDEX IF EXISTS idx_movements_active_plate")
+    c.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_movements_open_plate
+    ON VehicleMovements (license_plate) WHERE state = 'in'
+    ''')
+
+
+@migration(9, 'Reservation time windows')
+def reservation_windows(c):
+    # Expiry scans active reservations by end time
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_reservations_status_end
+    ON Reservations (status, reservation_end)
+    ''')
+
+    # (slot, time) R*Tree of active reservations for logarithmic overlap queries
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS reservation_windows
+    USING rtree_i32(id, slot_lo, slot_hi, start_ts, end_ts)
+    ''')
+    window = "{0}.id, {0}.slot_number, {0}.slot_number, " \
+             "CAST(strftime('%s', {0}.reservation_start) AS INTEGER), " \
+             "CAST(strftime('%s', {0}.reservation_end) AS INTEGER)"
+    c.execute(f'''
+    INSERT INTO reservation_windows (id, slot_lo, slot_hi, start_ts, end_ts)
+    SELECT {window.format('Reservations')} FROM Reservations WHERE status = 'active'
+    ''')
+    c.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_reservations_window_insert AFTER INSERT ON Reservations
+    WHEN new.status = 'active'
+    BEGIN
+        INSERT INTO reservation_windows (id, slot_lo, slot_hi, start_ts, end_ts) VALUES ({window.format('new')});
+    END
+    ''')
+    c.execute(f'''
+    CREATE TRIGGER IF NOT EXISTS trg_reservations_window_update
+    AFTER UPDATE OF status, slot_number, reservation_start, reservation_end ON Reservations
+    BEGIN
+        DELETE FROM reservation_windows WHERE id = old.id;
+        INSERT INTO reservation_windows (id, slot_lo, slot_hi, start_ts, end_ts)
+        SELECT {window.format('new')} WHERE new.status = 'active';
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS trg_reservations_window_delete AFTER DELETE ON Reservations
+    BEGIN
+        DELETE FROM reservation_windows WHERE id = old.id;
+    END
+    ''')
+
+    # Reservations used to mark their slot 'occupied' indefinitely; availability
+    # is now decided per time window, so release those slots.
+    c.execute("UPDATE ParkingSlots SET status = 'available' WHERE status = 'occupied'")
+
+
+@migration(10, 'Zones, slot types and slot allocation')
+def slot_inventory(c):
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS zones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        site TEXT NOT NULL DEFAULT 'main',
+        level INTEGER NOT NULL DEFAULT 0,
+        name TEXT NOT NULL,
+        capacity INTEGER,
+        UNIQUE (site, level, name)
+    )
+    ''')
+    # slot_type: 'standard', 'ev', 'disabled' or 'motorbike'. exit_distance
+    # orders bays for the allocator; lower is closer to the exit.
+    c.execute("ALTER TABLE ParkingSlots ADD COLUMN zone_id INTEGER REFERENCES zones (id)")
+    c.execute("ALTER TABLE ParkingSlots ADD COLUMN slot_type TEXT NOT NULL DEFAULT 'standard'")
+    c.execute("ALTER TABLE ParkingSlots ADD COLUMN exit_distance REAL NOT NULL DEFAULT 0")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_slots_zone ON ParkingSlots (zone_id)")
+
+    # Existing flat slots become zone A of the main site. A NULL capacity
+    # means the zone may fill all of its bays.
+    c.execute("INSERT INTO zones (site, level, name) VALUES ('main', 0, 'A')")
+    c.execute('''
+    UPDATE ParkingSlots SET zone_id = last_insert_rowid(), exit_distance = slot_number
+    ''')
+
+    # The bay a session was allocated; one open session per bay
+    c.execute("ALTER TABLE VehicleMovements ADD COLUMN slot_number INTEGER")
+    c.execute('''
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_movements_open_slot
+    ON VehicleMovements (slot_number) WHERE state = 'in' AND slot_number IS NOT NULL
+    ''')
+
+
+# Upper bounds (seconds) of the dwell histogram buckets; longer stays fall in the last bucket
+DWELL_BUCKET_EDGES = (900, 1800, 3600, 7200, 14400, 28800, 86400)
+HOUR_SQL = "strftime('%Y-%m-%d %H:00', {0})"
+
+
+def dwell_bucket_sql(dwell):
+    cases = ' '.join(f"WHEN {dwell} < {edge} THEN {i}" for i, edge in enumerate(DWELL_BUCKET_EDGES))
+    return f"CASE {cases} ELSE {len(DWELL_BUCKET_EDGES)} END"
+
+
+def create_movement_stats_triggers(c, day, hour, dwell):
+    """(Re)creates the triggers behind movement_stats and the daily and hourly rollups.
+
+    `day` and `hour` are SQL templates for the local day and hour of a time
+    column ({0}); `dwell` gives the seconds between two of them ({0}, {1}).
+    One trigger body updates movement_stats first and then the rollups, so
+    its checked_in counter is the current occupancy.
+    """
+    for trigger in ('entry', 'closed_insert', 'exit'):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_movements_stats_{trigger}")
+
+    new_dwell = dwell.format('new.checkin_time', 'new.checkout_time')
+    occupancy = "(SELECT checked_in FROM movement_stats WHERE id = 1)"
+
+    def record_exit(occupancy_before):
+        return f'''
+            UPDATE movement_stats
+            SET checked_out = checked_out + 1, dwell_seconds = dwell_seconds + {new_dwell}
+            WHERE id = 1;
+            INSERT INTO daily_movement_stats (day, exits, dwell_seconds)
+            VALUES ({day.format('new.checkout_time')}, 1, {new_dwell})
+            ON CONFLICT (day) DO UPDATE SET exits = exits + 1, dwell_seconds = dwell_seconds + excluded.dwell_seconds;
+            INSERT INTO hourly_movement_stats (hour, exits, dwell_seconds, peak_occupancy, closing_occupancy)
+            VALUES ({hour.format('new.checkout_time')}, 1, {new_dwell}, {occupancy_before}, {occupancy})
+            ON CONFLICT (hour) DO UPDATE SET
+                exits = exits + 1,
+                dwell_seconds = dwell_seconds + excluded.dwell_seconds,
+                closing_occupancy = excluded.closing_occupancy;
+            INSERT INTO dwell_histogram (day, bucket, exits)
+            VALUES ({day.format('new.checkout_time')}, {dwell_bucket_sql(new_dwell)}, 1)
+            ON CONFLICT (day, bucket) DO UPDATE SET exits = exits + 1;
+        '''
+
+    c.execute(f'''
+    CREATE TRIGGER trg_movements_stats_entry AFTER INSERT ON VehicleMovements
+    BEGIN
+        UPDATE movement_stats SET checked_in = checked_in + (new.state = 'in') WHERE id = 1;
+        INSERT INTO daily_movement_stats (day, entries) VALUES ({day.format('new.checkin_time')}, 1)
+        ON CONFLICT (day) DO UPDATE SET entries = entries + 1;
+        INSERT INTO hourly_movement_stats
+            (hour, entries, male_entries, female_entries, passenger_entries, peak_occupancy, closing_occupancy)
+        VALUES ({hour.format('new.checkin_time')}, 1, new.owner_gender IS 'Male', new.owner_gender IS 'Female',
+                new.passengers IS 'Y', {occupancy}, {occupancy})
+        ON CONFLICT (hour) DO UPDATE SET
+            entries = entries + 1,
+            male_entries = male_entries + excluded.male_entries,
+            female_entries = female_entries + excluded.female_entries,
+            passenger_entries = passenger_entries + excluded.passenger_entries,
+            peak_occupancy = MAX(peak_occupancy, excluded.peak_occupancy),
+            closing_occupancy = excluded.closing_occupancy;
+    END
+    ''')
+    # Rows inserted already closed (hand-made backfills) count as an exit
+    # too; they never changed the occupancy. Gate ingest always inserts
+    # movements open and closes them with an UPDATE, so it does not get here.
+    # Use analytics.py --rebuild after such backfills to recompute occupancy.
+    c.execute(f'''
+    CREATE TRIGGER trg_movements_stats_closed_insert AFTER INSERT ON VehicleMovements
+    WHEN new.state = 'out'
+    BEGIN
+        {record_exit(occupancy)}
+    END
+    ''')
+    c.execute(f'''
+    CREATE TRIGGER trg_movements_stats_exit AFTER UPDATE OF state ON VehicleMovements
+    WHEN old.state = 'in' AND new.state = 'out'
+    BEGIN
+        UPDATE movement_stats SET checked_in = checked_in - 1 WHERE id = 1;
+        {record_exit(occupancy + ' + 1')}
+    END
+    ''')
+
+
+@migration(11, 'Hourly movement rollups and dwell histogram')
+def movement_rollups(c):
+    # One row per hour with movement activity. Occupancy is the number of
+    # open sessions: its maximum within the hour, and its value after the
+    # hour's last movement (carried forward through quiet hours).
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS hourly_movement_stats (
+        hour TEXT PRIMARY KEY,
+        entries INTEGER NOT NULL DEFAULT 0,
+        exits INTEGER NOT NULL DEFAULT 0,
+        dwell_seconds INTEGER NOT NULL DEFAULT 0,
+        male_entries INTEGER NOT NULL DEFAULT 0,
+        female_entries INTEGER NOT NULL DEFAULT 0,
+        passenger_entries INTEGER NOT NULL DEFAULT 0,
+        peak_occupancy INTEGER NOT NULL DEFAULT 0,
+        closing_occupancy INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS dwell_histogram (
+        day TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        exits INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, bucket)
+    ) WITHOUT ROWID
+    ''')
+    # Backfilled by migration 12, once movement times are epoch seconds
+    create_movement_stats_triggers(c, 'date({0})', HOUR_SQL, DWELL_SQL)
+
+
+# Local-time TEXT columns converted to epoch seconds by migration 12:
+# (table, column, SQL giving the epoch value from the old row)
+EPOCH_COLUMNS = [
+    ('VehicleMovements', 'checkin_time', 'local_epoch(checkin_time)'),
+    ('VehicleMovements', 'checkout_time', 'local_epoch(checkout_time)'),
+    ('Reservations', 'reservation_start', 'local_epoch(reservation_start)'),
+    ('Reservations', 'reservation_end', 'local_epoch(reservation_end)'),
+    # Defaulted to SQLite's CURRENT_TIMESTAMP, which is UTC
+    ('Reservations', 'reserved_on', "CAST(strftime('%s', reserved_on) AS INTEGER)"),
+    ('staff_allocation', 'start_time', "local_epoch(shift_date || ' ' || start_time)"),
+    ('staff_allocation', 'end_time', "local_epoch(shift_date || ' ' || end_time)"),
+    ('staff_allocation', 'allocation_time', "CAST(strftime('%s', allocation_time) AS INTEGER)"),
+]
+EPOCH_DWELL_SQL = "MAX(0, COALESCE({1} - {0}, 0))"
+
+
+@migration(12, 'Epoch UTC timestamps')
+def epoch_timestamps(c):
+    import analytics
+
+    c.connection.create_function('local_epoch', 1, timeutil.local_text_to_epoch, deterministic=True)
+
+    # Indexes and triggers that read the old columns block DROP COLUMN; they
+    # are recreated on the new ones below.
+    for index in ('idx_movements_state_checkin', 'idx_movements_closed_checkout', 'idx_movements_plate_checkin',
+                  'idx_reservations_start', 'idx_reservations_status_end'):
+        c.execute(f"DROP INDEX IF EXISTS {index}")
+    for trigger in ('trg_movements_stats_entry', 'trg_movements_stats_closed_insert', 'trg_movements_stats_exit',
+                    'trg_reservations_window_insert', 'trg_reservations_window_update'):
+        c.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+    # Same column names, now INTEGER epoch seconds
+    for table, column, epoch in EPOCH_COLUMNS:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column}_epoch INTEGER")
+        c.execute(f"UPDATE {table} SET {column}_epoch = {epoch}")
+        c.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+        c.execute(f"ALTER TABLE {table} RENAME COLUMN {column}_epoch TO {column}")
+    # Shifts ending past midnight end on the next day
+    c.execute("UPDATE staff_allocation SET end_time = end_time + 86400 WHERE end_time < start_time")
+
+    c.execute("CREATE INDEX idx_movements_state_checkin ON VehicleMovements (state, checkin_time)")
+    c.execute("CREATE INDEX idx_movements_closed_checkout ON VehicleMovements (checkout_time) WHERE state = 'out'")
+    c.execute("CREATE INDEX idx_movements_plate_checkin ON VehicleMovements (license_plate, checkin_time)")
+    c.execute("CREATE INDEX idx_movements_checkin ON VehicleMovements (checkin_time)")
+    c.execute("CREATE INDEX idx_reservations_start ON Reservations (reservation_start)")
+    c.execute("CREATE INDEX idx_reservations_status_end ON Reservations (status, reservation_end)")
+    c.execute("CREATE INDEX idx_staff_allocation_start ON staff_allocation (start_time)")
+
+    # Reservation windows hold the epoch times themselves
+    c.execute("DELETE FROM reservation_windows")
+    c.execute('''
+    INSERT INTO reservation_windows (id, slot_lo, slot_hi, start_ts, end_ts)
+    SELECT id, slot_number, slot_number, reservation_start, reservation_end FROM Reservations WHERE status = 'active'
+    ''')
+    window = "{0}.id, {0}.slot_number, {0}.slot_number, {0}.reservation_start, {0}.reservation_end"
+    c.execute(f'''
+    CREATE TRIGGER trg_reservations_window_insert AFTER INSERT ON Reservations
+    WHEN new.status = 'active'
+    BEGIN
+        INSERT INTO reservation_windows (id, slot_lo, slot_hi, start_ts, end_ts) VALUES ({window.format('new')});
+    END
+    ''')
+    c.execute(f'''
+    CREATE TRIGGER trg_reservations_window_update
+    AFTER UPDATE OF status, slot_number, reservation_start, reservation_end ON Reservations
+    BEGIN
+        DELETE FROM reservation_windows WHERE id = old.id;
+        INSERT INTO reservation_windows (id, slot_lo, slot_hi, start_ts, end_ts)
+        SELECT {window.format('new')} WHERE new.status = 'active';
+    END
+    ''')
+
+    create_movement_stats_triggers(
+        c, timeutil.local_date_sql('{0}'), timeutil.local_hour_sql('{0}'), EPOCH_DWELL_SQL
+    )
+    analytics.rebuild_rollups(c)
+
+
+@migration(13, 'Movement archive catalog')
+def movement_archive(c):
+    # One row per archived month of check-ins; see archive.py
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS movement_archive (
+        month TEXT PRIMARY KEY,
+        storage TEXT NOT NULL CHECK (storage IN ('table', 'sqlite', 'parquet')),
+        location TEXT NOT NULL,
+        row_count INTEGER NOT NULL DEFAULT 0,
+        first_checkin INTEGER,
+        last_checkin INTEGER,
+        last_checkout INTEGER,
+        archived_on INTEGER
+    )
+    ''')
+
+
+@migration(14, 'Vehicle image store')
+def image_store(c):
+    # One row per stored photo, keyed by the SHA-256 of the capture; see images.py
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS images (
+        sha256 TEXT PRIMARY KEY,
+        format TEXT,
+        width INTEGER,
+        height INTEGER,
+        bytes INTEGER,
+        source_bytes INTEGER,
+        stored_on INTEGER,
+        last_used INTEGER
+    ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_images_last_used ON images (last_used)")
+    c.execute("ALTER TABLE VehicleMovements ADD COLUMN image_sha256 TEXT")
+    c.execute('''
+    CREATE INDEX IF NOT EXISTS idx_movements_image ON VehicleMovements (image_sha256)
+    WHERE image_sha256 IS NOT NULL
+    ''')
+    # Archived partitions in the main database get the column too
+    for (table,) in c.execute("SELECT location FROM movement_archive WHERE storage = 'table'").fetchall():
+        c.execute(f"ALTER TABLE {table} ADD COLUMN image_sha256 TEXT")
+
+
+@migration(15, 'Gate event queue')
+def gate_event_queue(c):
+    # Events accepted by gateway.py and not yet applied, in arrival order
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS gate_events (
+        id INTEGER PRIMARY KEY,
+        received_on INTEGER NOT NULL,
+        device TEXT,
+        payload TEXT NOT NULL
+    )
+    ''')
+
+
+@migration(16, 'Rejected gate events')
+def rejected_gate_events(c):
+    # Queued events that failed to apply, set aside so later events still drain
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS gate_events_rejected (
+        id INTEGER PRIMARY KEY,
+        received_on INTEGER NOT NULL,
+        device TEXT,
+        payload TEXT NOT NULL,
+        error TEXT,
+        rejected_on INTEGER NOT NULL
+    )
+    ''')
+
+
+def latest_version():
+    return MIGRATIONS[-1][0]
+
+
+def applied_version(pool):
+    """Reads the schema version without taking the write lock."""
+    with pool.reader() as conn:
+        try:
+            return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+        except sqlite3.OperationalError:
+            return 0
+
+
+def current_version(conn):
+    """Returns the highest applied migration version (0 for a new database)."""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_on TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(pool):
+    """Applies every pending migration and returns the list of versions applied."""
+    applied = []
+    if applied_version(pool) >= latest_version():
+        return applied
+    for version, description, func in MIGRATIONS:
+        with pool.transaction() as conn:
+            if version <= current_version(conn):
+                continue
+            func(conn.cursor())
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+        applied.append(version)
+    return applied
+
+
+_bootstrapped = set()
+_bootstrap_lock = threading.Lock()
+
+
+def bootstrap(pool):
+    """Brings the database up to date once per process.
+
+    Streamlit re-runs the app script on every interaction; after the first
+    call for a database file this returns without touching SQLite at all.
+    """
+    if pool.db_file in _bootstrapped:
+        return
+    with _bootstrap_lock:
+        if pool.db_file not in _bootstrapped:
+            migrate(pool)
+            _bootstrapped.add(pool.db_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending car park schema migrations.")
+    parser.add_argument('db_file', nargs='?', default='car_park_management.db')
+    parser.add_argument('--status', action='store_true', help="only list applied and pending migrations")
+    args = parser.parse_args()
+
+    pool = get_pool(args.db_file)
+    if not args.status:
+        for version in migrate(pool):
+            print(f"Applied migration {version}")
+
+    with pool.transaction() as conn:
+        version = current_version(conn)
+    for number, description, _ in MIGRATIONS:
+        state = 'applied' if number <= version else 'pending'
+        print(f"{number:>4}  {state:<8} {description}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,6 @@
-import sqlite3
+import argparse
+from connection import get_pool
+import migrations
 
 # List of car models
 car_models = [
@@ -106,24 +108,27 @@ car_models = [
     ('Tesla', 'Cybertruck')
 ]
 
-# Connect to SQLite database (or create it if it doesn't exist)
-conn = sqlite3.connect('car_park_management.db')
-c = conn.cursor()
 
-# Create table
-c.execute('''
-CREATE TABLE IF NOT EXISTS car_models (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    brand TEXT NOT NULL,
-    model TEXT NOT NULL
-)
-''')
+def seed_car_models(conn, rows=None):
+    """Inserts car models that are not present yet; safe to run repeatedly."""
+    cur = conn.executemany(
+        'INSERT INTO car_models (brand, model) VALUES (?, ?) ON CONFLICT (brand, model) DO NOTHING',
+        rows or car_models
+    )
+    return cur.rowcount
 
-# Insert car models into the table
-c.executemany('INSERT INTO car_models (brand, model) VALUES (?, ?)', car_models)
 
-# Commit the changes and close the connection
-conn.commit()
-conn.close()
+def main():
+    parser = argparse.ArgumentParser(description="Seed the car_models table.")
+    parser.add_argument('db_file', nargs='?', default='car_park_management.db')
+    args = parser.parse_args()
 
-print("Car models table created and populated successfully.")
+    pool = get_pool(args.db_file)
+    migrations.bootstrap(pool)
+    with pool.transaction() as conn:
+        added = seed_car_models(conn)
+    print(f"Car models table up to date ({added} new models added).")
+
+
+if __name__ == '__main__':
+    main()
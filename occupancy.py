@@ -0,0 +1,162 @@
+import threading
+import time
+
+
+class OccupancyIndex:
+    """In-process view of live car park state, shared by every Streamlit session.
+
+    Holds the active session per plate, a bitmap of taken slots, active
+    reservations per plate and running counters. It is loaded from SQLite once
+    and then kept current write-through by VehicleManagement. Writes made by
+    other processes show up after at most `max_age` seconds, when the index
+    reloads itself.
+    """
+
+    def __init__(self, pool, max_age=60):
+        self.pool = pool
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """Rebuilds the index from the database."""
+        with self.pool.reader() as conn:
+            sessions = {
+                plate: {'id': movement_id, 'checkin_time': checkin_time}
+                for movement_id, plate, checkin_time in conn.execute(
+                    "SELECT id, license_plate, checkin_time FROM VehicleMovements WHERE state = 'in'"
+                )
+            }
+            checked_out, reservations = conn.execute(
+                "SELECT checked_out, reservations FROM movement_stats WHERE id = 1"
+            ).fetchone() or (0, 0)
+            reserved = {
+                plate: (slot_number, start, end)
+                for plate, slot_number, start, end in conn.execute(
+                    "SELECT license_plate, slot_number, reservation_start, reservation_end "
+                    "FROM Reservations WHERE status = 'active'"
+                )
+            }
+            slots = conn.execute("SELECT slot_number, status FROM ParkingSlots").fetchall()
+
+        occupied = 0
+        for slot_number, status in slots:
+            if status != 'available':
+                occupied |= 1 << slot_number
+        with self.lock:
+            self.sessions = sessions
+            self.reserved = reserved
+            self.slot_numbers = sorted(slot_number for slot_number, _ in slots)
+            self.occupied_slots = occupied
+            self.checked_out_count = checked_out
+            self.reservation_count = reservations
+            self.loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    @property
+    def checked_in_count(self):
+        with self.lock:
+            self._fresh()
+            return len(self.sessions)
+
+    def is_checked_in(self, license_plate):
+        with self.lock:
+            self._fresh()
+            return license_plate in self.sessions
+
+    def refresh_plate(self, license_plate):
+        """Re-reads the plate's open session from the database; returns whether it is checked in.
+
+        Other processes (the gateway, ingest) write without telling this
+        index, so a hit is only a hint until confirmed here.
+        """
+        with self.pool.reader() as conn:
+            row = conn.execute(
+                "SELECT id, checkin_time FROM VehicleMovements WHERE license_plate = ? AND state = 'in'",
+                (license_plate,)
+            ).fetchone()
+        with self.lock:
+            if row is None:
+                self.sessions.pop(license_plate, None)
+            else:
+                self.sessions[license_plate] = {'id': row[0], 'checkin_time': row[1]}
+        return row is not None
+
+    def has_active_reservation(self, license_plate):
+        with self.lock:
+            self._fresh()
+            return license_plate in self.reserved
+
+    def reserved_slot(self, license_plate, at):
+        """Slot of the plate's active reservation if its window covers epoch `at`, else None."""
+        with self.lock:
+            self._fresh()
+            reservation = self.reserved.get(license_plate)
+        if reservation is None:
+            return None
+        slot_number, start, end = reservation
+        return slot_number if start <= at < end else None
+
+    def is_slot_available(self, slot_number):
+        with self.lock:
+            self._fresh()
+            return slot_number in self.slot_numbers and not self.occupied_slots >> slot_number & 1
+
+    def available_slots(self):
+        with self.lock:
+            self._fresh()
+            return [n for n in self.slot_numbers if not self.occupied_slots >> n & 1]
+
+    def checked_in(self, license_plate, movement_id, checkin_time):
+        with self.lock:
+            self.sessions[license_plate] = {'id': movement_id, 'checkin_time': checkin_time}
+
+    def checked_out(self, license_plate):
+        with self.lock:
+            if self.sessions.pop(license_plate, None) is not None:
+                self.checked_out_count += 1
+
+    def sessions_changed(self, plates, open_sessions, checkouts):
+        """Applies an ingest chunk: each of `plates` is checked in iff it is in
+        `open_sessions` (plate -> (id, checkin_time)), after `checkouts` check-outs."""
+        with self.lock:
+            for plate in plates:
+                session = open_sessions.get(plate)
+                if session is None:
+                    self.sessions.pop(plate, None)
+                else:
+                    self.sessions[plate] = {'id': session[0], 'checkin_time': session[1]}
+            self.checked_out_count += checkouts
+
+    def reservation_added(self, license_plate, slot_number, start, end):
+        with self.lock:
+            self.reserved[license_plate] = (slot_number, start, end)
+            self.reservation_count += 1
+
+    def reservation_cancelled(self, license_plate):
+        with self.lock:
+            self.reserved.pop(license_plate, None)
+
+    def slot_status_changed(self, slot_number, status):
+        with self.lock:
+            if status == 'available':
+                self.occupied_slots &= ~(1 << slot_number)
+            else:
+                self.occupied_slots |= 1 << slot_number
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(pool):
+    """Returns the process-wide occupancy index for the pool's database."""
+    with _indexes_lock:
+        index = _indexes.get(pool.db_file)
+        if index is None or index.pool is not pool:
+            index = OccupancyIndex(pool)
+            _indexes[pool.db_file] = index
+        return index
@@ -0,0 +1,123 @@
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+READ_TABLES = re.compile(r'\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)', re.IGNORECASE)
+WRITE_TABLES = re.compile(
+    # "DO UPDATE SET" in an upsert is not a table reference
+    r'\b(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|REPLACE\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(?!SET\b)([A-Za-z_][A-Za-z0-9_]*)',
+    re.IGNORECASE
+)
+
+
+def read_tables(query):
+    """Names of the tables a SELECT reads (lower case)."""
+    return {name.lower() for name in READ_TABLES.findall(query)}
+
+
+def written_tables(query):
+    """Names of the tables a write statement modifies (lower case)."""
+    return {name.lower() for name in WRITE_TABLES.findall(query)}
+
+
+class QueryCache:
+    """Size-bounded LRU cache of read results with per-entry TTLs.
+
+    Every entry remembers the tables its query reads. Writing to a table
+    drops exactly the entries that depend on it, including tables that
+    triggers on it update (for example the search index and summary tables).
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.by_table = defaultdict(set)
+        self.trigger_writes = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def load_trigger_dependencies(self, conn):
+        """Learns which tables each table's triggers write to, from sqlite_master."""
+        direct = defaultdict(set)
+        for table, sql in conn.execute("SELECT tbl_name, sql FROM sqlite_master WHERE type = 'trigger'"):
+            body = sql[sql.upper().index('BEGIN'):]
+            direct[table.lower()] |= written_tables(body)
+        closure = {}
+        for table in direct:
+            seen, pending = set(), [table]
+            while pending:
+                for derived in direct.get(pending.pop(), ()):
+                    if derived not in seen:
+                        seen.add(derived)
+                        pending.append(derived)
+            closure[table] = seen
+        with self.lock:
+            self.trigger_writes = closure
+
+    def get(self, key):
+        """Returns (True, value) for a live entry, else (False, None)."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def put(self, key, value, ttl, tables):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = (time.monotonic() + ttl, tables, value)
+            for table in tables:
+                self.by_table[table].add(key)
+            while len(self.entries) > self.max_entries:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tables):
+        """Drops every entry that reads any of `tables` or a table their triggers write."""
+        affected = set()
+        for table in tables:
+            table = table.lower()
+            affected.add(table)
+            affected |= self.trigger_writes.get(table, set())
+        with self.lock:
+            for table in affected:
+                for key in list(self.by_table.pop(table, ())):
+                    self._drop(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_table.clear()
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            for table in entry[1]:
+                keys = self.by_table.get(table)
+                if keys is not None:
+                    keys.discard(key)
@@ -0,0 +1,175 @@
+import bisect
+import threading
+import time
+
+import occupancy
+import timeutil
+
+
+class SlotSchedule:
+    """Active reservations of one slot as sorted, non-overlapping intervals.
+
+    Because a slot can never hold two overlapping reservations, a sorted list
+    of starts is a complete interval index for it: the only candidates that
+    can overlap [start, end) are the neighbours of start's insertion point,
+    found by binary search.
+    """
+
+    def __init__(self):
+        self.starts = []
+        self.intervals = []
+
+    def conflicts(self, start, end):
+        """Reservation ids overlapping [start, end)."""
+        i = bisect.bisect_left(self.starts, end)
+        found = []
+        while i > 0 and self.intervals[i - 1][1] > start:
+            found.append(self.intervals[i - 1][2])
+            i -= 1
+        return found
+
+    def add(self, start, end, reservation_id):
+        i = bisect.bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.intervals.insert(i, (start, end, reservation_id))
+
+    def remove(self, reservation_id):
+        for i, interval in enumerate(self.intervals):
+            if interval[2] == reservation_id:
+                del self.starts[i]
+                del self.intervals[i]
+                return
+
+    def expire(self, now):
+        """Drops intervals that ended at or before `now`; returns how many."""
+        kept = [interval for interval in self.intervals if interval[1] > now]
+        dropped = len(self.intervals) - len(kept)
+        if dropped:
+            self.intervals = kept
+            self.starts = [interval[0] for interval in kept]
+        return dropped
+
+
+class ReservationEngine:
+    """Time-windowed slot availability and overlap detection.
+
+    Keeps a SlotSchedule per slot in memory for O(log n) checks, backed by
+    the reservation_windows R*Tree in SQLite, which add_reservation consults
+    inside its write transaction so that racing processes cannot double-book
+    a slot. Reservations whose end has passed are expired automatically the
+    next time the engine is used, and dropped from the occupancy index.
+    """
+
+    def __init__(self, pool, max_age=60):
+        self.pool = pool
+        self.max_age = max_age
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        """Rebuilds the schedules from active reservations in the database."""
+        with self.pool.reader() as conn:
+            slots = [row[0] for row in conn.execute("SELECT slot_number FROM ParkingSlots ORDER BY slot_number")]
+            windows = conn.execute("SELECT id, slot_lo, start_ts, end_ts FROM reservation_windows").fetchall()
+        schedules = {slot: SlotSchedule() for slot in slots}
+        slot_of = {}
+        for reservation_id, slot, start, end in sorted(windows, key=lambda w: w[2]):
+            schedules.setdefault(slot, SlotSchedule()).add(start, end, reservation_id)
+            slot_of[reservation_id] = slot
+        with self.lock:
+            self.schedules = schedules
+            self.slot_of = slot_of
+            self.next_expiry = min((w[3] for w in windows), default=None)
+            self.loaded_at = time.monotonic()
+
+    def _fresh(self):
+        if time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+        now = timeutil.now()
+        if self.next_expiry is not None and self.next_expiry <= now:
+            self.expire(now)
+
+    def conflicts(self, slot_number, start, end):
+        """Ids of active reservations on the slot that overlap [start, end)."""
+        with self.lock:
+            self._fresh()
+            schedule = self.schedules.get(slot_number)
+            return schedule.conflicts(timeutil.to_epoch(start), timeutil.to_epoch(end)) if schedule else []
+
+    def available_slots(self, start, end):
+        """Slots with no active reservation overlapping [start, end)."""
+        start, end = timeutil.to_epoch(start), timeutil.to_epoch(end)
+        with self.lock:
+            self._fresh()
+            return [slot for slot, schedule in self.schedules.items() if not schedule.conflicts(start, end)]
+
+    def reserved_slots(self, start, end):
+        """Slots with an active reservation overlapping [start, end)."""
+        start, end = timeutil.to_epoch(start), timeutil.to_epoch(end)
+        with self.lock:
+            self._fresh()
+            return {slot for slot, schedule in self.schedules.items() if schedule.conflicts(start, end)}
+
+    def find_conflict(self, conn, slot_number, start, end):
+        """Authoritative overlap check against the R*Tree, on the caller's connection."""
+        row = conn.execute(
+            """SELECT id FROM reservation_windows
+               WHERE slot_lo <= ?1 AND slot_hi >= ?1 AND start_ts < ?3 AND end_ts > ?2
+               LIMIT 1""",
+            (slot_number, timeutil.to_epoch(start), timeutil.to_epoch(end))
+        ).fetchone()
+        return row[0] if row else None
+
+    def added(self, reservation_id, slot_number, start, end):
+        start, end = timeutil.to_epoch(start), timeutil.to_epoch(end)
+        with self.lock:
+            self.schedules.setdefault(slot_number, SlotSchedule()).add(start, end, reservation_id)
+            self.slot_of[reservation_id] = slot_number
+            if self.next_expiry is None or end < self.next_expiry:
+                self.next_expiry = end
+
+    def removed(self, reservation_ids):
+        with self.lock:
+            for reservation_id in reservation_ids:
+                slot = self.slot_of.pop(reservation_id, None)
+                if slot is not None:
+                    self.schedules[slot].remove(reservation_id)
+
+    def expire(self, now=None):
+        """Marks reservations that have ended as 'completed'; returns their (id, license_plate) rows.
+
+        Runs lazily from any engine call as well as from the scheduler, so it
+        clears the plates from the occupancy index itself.
+        """
+        now = timeutil.now() if now is None else timeutil.to_epoch(now)
+        with self.pool.transaction() as conn:
+            expired = conn.execute(
+                "UPDATE Reservations SET status = 'completed' "
+                "WHERE status = 'active' AND reservation_end <= ? RETURNING id, license_plate",
+                (now,)
+            ).fetchall()
+        with self.lock:
+            for schedule in self.schedules.values():
+                schedule.expire(now)
+            for reservation_id, _ in expired:
+                self.slot_of.pop(reservation_id, None)
+            remaining = [i[1] for s in self.schedules.values() for i in s.intervals]
+            self.next_expiry = min(remaining, default=None)
+        index = occupancy.get_index(self.pool)
+        for _, license_plate in expired:
+            index.reservation_cancelled(license_plate)
+        return expired
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(pool):
+    """Returns the process-wide reservation engine for the pool's database."""
+    with _engines_lock:
+        engine = _engines.get(pool.db_file)
+        if engine is None or engine.pool is not pool:
+            engine = ReservationEngine(pool)
+            _engines[pool.db_file] = engine
+        return engine
@@ -0,0 +1,198 @@
+"""Background maintenance jobs for reservations and parking slots.
+
+One daemon thread per process (not per Streamlit rerun) runs each job on its
+own cadence:
+
+- expire_reservations: active reservations whose end has passed become 'completed'
+- release_no_shows: reservations not honoured within NO_SHOW_GRACE of their
+  start become 'no_show', freeing the rest of their window
+- reconcile_slots: ParkingSlots.status is recomputed from Reservations and
+  VehicleMovements ('occupied' while a session holds the bay or the
+  reserving vehicle is inside, 'reserved' while a window is running without
+  it, otherwise 'available'); other statuses such as out of service are kept
+- archive_movements: closed movements older than archive.ARCHIVE_AFTER_DAYS
+  move to their monthly archive partitions
+- collect_images: photos unused for images.IMAGE_RETENTION_DAYS and failed
+  captures are deleted
+
+Each job is a handful of set-based statements in one transaction. Timings
+are available from Scheduler.stats().
+"""
+import threading
+import time
+
+import timeutil
+
+# Seconds between runs of each job
+JOB_INTERVALS = {
+    'expire_reservations': 60,
+    'release_no_shows': 300,
+    'reconcile_slots': 120,
+    'archive_movements': 3600,
+    'collect_images': 6 * 3600,
+}
+# Seconds after its start that a reservation is held for the vehicle
+NO_SHOW_GRACE = 30 * 60
+
+
+class Scheduler:
+    """Runs maintenance jobs for one VehicleManagement on a daemon thread."""
+
+    def __init__(self, vehicle_management, intervals=None, no_show_grace=NO_SHOW_GRACE):
+        self.vm = vehicle_management
+        self.intervals = dict(JOB_INTERVALS, **(intervals or {}))
+        self.no_show_grace = no_show_grace
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.next_run = {name: 0.0 for name in self.intervals}
+        self.metrics = {
+            name: {'runs': 0, 'errors': 0, 'last_rows': 0, 'last_seconds': 0.0,
+                   'max_seconds': 0.0, 'total_seconds': 0.0, 'last_run': None, 'last_error': None}
+            for name in self.intervals
+        }
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stopping.clear()
+                self.thread = threading.Thread(target=self._loop, name='carpark-scheduler', daemon=True)
+                self.thread.start()
+
+    def stop(self, timeout=5):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _loop(self):
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            for name, interval in self.intervals.items():
+                if now >= self.next_run[name]:
+                    self.run(name)
+                    self.next_run[name] = time.monotonic() + interval
+            self.stopping.wait(max(0.5, min(self.next_run.values()) - time.monotonic()))
+
+    def run(self, name):
+        """Runs one job now and records its timing; returns the rows it changed."""
+        started = time.perf_counter()
+        rows, error = 0, None
+        try:
+            rows = getattr(self, name)()
+        except Exception as e:
+            error = str(e)
+            print(f"Error: scheduled job {name} failed: {e}")
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            m = self.metrics[name]
+            m['runs'] += 1
+            m['last_rows'] = rows
+            m['last_seconds'] = elapsed
+            m['max_seconds'] = max(m['max_seconds'], elapsed)
+            m['total_seconds'] += elapsed
+            m['last_run'] = timeutil.format_local(timeutil.now())
+            if error is not None:
+                m['errors'] += 1
+                m['last_error'] = error
+        return rows
+
+    def stats(self):
+        """Per-job run counts and timings, with the average run time filled in."""
+        with self.lock:
+            stats = {name: dict(m) for name, m in self.metrics.items()}
+        for m in stats.values():
+            m['avg_seconds'] = m['total_seconds'] / m['runs'] if m['runs'] else 0.0
+        return stats
+
+    def expire_reservations(self):
+        expired = self.vm.reservation_engine.expire()
+        if expired:
+            self.vm.db.invalidate('Reservations')
+        return len(expired)
+
+    def release_no_shows(self):
+        now = timeutil.now()
+        try:
+            with self.vm.db.transaction() as conn:
+                released = conn.execute(
+                    """UPDATE Reservations SET status = 'no_show'
+                       WHERE status = 'active' AND reservation_start <= ? AND reservation_end > ?
+                         AND NOT EXISTS (
+                             SELECT 1 FROM VehicleMovements m
+                             WHERE m.license_plate = Reservations.license_plate
+                               AND (m.state = 'in' OR m.checkin_time >= Reservations.reservation_start))
+                       RETURNING id, license_plate""",
+                    (now - self.no_show_grace, now)
+                ).fetchall()
+        finally:
+            self.vm.db.invalidate('Reservations')
+        self.vm.reservation_engine.removed(reservation_id for reservation_id, _ in released)
+        for _, license_plate in released:
+            self.vm.occupancy.reservation_cancelled(license_plate)
+        return len(released)
+
+    def reconcile_slots(self):
+        now = timeutil.now()
+        try:
+            with self.vm.db.transaction() as conn:
+                changed = conn.execute(
+                    """WITH wanted AS (
+                           SELECT s.slot_number,
+                                  CASE
+                                      WHEN MAX(held.id) IS NOT NULL OR MAX(m.id) IS NOT NULL THEN 'occupied'
+                                      WHEN MAX(r.id) IS NOT NULL THEN 'reserved'
+                                      ELSE 'available'
+                                  END AS status
+                           FROM ParkingSlots s
+                           LEFT JOIN VehicleMovements held
+                             ON held.slot_number = s.slot_number AND held.state = 'in'
+                           LEFT JOIN Reservations r
+                             ON r.slot_number = s.slot_number AND r.status = 'active'
+                            AND r.reservation_start <= ?1 AND r.reservation_end > ?1
+                           LEFT JOIN VehicleMovements m
+                             ON m.state = 'in' AND m.license_plate = r.license_plate
+                           GROUP BY s.slot_number
+                       )
+                       UPDATE ParkingSlots SET status = wanted.status
+                       FROM wanted
+                       WHERE wanted.slot_number = ParkingSlots.slot_number
+                         AND ParkingSlots.status IN ('available', 'reserved', 'occupied')
+                         AND ParkingSlots.status IS NOT wanted.status
+                       RETURNING ParkingSlots.slot_number, ParkingSlots.status""",
+                    (now,)
+                ).fetchall()
+        finally:
+            self.vm.db.invalidate('ParkingSlots')
+        for slot_number, status in changed:
+            self.vm.occupancy.slot_status_changed(slot_number, status)
+        return len(changed)
+
+    def archive_movements(self):
+        try:
+            return self.vm.archive.archive()
+        finally:
+            self.vm.db.invalidate('VehicleMovements', 'movement_archive')
+
+    def collect_images(self):
+        try:
+            return self.vm.images.collect()
+        finally:
+            self.vm.db.invalidate('VehicleMovements', 'images')
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def start_scheduler(vehicle_management, intervals=None):
+    """Starts the process-wide scheduler for the database, once; returns it."""
+    db_file = vehicle_management.db.db_file
+    with _schedulers_lock:
+        scheduler = _schedulers.get(db_file)
+        if scheduler is None or scheduler.vm.db.pool is not vehicle_management.db.pool:
+            if scheduler is not None:
+                scheduler.stop()
+            scheduler = Scheduler(vehicle_management, intervals)
+            _schedulers[db_file] = scheduler
+        scheduler.start()
+        return scheduler
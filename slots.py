@@ -1,41 +1,76 @@
 
 
-import sqlite3
-
-# Connect to your database
-conn = sqlite3.connect('car_park_management.db')
-
-# Create a cursor object
-cur = conn.cursor()
-
-# Create table
-cur.execute('''
-CREATE TABLE IF NOT EXISTS ParkingSlots (
-    slot_number INTEGER PRIMARY KEY,
-    status TEXT DEFAULT 'available' -- 'available' or 'occupied'
-)
-''')
-
-# Insert statements
-insert_statements = [
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (1, 'available')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (2, 'available')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (3, 'occupied')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (4, 'available')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (5, 'occupied')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (6, 'available')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (7, 'available')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (8, 'occupied')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (9, 'available')",
-    "INSERT INTO ParkingSlots (slot_number, status) VALUES (10, 'available')"
-]
-
-# Execute each insert statement
-for statement in insert_statements:
-    cur.execute(statement)
-
-# Commit the changes
-conn.commit()
-
-# Close the connection
-conn.close()
+import argparse
+from connection import get_pool
+import migrations
+
+# Slots created for a new database
+DEFAULT_SLOT_COUNT = 10
+SLOT_TYPES = ('standard', 'ev', 'disabled', 'motorbike')
+# Added to exit_distance per level, so lower levels are preferred
+LEVEL_DISTANCE = 1000
+
+
+def seed_parking_slots(conn, slot_numbers):
+    """Creates missing parking slots as 'available'; existing slots keep their status."""
+    cur = conn.executemany(
+        "INSERT INTO ParkingSlots (slot_number, status) VALUES (?, 'available') "
+        "ON CONFLICT (slot_number) DO NOTHING",
+        [(number,) for number in slot_numbers]
+    )
+    return cur.rowcount
+
+
+def seed_zone(conn, site, level, name, capacity=None):
+    """Creates the zone if missing and returns its id; `capacity` updates it when given.
+
+    A zone without a capacity may fill all of its bays.
+    """
+    conn.execute(
+        "INSERT INTO zones (site, level, name, capacity) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (site, level, name) DO UPDATE SET capacity = COALESCE(excluded.capacity, capacity)",
+        (site, level, name, capacity)
+    )
+    return conn.execute(
+        "SELECT id FROM zones WHERE site = ? AND level = ? AND name = ?", (site, level, name)
+    ).fetchone()[0]
+
+
+def seed_zone_slots(conn, zone_id, slot_numbers, slot_type='standard'):
+    """Creates or moves slots into a zone, in exit order: the first number is nearest the exit."""
+    if slot_type not in SLOT_TYPES:
+        raise ValueError(f"Unknown slot type {slot_type!r}")
+    level = conn.execute("SELECT level FROM zones WHERE id = ?", (zone_id,)).fetchone()[0]
+    cur = conn.executemany(
+        """INSERT INTO ParkingSlots (slot_number, status, zone_id, slot_type, exit_distance)
+           VALUES (?, 'available', ?, ?, ?)
+           ON CONFLICT (slot_number) DO UPDATE SET
+               zone_id = excluded.zone_id, slot_type = excluded.slot_type, exit_distance = excluded.exit_distance""",
+        [(number, zone_id, slot_type, level * LEVEL_DISTANCE + position)
+         for position, number in enumerate(slot_numbers, 1)]
+    )
+    return cur.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed parking slots into a site, level and zone.")
+    parser.add_argument('db_file', nargs='?', default='car_park_management.db')
+    parser.add_argument('--count', type=int, default=DEFAULT_SLOT_COUNT, help="number of slots to create")
+    parser.add_argument('--first', type=int, default=1, help="slot number of the bay nearest the exit")
+    parser.add_argument('--site', default='main')
+    parser.add_argument('--level', type=int, default=0)
+    parser.add_argument('--zone', default='A')
+    parser.add_argument('--type', default='standard', choices=SLOT_TYPES, help="slot type of the new bays")
+    parser.add_argument('--capacity', type=int, help="vehicles the zone may hold (defaults to its bay count)")
+    args = parser.parse_args()
+
+    pool = get_pool(args.db_file)
+    migrations.bootstrap(pool)
+    with pool.transaction() as conn:
+        zone_id = seed_zone(conn, args.site, args.level, args.zone, args.capacity)
+        added = seed_zone_slots(conn, zone_id, range(args.first, args.first + args.count), args.type)
+    print(f"Zone {args.site}/{args.level}/{args.zone}: {added} slots added or updated.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Process-wide registry of loaded WhisperX models.
+
+Loading a model takes seconds and hundreds of MB, so each (size, compute
+type) pair is loaded once, on first use, and shared by every Streamlit
+session and rerun in the process (see transcribe.get_registry). whisperx
+and torch are imported only when the first model loads, so pages render
+without them.
+
+Models unused for IDLE_SECONDS are dropped by a daemon reaper thread. When
+loading another model would take the estimated total over the memory
+budget, the least recently used idle models are dropped first. Models in
+use by a transcription are never dropped.
+"""
+import gc
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+MODEL_SIZES = ('tiny', 'base', 'small', 'medium', 'large-v2', 'large-v3')
+# CPU compute types supported by CTranslate2
+COMPUTE_TYPES = ('int8', 'float32')
+DEFAULT_SIZE = 'base'
+DEFAULT_COMPUTE_TYPE = 'int8'
+# Millions of parameters per model size, for the memory estimate
+MODEL_PARAMETERS = {'tiny': 39, 'base': 74, 'small': 244, 'medium': 769, 'large-v2': 1550, 'large-v3': 1550}
+BYTES_PER_PARAMETER = {'int8': 1, 'float32': 4}
+# Runtime, tokenizer and VAD model on top of the weights
+MODEL_OVERHEAD_MB = 150
+MEMORY_BUDGET_MB = int(os.environ.get('TRANSCRIBE_MEMORY_MB', 4096))
+IDLE_SECONDS = 15 * 60
+REAPER_INTERVAL = 60
+
+
+def estimated_mb(size, compute_type):
+    return MODEL_PARAMETERS[size] * BYTES_PER_PARAMETER[compute_type] + MODEL_OVERHEAD_MB
+
+
+def cpu_threads():
+    return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+class ModelRegistry:
+    """Loads WhisperX models on demand and drops idle ones under a memory budget."""
+
+    def __init__(self, memory_budget_mb=MEMORY_BUDGET_MB, idle_seconds=IDLE_SECONDS, threads=None):
+        self.memory_budget_mb = memory_budget_mb
+        self.idle_seconds = idle_seconds
+        self.threads = threads or cpu_threads()
+        self.lock = threading.Lock()
+        # (size, compute_type) -> {'model', 'mb', 'users', 'last_used', 'load_seconds'}
+        self.models = {}
+        self.loading = {}
+        self.reaper = None
+
+    @contextmanager
+    def model(self, size=DEFAULT_SIZE, compute_type=DEFAULT_COMPUTE_TYPE):
+        """Yields the loaded model for (size, compute_type), which cannot be evicted while in use."""
+        key = (size, compute_type)
+        entry = self._acquire(key)
+        try:
+            yield entry['model']
+        finally:
+            with self.lock:
+                entry['users'] -= 1
+                entry['last_used'] = time.monotonic()
+
+    def _acquire(self, key):
+        if key[0] not in MODEL_SIZES or key[1] not in COMPUTE_TYPES:
+            raise ValueError(f"Unknown model {key[0]} / {key[1]}")
+        while True:
+            with self.lock:
+                entry = self.models.get(key)
+                if entry is not None:
+                    entry['users'] += 1
+                    entry['last_used'] = time.monotonic()
+                    return entry
+                loaded = self.loading.get(key)
+                if loaded is None:
+                    loaded = self.loading[key] = threading.Event()
+                    break
+            # Another thread is loading the same model
+            loaded.wait()
+
+        try:
+            mb = estimated_mb(*key)
+            self._make_room(mb)
+            started = time.perf_counter()
+            model = self._load(*key)
+            entry = {
+                'model': model, 'mb': mb, 'users': 1, 'last_used': time.monotonic(),
+                'load_seconds': time.perf_counter() - started,
+            }
+            with self.lock:
+                self.models[key] = entry
+            self._start_reaper()
+            return entry
+        finally:
+            with self.lock:
+                self.loading.pop(key).set()
+
+    def _load(self, size, compute_type):
+        import whisperx
+
+        return whisperx.load_model(size, 'cpu', compute_type=compute_type, threads=self.threads)
+
+    def _make_room(self, mb):
+        """Drops least recently used idle models until `mb` more fits the budget."""
+        dropped = []
+        with self.lock:
+            idle = sorted(
+                (entry['last_used'], key) for key, entry in self.models.items() if not entry['users']
+            )
+            used = sum(entry['mb'] for entry in self.models.values())
+            for _, key in idle:
+                if used + mb <= self.memory_budget_mb:
+                    break
+                used -= self.models[key]['mb']
+                dropped.append(self.models.pop(key))
+        if dropped:
+            del dropped
+            gc.collect()
+
+    def evict_idle(self, now=None):
+        """Drops models unused for idle_seconds; returns how many were dropped."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            expired = [
+                key for key, entry in self.models.items()
+                if not entry['users'] and now - entry['last_used'] > self.idle_seconds
+            ]
+            for key in expired:
+                del self.models[key]
+        if expired:
+            gc.collect()
+        return len(expired)
+
+    def clear(self):
+        """Drops every model not currently in use."""
+        return self.evict_idle(now=float('inf'))
+
+    def _start_reaper(self):
+        with self.lock:
+            if self.reaper is None or not self.reaper.is_alive():
+                self.reaper = threading.Thread(target=self._reap, name='speech-model-reaper', daemon=True)
+                self.reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(REAPER_INTERVAL)
+            self.evict_idle()
+            with self.lock:
+                if not self.models:
+                    self.reaper = None
+                    return
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return {
+                f"{size}/{compute_type}": {
+                    'estimated_mb': entry['mb'],
+                    'in_use': entry['users'],
+                    'idle_seconds': round(now - entry['last_used'], 1),
+                    'load_seconds': round(entry['load_seconds'], 2),
+                }
+                for (size, compute_type), entry in self.models.items()
+            }
@@ -6,7 +6,9 @@ from datetime import datetime, timedelta
 from streamlit_option_menu import option_menu
 import os
 import altair as alt
-import pytz
+import timeutil
+import instrumentation
+from carpark import get_database, REFERENCE_TTL, LIVE_TTL
 
 class StaffView:
     """Handles the UI for staff allocation and staff details management."""
@@ -45,75 +47,44 @@ class StaffView:
         if staff_allocations.empty:
             st.write("No staff allocations yet.")
         else:
-            st.write(staff_allocations)
+            st.write(timeutil.localize_columns(staff_allocations, 'start_time', 'end_time'))
 
 
 class StaffModel:
     """Handles database interactions related to staff details and allocations."""
 
-    def __init__(self, conn):
-        self.conn = conn
-        self.create_staff_table()
-        self.create_allocation_table()
-
-    def create_staff_table(self):
-        """Creates the staff details table if it doesn't exist."""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS staff (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                employee_id TEXT,
-                contact_info TEXT
-            )
-        ''')
-        self.conn.commit()
-
-    def create_allocation_table(self):
-        """Creates the staff allocation table if it doesn't exist."""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS staff_allocation (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                staff_id INTEGER,
-                role TEXT,
-                shift TEXT,
-                shift_date DATE,
-                start_time DATETIME,
-                end_time DATETIME,
-                allocation_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (staff_id) REFERENCES staff(id)
-            )
-        ''')
-        self.conn.commit()
+    def __init__(self, database):
+        self.db = database
 
     def save_staff(self, name, employee_id, contact_info):
         """Saves a new staff member to the database."""
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT INTO staff (name, employee_id, contact_info) VALUES (?, ?, ?)",
-                       (name, employee_id, contact_info))
-        self.conn.commit()
+        self.db.execute_query("INSERT INTO staff (name, employee_id, contact_info) VALUES (?, ?, ?)",
+                              (name, employee_id, contact_info))
 
     def get_staff_list(self):
         """Fetches the list of staff members from the database."""
         query = "SELECT id, name FROM staff"
-        return pd.read_sql_query(query, self.conn)
+        return self.db.fetch_dataframe(query, ttl=REFERENCE_TTL)
 
     def save_staff_allocation(self, staff_id, role, shift, shift_date, start_time, end_time):
-        """Saves staff allocation to the database."""
+        """Saves staff allocation to the database; the local shift times are stored as epoch seconds."""
+        start = timeutil.from_local(shift_date, start_time)
+        end = timeutil.from_local(shift_date, end_time)
+        if end < start:
+            # Night shifts end the next day
+            end += 24 * 60 * 60
         try:
-            cursor = self.conn.cursor()
-    
-            # No need to convert to string; SQLite will handle it
-            cursor.execute('''
-                INSERT INTO staff_allocation 
-                (staff_id, role, shift, shift_date, start_time, end_time) 
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (staff_id, role, shift, shift_date, start_time, end_time))
-            self.conn.commit()
+            with self.db.transaction() as conn:
+                conn.execute('''
+                    INSERT INTO staff_allocation 
+                    (staff_id, role, shift, shift_date, start_time, end_time, allocation_time) 
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (int(staff_id), role, shift, shift_date.isoformat(), start, end, timeutil.now()))
             st.success("Staff allocation saved successfully!")
         except sqlite3.Error as e:
             st.error(f"An error occurred while saving staff allocation: {e}")
+        finally:
+            self.db.invalidate('staff_allocation')
     
     def fetch_staff_allocations(self):
         """Fetches current staff allocations from the database."""
@@ -121,9 +92,9 @@ class StaffModel:
             SELECT s.name, sa.role, sa.shift, sa.shift_date, sa.start_time, sa.end_time 
             FROM staff_allocation sa
             JOIN staff s ON sa.staff_id = s.id
-            ORDER BY sa.shift_date DESC, sa.start_time DESC
+            ORDER BY sa.start_time DESC
         '''
-        return pd.read_sql_query(query, self.conn)
+        return self.db.fetch_dataframe(query, ttl=LIVE_TTL)
 
 class StaffAllocationController:
     """Handles the logic for staff management and allocation."""
@@ -162,11 +133,11 @@ class StaffAllocationController:
 def main():
     st.set_page_config(page_title="Vehicle Check-In System", layout="wide")
     
-    # Initialize the Model, View, and Controller for vehicle check-ins
-    conn = sqlite3.connect("car_park_management.db")
+    # Share the process-wide database, pool and query cache with the vehicle check-in app
+    db = get_database("car_park_management.db")
 
     # Initialize the Model, View, and Controller for staff allocation
-    staff_model = StaffModel(conn)
+    staff_model = instrumentation.trace(StaffModel(db), db.metrics)
     staff_view = StaffView()
     staff_controller = StaffAllocationController(staff_model, staff_view)
     
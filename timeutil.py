@@ -0,0 +1,109 @@
+"""Time handling shared by the car park modules.
+
+Movement, reservation and staff allocation times are stored as integer
+seconds since the Unix epoch (UTC). They are converted to the site's local
+time zone only for display, and for the local day and hour keys of the
+summary tables.
+"""
+import numbers
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import pytz
+
+LOCAL_TZ = pytz.timezone('Africa/Nairobi')
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Accepted for local time strings, most specific first
+PARSE_FORMATS = (TIME_FORMAT, '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+# Offset used by SQL for local day and hour buckets. Nairobi keeps no
+# daylight saving time, so a fixed offset is exact.
+UTC_OFFSET = int(datetime.now(LOCAL_TZ).utcoffset().total_seconds())
+
+
+def now():
+    """Current time as epoch seconds."""
+    return int(time.time())
+
+
+def parse_local(text):
+    """Naive datetime for a local time string in one of PARSE_FORMATS."""
+    for fmt in PARSE_FORMATS:
+        try:
+            return datetime.strptime(text.strip(), fmt)
+        except ValueError:
+            pass
+    raise ValueError(f"Unrecognised time {text!r}")
+
+
+def to_epoch(value):
+    """Epoch seconds for an epoch number, a datetime or date (naive means local) or a local time string."""
+    if value is None:
+        return None
+    if isinstance(value, numbers.Real):
+        return int(value)
+    if isinstance(value, str):
+        if value.strip().isdigit():
+            return int(value)
+        value = parse_local(value)
+    elif not isinstance(value, date):
+        raise TypeError(f"Cannot convert {type(value).__name__} to epoch seconds")
+    elif not isinstance(value, datetime):
+        value = datetime.combine(value, datetime.min.time())
+    if value.tzinfo is None:
+        value = LOCAL_TZ.localize(value)
+    return int(value.timestamp())
+
+
+def local_text_to_epoch(text):
+    """to_epoch for stored legacy text; None when it cannot be parsed."""
+    try:
+        return to_epoch(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def from_local(day, time_of_day):
+    """Epoch seconds for a local date and time, as picked in the UI."""
+    return to_epoch(datetime.combine(day, time_of_day))
+
+
+def to_local(epoch):
+    """Aware local datetime for epoch seconds."""
+    return datetime.fromtimestamp(epoch, LOCAL_TZ)
+
+
+def format_local(epoch, fmt=TIME_FORMAT):
+    return to_local(epoch).strftime(fmt) if epoch is not None else None
+
+
+def local_day(epoch):
+    """Local calendar day ('YYYY-MM-DD') of epoch seconds."""
+    return format_local(epoch, '%Y-%m-%d')
+
+
+def local_date_sql(column):
+    """SQL for the local 'YYYY-MM-DD' of an epoch column."""
+    return f"date({column} + {UTC_OFFSET}, 'unixepoch')"
+
+
+def local_hour_sql(column):
+    """SQL for the local 'YYYY-MM-DD HH:00' of an epoch column."""
+    return f"strftime('%Y-%m-%d %H:00', {column} + {UTC_OFFSET}, 'unixepoch')"
+
+
+def local_month_sql(column):
+    """SQL for the local 'YYYY-MM' of an epoch column."""
+    return f"strftime('%Y-%m', {column} + {UTC_OFFSET}, 'unixepoch')"
+
+
+def localize_columns(frame, *columns):
+    """Copy of the frame with epoch columns shown as naive local datetimes."""
+    frame = frame.copy()
+    for column in columns:
+        if column in frame:
+            frame[column] = (
+                pd.to_datetime(frame[column], unit='s', utc=True)
+                .dt.tz_convert(LOCAL_TZ).dt.tz_localize(None)
+            )
+    return frame
@@ -1,71 +1,350 @@
 import streamlit as st
-import whisperx
-from io import BytesIO
-from moviepy.editor import VideoFileClip
-import tempfile
+import numpy as np
 import os
-from pydub import AudioSegment
-
-# Load the WhisperX model
-model = whisperx.load_model("base")
-
-def extract_audio_from_video(video_file):
-    # Create a temporary file to save the uploaded video file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_video_file:
-        temp_video_file.write(video_file.getbuffer())
-        temp_video_path = temp_video_file.name
-
-    # Load video file using moviepy
-    video = VideoFileClip(temp_video_path)
-    
-    # Extract the audio
-    audio_file_path = tempfile.NamedTemporaryFile(delete=False, suffix=".wav").name
-    video.audio.write_audiofile(audio_file_path, codec='pcm_s16le')  # Save as WAV
-
-    # Clean up the temporary video file
-    video.close()
-    os.remove(temp_video_path)
-    
-    return audio_file_path
-
-def convert_to_wav(input_path):
-    output_path = tempfile.NamedTemporaryFile(delete=False, suffix=".wav").name
-    audio = AudioSegment.from_file(input_path)
-    audio = audio.set_channels(1).set_frame_rate(16000)
-    audio.export(output_path, format="wav")
-    return output_path
-
-# Streamlit app
-st.title("Audio/Video Transcription with Whisper")
-
-st.write("Upload an audio or video file (MP4) and get its transcription using OpenAI's Whisper model.")
-
-# File uploader
-uploaded_file = st.file_uploader("Choose an audio or video file...", type=["mp3", "wav", "m4a", "flac", "mp4"])
-
-if uploaded_file is not None:
-    # Handle MP4 file separately by extracting audio
-    if uploaded_file.name.endswith(".mp4"):
-        with st.spinner("Extracting audio from video..."):
-            audio_file_path = extract_audio_from_video(uploaded_file)
+import threading
+from collections import deque
+from contextlib import contextmanager
+import speech_models
+import transcribe_batch
+import transcript_cache
+from speech_models import ModelRegistry, MODEL_SIZES, COMPUTE_TYPES, DEFAULT_SIZE, DEFAULT_COMPUTE_TYPE
+
+# Audio segments transcribed together by the model
+BATCH_SIZE = 8
+# What WhisperX expects: 16 kHz mono float32
+SAMPLE_RATE = 16000
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE = os.environ.get('FFPROBE_BINARY', 'ffprobe')
+PCM_OUTPUT = dict(format='f32le', acodec='pcm_f32le', ac=1, ar=SAMPLE_RATE)
+# Streaming: seconds decoded per read, longest window given to the model,
+# and how far back from a window's end to look for a pause to cut at
+BLOCK_SECONDS = 30
+WINDOW_SECONDS = 120
+CUT_SEARCH_SECONDS = 5
+# 30 ms frames, and the RMS level above which a frame may hold speech (about -46 dBFS)
+VAD_FRAME = 480
+SPEECH_LEVEL = 0.005
+# Where batch uploads are kept until their jobs finish
+SPOOL_DIR = 'transcription_spool'
+MEDIA_TYPES = ["mp3", "wav", "m4a", "flac", "mp4"]
+
+
+@st.cache_resource
+def get_registry():
+    """One model registry per process, shared by every session and rerun."""
+    return ModelRegistry()
+
+
+@st.cache_resource
+def get_transcript_cache():
+    return transcript_cache.get_cache(transcript_cache.CACHE_DB)
+
+
+@st.cache_resource
+def get_batch_runner():
+    """The process-wide batch runner, working through the job queue in the background."""
+    return transcribe_batch.BatchRunner(transcribe_batch.JOBS_DB).start()
+
+
+@contextmanager
+def ffmpeg_source(data):
+    """Yields (input, bytes to pipe) for feeding `data` to ffmpeg without touching the disk.
+
+    `data` is the recording's bytes, or the path of a file already on disk,
+    which ffmpeg then opens itself. On Linux bytes are read from an in-memory
+    file, which ffmpeg can seek like a regular one (MP4s often keep their
+    index at the end); elsewhere they are piped to its stdin.
+    """
+    if isinstance(data, str):
+        yield data, None
+    elif hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('transcribe-upload')
+        try:
+            os.write(fd, data)
+            yield f"/proc/{os.getpid()}/fd/{fd}", None
+        finally:
+            os.close(fd)
     else:
-        # Save the uploaded audio file as a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as temp_audio_file:
-            temp_audio_file.write(uploaded_file.getbuffer())
-            audio_file_path = temp_audio_file.name
-
-    # Convert to WAV format if necessary
-    with st.spinner("Converting audio to WAV format..."):
-        audio_file_path = convert_to_wav(audio_file_path)
-
-    # Transcribe the audio file
-    with st.spinner("Transcribing..."):
-        result = model.transcribe(audio_file_path)
-        transcription = result['text']
-
-    # Clean up the temporary audio file
-    os.remove(audio_file_path)
-
-    # Display the transcription
-    st.header("Transcription:")
-    st.write(transcription)
+        yield 'pipe:', data
+
+def decode_audio(data):
+    """Decodes audio or video bytes to a 16 kHz mono float32 waveform in one ffmpeg pass."""
+    import ffmpeg
+
+    try:
+        with ffmpeg_source(data) as (source, piped):
+            out, _ = ffmpeg.input(source).output('pipe:', **PCM_OUTPUT).run(
+                cmd=FFMPEG, input=piped, capture_stdout=True, capture_stderr=True
+            )
+    except ffmpeg.Error as e:
+        message = e.stderr.decode('utf-8', 'replace').strip().splitlines()
+        raise ValueError(f"Could not decode audio: {message[-1] if message else e}")
+    return np.frombuffer(out, np.float32)
+
+def probe_duration(data):
+    """Length of the recording in seconds, or None if ffprobe cannot tell."""
+    import ffmpeg
+
+    try:
+        with ffmpeg_source(data) as (source, piped):
+            if piped is not None:
+                return None
+            return float(ffmpeg.probe(source, cmd=FFPROBE)['format']['duration'])
+    except (ffmpeg.Error, KeyError, ValueError):
+        return None
+
+def stream_audio(data, start=0, block_seconds=BLOCK_SECONDS):
+    """Yields the decoded waveform of `data` from `start` seconds in blocks of block_seconds while ffmpeg is still decoding."""
+    import ffmpeg
+
+    block_bytes = int(block_seconds * SAMPLE_RATE) * 4
+    with ffmpeg_source(data) as (source, piped):
+        process = ffmpeg.input(source, **({'ss': start} if start else {})).output('pipe:', **PCM_OUTPUT).run_async(
+            cmd=FFMPEG, pipe_stdin=piped is not None, pipe_stdout=True, pipe_stderr=True
+        )
+        # Drain stderr and feed stdin on threads so neither pipe can stall ffmpeg
+        errors = deque(maxlen=5)
+        threads = [threading.Thread(target=lambda: errors.extend(process.stderr), daemon=True)]
+        if piped is not None:
+            threads.append(threading.Thread(target=feed, args=(process.stdin, piped), daemon=True))
+        for thread in threads:
+            thread.start()
+        finished = False
+        try:
+            while True:
+                block = process.stdout.read(block_bytes)
+                if not block:
+                    break
+                yield np.frombuffer(block[:len(block) // 4 * 4], np.float32)
+            finished = True
+        finally:
+            if not finished:
+                process.kill()
+            process.stdout.close()
+            process.wait()
+            for thread in threads:
+                thread.join()
+    if process.returncode:
+        message = errors[-1].decode('utf-8', 'replace').strip() if errors else f"ffmpeg exited with {process.returncode}"
+        raise ValueError(f"Could not decode audio: {message}")
+
+def feed(pipe, data):
+    try:
+        pipe.write(data)
+        pipe.close()
+    except (BrokenPipeError, ValueError):
+        pass
+
+def frame_levels(samples):
+    """RMS level of each VAD_FRAME-sample frame."""
+    frames = samples[:len(samples) // VAD_FRAME * VAD_FRAME].reshape(-1, VAD_FRAME)
+    return np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+
+def speech_windows(blocks, start=0, window_seconds=WINDOW_SECONDS, cut_seconds=CUT_SEARCH_SECONDS):
+    """Regroups waveform blocks beginning at `start` seconds into windows for the model; yields (start seconds, samples).
+
+    Windows hold at most window_seconds. Each one ends at the quietest frame
+    of its last cut_seconds, so pauses rather than words are split. Windows
+    without any frame above SPEECH_LEVEL are skipped. At most one window and
+    one block are held at a time, whatever the length of the recording.
+    """
+    window = int(window_seconds * SAMPLE_RATE)
+    search = int(cut_seconds * SAMPLE_RATE) // VAD_FRAME * VAD_FRAME
+    buffer = np.empty(0, np.float32)
+    offset = int(start * SAMPLE_RATE)
+    for block in blocks:
+        buffer = np.concatenate((buffer, block))
+        while len(buffer) >= window:
+            # Smoothed over about a quarter second, so the cut lands inside a pause, not at its edge
+            tail = np.convolve(frame_levels(buffer[window - search:window]), np.ones(9), 'same')
+            cut = window - search + int(np.argmin(tail)) * VAD_FRAME + VAD_FRAME // 2
+            piece, buffer = buffer[:cut], buffer[cut:]
+            if (frame_levels(piece) > SPEECH_LEVEL).any():
+                yield offset / SAMPLE_RATE, piece
+            offset += cut
+    if len(buffer) >= VAD_FRAME and (frame_levels(buffer) > SPEECH_LEVEL).any():
+        yield offset / SAMPLE_RATE, buffer
+
+def transcribe_stream(data, size=DEFAULT_SIZE, compute_type=DEFAULT_COMPUTE_TYPE, language=None, registry=None,
+                      start=0):
+    """Transcribes audio or video bytes (or a file path) window by window; yields (segment, language) as they are ready.
+
+    Segments are dicts with 'start' and 'end' in seconds from the start of
+    the recording, and 'text'. WhisperX's own VAD splits each window into
+    speech segments and transcribes them in batches of BATCH_SIZE. The
+    language detected in the first window is kept for the rest. With
+    `start`, transcription resumes that many seconds into the recording.
+    """
+    registry = registry or get_registry()
+    with registry.model(size, compute_type) as model:
+        for offset, samples in speech_windows(stream_audio(data, start), start):
+            result = model.transcribe(samples, batch_size=BATCH_SIZE, language=language)
+            language = language or result.get('language')
+            for segment in result['segments']:
+                yield {
+                    'start': round(offset + segment['start'], 3),
+                    'end': round(offset + segment['end'], 3),
+                    'text': segment['text'].strip(),
+                }, language
+
+def transcribe_audio(audio, size=DEFAULT_SIZE, compute_type=DEFAULT_COMPUTE_TYPE, registry=None):
+    """Transcribes a 16 kHz mono waveform with a shared model; returns WhisperX's result dict."""
+    registry = registry or get_registry()
+    with registry.model(size, compute_type) as model:
+        return model.transcribe(audio, batch_size=BATCH_SIZE)
+
+def result_text(result):
+    return ' '.join(segment['text'].strip() for segment in result['segments'])
+
+def format_segments(segments):
+    return '  \n'.join(f"`{format_timestamp(segment['start'])}` {segment['text']}" for segment in segments)
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:{seconds:02d}"
+
+
+def main():
+    # Streamlit app
+    st.title("Audio/Video Transcription with Whisper")
+
+    st.write("Upload an audio or video file (MP4) and get its transcription using OpenAI's Whisper model.")
+
+    with st.sidebar:
+        size = st.selectbox("Model size", MODEL_SIZES, index=MODEL_SIZES.index(DEFAULT_SIZE))
+        compute_type = st.selectbox(
+            "Compute type", COMPUTE_TYPES, index=COMPUTE_TYPES.index(DEFAULT_COMPUTE_TYPE),
+            help="int8 needs about a quarter of the memory of float32 and is usually faster on CPU"
+        )
+        st.caption(
+            f"About {speech_models.estimated_mb(size, compute_type)} MB; "
+            f"loaded models: {', '.join(get_registry().stats()) or 'none'}"
+        )
+
+    mode = st.radio("Mode", ['Single file', 'Batch', 'Search'], horizontal=True)
+    if mode == 'Batch':
+        show_batch(size, compute_type)
+        return
+    if mode == 'Search':
+        show_search()
+        return
+
+    # File uploader
+    uploaded_file = st.file_uploader("Choose an audio or video file...", type=MEDIA_TYPES)
+
+    streaming = st.toggle(
+        "Stream long recordings", value=True,
+        help="Show segments as they are transcribed, holding only a couple of minutes of audio in memory"
+    )
+
+    if uploaded_file is None:
+        return
+    data = uploaded_file.getvalue()
+    cache = get_transcript_cache()
+    sha256 = transcript_cache.content_sha256(data)
+    cached = cache.get(sha256, size, compute_type)
+    if cached is not None:
+        st.header("Transcription:")
+        st.caption(f"Language: {cached['language']}; from the cache, transcribed earlier with {size}/{compute_type}")
+        st.markdown(format_segments(cached['segments']) or "No speech found.")
+
+    elif streaming:
+        st.header("Transcription:")
+        status = st.empty()
+        output = st.empty()
+        segments = []
+        language = None
+        try:
+            with st.spinner("Transcribing..."):
+                for segment, language in transcribe_stream(data, size, compute_type):
+                    segments.append(segment)
+                    output.markdown(format_segments(segments))
+                    status.caption(f"Language: {language}; transcribed up to {format_timestamp(segment['end'])}")
+        except ValueError as e:
+            st.error(str(e))
+            return
+        cache.put(sha256, size, compute_type, None, segments, language, name=uploaded_file.name)
+        if not segments:
+            st.info("No speech found.")
+
+    else:
+        # Audio and video go through the same single decode, straight to memory
+        with st.spinner("Decoding audio..."):
+            try:
+                audio = decode_audio(data)
+            except ValueError as e:
+                st.error(str(e))
+                return
+
+        # Transcribe the waveform; the model loads on first use only
+        with st.spinner("Transcribing..."):
+            result = transcribe_audio(audio, size, compute_type)
+            transcription = result_text(result)
+        segments = [
+            {'start': round(s['start'], 3), 'end': round(s['end'], 3), 'text': s['text'].strip()}
+            for s in result['segments']
+        ]
+        cache.put(sha256, size, compute_type, None, segments, result.get('language'), len(audio) / SAMPLE_RATE,
+                  uploaded_file.name)
+
+        # Display the transcription
+        st.header("Transcription:")
+        st.write(transcription)
+
+def show_batch(size, compute_type):
+    runner = get_batch_runner()
+    uploads = st.file_uploader("Choose audio or video files...", type=MEDIA_TYPES, accept_multiple_files=True)
+    if uploads and st.button(f"Queue {len(uploads)} files"):
+        queued = 0
+        for upload in uploads:
+            path = transcribe_batch.spool_upload(upload.name, upload.getvalue(), SPOOL_DIR)
+            _, new = transcribe_batch.enqueue(runner.pool, path, upload.name, size, compute_type)
+            queued += new
+        runner.wake.set()
+        st.success(f"{queued} files queued, {len(uploads) - queued} already queued with this model")
+    st.caption(f"{runner.workers} worker processes x {runner.threads} threads")
+    show_jobs(runner)
+
+@st.fragment(run_every=2)
+def show_jobs(runner):
+    jobs = transcribe_batch.job_table(runner.pool)
+    if jobs.empty:
+        st.info("No transcription jobs yet.")
+        return
+    if (jobs['status'] == 'failed').any() and st.button("Retry failed jobs"):
+        transcribe_batch.retry_failed(runner.pool)
+        runner.wake.set()
+    st.dataframe(
+        jobs.drop(columns=['progress', 'duration', 'created_on']),
+        column_config={'percent': st.column_config.ProgressColumn('Progress', min_value=0, max_value=100, format='%.0f%%')},
+        hide_index=True, use_container_width=True
+    )
+    done = jobs[jobs['status'] == 'done']
+    if not done.empty:
+        job_id = st.selectbox("Transcript", done['id'], format_func=dict(zip(done['id'], done['name'])).get)
+        segments = transcribe_batch.job_segments(runner.pool, job_id)
+        text = '\n'.join(f"[{format_timestamp(s['start'])}] {s['text']}" for s in segments)
+        st.text_area("Text", text, height=300)
+        st.download_button("Download transcript", text, f"{os.path.splitext(done.set_index('id').loc[job_id, 'name'])[0]}.txt")
+
+
+def show_search():
+    cache = get_transcript_cache()
+    stats = cache.stats()
+    st.caption(
+        f"{stats['entries']} cached transcripts, {stats['bytes'] / 2**20:.1f} of {stats['max_bytes'] / 2**20:.0f} MB, "
+        f"{stats['hits']} repeat requests answered from the cache"
+    )
+    text = st.text_input("Find words or phrases in earlier transcripts")
+    if text:
+        results = cache.search(text)
+        if results.empty:
+            st.info("No matches found.")
+            return
+        results['start'] = results['start'].map(format_timestamp)
+        results['end'] = results['end'].map(format_timestamp)
+        st.dataframe(results.drop(columns='sha256'), hide_index=True, use_container_width=True)
+
+
+if __name__ == '__main__':
+    main()
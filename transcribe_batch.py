@@ -0,0 +1,460 @@
+"""Batch transcription of recordings through a persistent job queue.
+
+Jobs live in their own SQLite database (transcriptions.db by default), one
+row per recording and model. A BatchRunner claims queued jobs and runs them
+on a pool of worker processes sized to the available cores. Each worker
+keeps its own model registry, so a model loads once per worker. Workers
+stream each recording window by window (transcribe.transcribe_stream)
+and commit every segment together with the job's progress.
+
+Jobs are resumable. If a worker or the whole runner dies, the job's
+heartbeat stops. Once the heartbeat is STALE_SECONDS old, the next runner
+queues the job again, and it continues from the end of its last committed
+segment.
+
+Finished results go to the transcript cache in the same database. A job
+for a recording that is already cached with the same model and language
+completes as soon as it is queued, without reaching a worker.
+
+Uploads from the page are copied to a spool directory first, so their jobs
+survive a restart like files on disk do.
+
+Usage: python transcribe_batch.py DIR [--db FILE] [--workers N] [--size base] [--compute-type int8]
+                                  [--language en] [--output DIR] [--retry-failed] [--status]
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+import timeutil
+from connection import get_pool
+from speech_models import ModelRegistry, DEFAULT_SIZE, DEFAULT_COMPUTE_TYPE, cpu_threads
+import transcribe
+import transcript_cache
+
+JOBS_DB = 'transcriptions.db'
+MEDIA_EXTENSIONS = ('.mp3', '.wav', '.m4a', '.flac', '.ogg', '.opus', '.mp4', '.mkv', '.mov', '.avi')
+# Inference threads per worker process; workers = cores // this
+THREADS_PER_WORKER = 4
+HEARTBEAT_SECONDS = 20
+STALE_SECONDS = 120
+# Runs of a job that may end with its worker process dying before it counts as failed
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 2.0
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS transcription_jobs (
+           id INTEGER PRIMARY KEY,
+           name TEXT NOT NULL,
+           path TEXT NOT NULL,
+           sha256 TEXT NOT NULL,
+           model_size TEXT NOT NULL,
+           compute_type TEXT NOT NULL,
+           language TEXT,
+           status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed')),
+           detected_language TEXT,
+           duration REAL,
+           progress REAL NOT NULL DEFAULT 0,
+           attempts INTEGER NOT NULL DEFAULT 0,
+           error TEXT,
+           created_on INTEGER NOT NULL,
+           started_on INTEGER,
+           finished_on INTEGER,
+           heartbeat INTEGER
+       )""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_transcription_jobs_source
+       ON transcription_jobs (path, sha256, model_size, compute_type, IFNULL(language, ''))""",
+    "CREATE INDEX IF NOT EXISTS idx_transcription_jobs_status ON transcription_jobs (status, id)",
+    """CREATE TABLE IF NOT EXISTS transcription_segments (
+           job_id INTEGER NOT NULL REFERENCES transcription_jobs (id) ON DELETE CASCADE,
+           start_seconds REAL NOT NULL,
+           end_seconds REAL NOT NULL,
+           text TEXT NOT NULL,
+           PRIMARY KEY (job_id, start_seconds)
+       ) WITHOUT ROWID""",
+)
+
+
+def open_jobs(db_file=JOBS_DB):
+    """The shared pool for the jobs database, with its tables created."""
+    pool = get_pool(db_file)
+    with pool.transaction() as conn:
+        for statement in SCHEMA:
+            conn.execute(statement)
+    return pool
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def spool_upload(name, data, spool_dir):
+    """Keeps an uploaded file under spool_dir, named by content; returns its path."""
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = os.path.join(spool_dir, sha256 + os.path.splitext(name)[1].lower())
+    if not os.path.exists(path):
+        os.makedirs(spool_dir, exist_ok=True)
+        partial = f"{path}.{os.getpid()}.partial"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+    return path
+
+
+def enqueue(pool, path, name=None, size=DEFAULT_SIZE, compute_type=DEFAULT_COMPUTE_TYPE, language=None):
+    """Queues a recording; returns (job id, True if newly queued). The same file and model is queued once."""
+    path = os.path.abspath(path)
+    sha256 = file_sha256(path)
+    with pool.transaction() as conn:
+        row = conn.execute(
+            """INSERT INTO transcription_jobs (name, path, sha256, model_size, compute_type, language, created_on)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT DO NOTHING
+               RETURNING id""",
+            (name or os.path.basename(path), path, sha256, size, compute_type, language, timeutil.now())
+        ).fetchone()
+        if row is not None:
+            cached = transcript_cache.get_cache(pool.db_file).get(sha256, size, compute_type, language)
+            if cached is not None:
+                complete_from_cache(conn, row[0], cached)
+            return row[0], True
+        row = conn.execute(
+            """SELECT id FROM transcription_jobs
+               WHERE path = ? AND sha256 = ? AND model_size = ? AND compute_type = ? AND IFNULL(language, '') = ?""",
+            (path, sha256, size, compute_type, language or '')
+        ).fetchone()
+    return row[0], False
+
+
+def complete_from_cache(conn, job_id, cached):
+    """Finishes a job with a cached result, inside the caller's transaction."""
+    conn.executemany(
+        """INSERT OR REPLACE INTO transcription_segments (job_id, start_seconds, end_seconds, text)
+           VALUES (?, ?, ?, ?)""",
+        [(job_id, segment['start'], segment['end'], segment['text']) for segment in cached['segments']]
+    )
+    conn.execute(
+        """UPDATE transcription_jobs
+           SET status = 'done', detected_language = ?, duration = ?, progress = IFNULL(?, progress), finished_on = ?
+           WHERE id = ?""",
+        (cached['language'], cached['duration'], cached['duration'], timeutil.now(), job_id)
+    )
+
+
+def find_media(directory):
+    """Audio and video files under `directory`, sorted."""
+    found = []
+    for root, _, files in os.walk(directory):
+        found.extend(os.path.join(root, name) for name in files if name.lower().endswith(MEDIA_EXTENSIONS))
+    return sorted(found)
+
+
+def recover(pool, stale_seconds=STALE_SECONDS):
+    """Queues again the running jobs whose worker stopped sending heartbeats, or fails those
+    that used up MAX_ATTEMPTS; returns how many."""
+    with pool.transaction() as conn:
+        return conn.execute(
+            """UPDATE transcription_jobs
+               SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                   error = 'Worker stopped responding'
+               WHERE status = 'running' AND heartbeat < ?""",
+            (MAX_ATTEMPTS, timeutil.now() - stale_seconds)
+        ).rowcount
+
+
+def retry_failed(pool):
+    with pool.transaction() as conn:
+        return conn.execute(
+            "UPDATE transcription_jobs SET status = 'queued', error = NULL WHERE status = 'failed'"
+        ).rowcount
+
+
+def claim(pool):
+    """Marks the oldest queued job as running; returns its id, or None."""
+    now = timeutil.now()
+    with pool.transaction() as conn:
+        row = conn.execute(
+            """UPDATE transcription_jobs
+               SET status = 'running', attempts = attempts + 1, started_on = ?, heartbeat = ?, error = NULL
+               WHERE id = (SELECT id FROM transcription_jobs WHERE status = 'queued' ORDER BY id LIMIT 1)
+               RETURNING id""",
+            (now, now)
+        ).fetchone()
+    return row and row[0]
+
+
+def requeue(pool, job_ids, error):
+    """Queues interrupted jobs again, or fails those that used up MAX_ATTEMPTS."""
+    with pool.transaction() as conn:
+        conn.executemany(
+            """UPDATE transcription_jobs
+               SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, error = ?
+               WHERE id = ? AND status = 'running'""",
+            [(MAX_ATTEMPTS, error, job_id) for job_id in job_ids]
+        )
+
+
+def fail(pool, job_id, error):
+    with pool.transaction() as conn:
+        conn.execute(
+            "UPDATE transcription_jobs SET status = 'failed', error = ?, finished_on = ? WHERE id = ?",
+            (error, timeutil.now(), job_id)
+        )
+
+
+def job_table(pool):
+    """Every job with its progress, newest first."""
+    with pool.reader() as conn:
+        frame = pd.read_sql_query(
+            """SELECT j.id, j.name, j.status, j.model_size || '/' || j.compute_type AS model,
+                      IFNULL(j.detected_language, j.language) AS language,
+                      j.progress, j.duration, COUNT(s.job_id) AS segments, j.attempts, j.error,
+                      j.created_on, j.finished_on
+               FROM transcription_jobs j
+               LEFT JOIN transcription_segments s ON s.job_id = j.id
+               GROUP BY j.id
+               ORDER BY j.id DESC""",
+            conn
+        )
+    done = frame['status'] == 'done'
+    frame['percent'] = (frame['progress'] / frame['duration'] * 100).clip(upper=100).where(~done, 100).round(1)
+    return frame
+
+
+def job_segments(pool, job_id):
+    with pool.reader() as conn:
+        rows = conn.execute(
+            """SELECT start_seconds, end_seconds, text FROM transcription_segments
+               WHERE job_id = ? ORDER BY start_seconds""",
+            (job_id,)
+        ).fetchall()
+    return [{'start': start, 'end': end, 'text': text} for start, end, text in rows]
+
+
+# Worker processes
+
+_registry = None
+
+
+def _init_worker(threads):
+    global _registry
+    _registry = ModelRegistry(threads=threads)
+
+
+def run_job(db_file, job_id):
+    """Transcribes one claimed job in a worker process, resuming after its last committed segment."""
+    pool = open_jobs(db_file)
+    with pool.reader() as conn:
+        path, name, sha256, size, compute_type, language, detected, duration, progress = conn.execute(
+            """SELECT path, name, sha256, model_size, compute_type, language, detected_language, duration, progress
+               FROM transcription_jobs WHERE id = ?""",
+            (job_id,)
+        ).fetchone()
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(HEARTBEAT_SECONDS):
+            with pool.transaction() as conn:
+                conn.execute("UPDATE transcription_jobs SET heartbeat = ? WHERE id = ?", (timeutil.now(), job_id))
+
+    heart = threading.Thread(target=beat, daemon=True)
+    heart.start()
+    cache = transcript_cache.get_cache(db_file)
+    try:
+        cached = cache.get(sha256, size, compute_type, language) if not progress else None
+        if cached is not None:
+            with pool.transaction() as conn:
+                complete_from_cache(conn, job_id, cached)
+            return job_id
+        # ffmpeg reads the spooled file itself; the worker never holds the recording
+        if duration is None:
+            duration = transcribe.probe_duration(path)
+            with pool.transaction() as conn:
+                conn.execute("UPDATE transcription_jobs SET duration = ? WHERE id = ?", (duration, job_id))
+        segments = transcribe.transcribe_stream(
+            path, size, compute_type, language or detected, registry=_registry, start=progress
+        )
+        for segment, detected in segments:
+            with pool.transaction() as conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO transcription_segments (job_id, start_seconds, end_seconds, text)
+                       VALUES (?, ?, ?, ?)""",
+                    (job_id, segment['start'], segment['end'], segment['text'])
+                )
+                conn.execute(
+                    """UPDATE transcription_jobs SET progress = ?, detected_language = ?, heartbeat = ?
+                       WHERE id = ?""",
+                    (segment['end'], detected, timeutil.now(), job_id)
+                )
+        with pool.transaction() as conn:
+            conn.execute(
+                """UPDATE transcription_jobs SET status = 'done', progress = IFNULL(duration, progress), finished_on = ?
+                   WHERE id = ?""",
+                (timeutil.now(), job_id)
+            )
+            detected = conn.execute(
+                "SELECT detected_language FROM transcription_jobs WHERE id = ?", (job_id,)
+            ).fetchone()[0]
+        cache.put(sha256, size, compute_type, language, job_segments(pool, job_id), detected, duration, name)
+    except Exception as e:
+        print(f"Error: transcription job {job_id} failed: {e}")
+        fail(pool, job_id, str(e))
+    finally:
+        stopped.set()
+        heart.join()
+    return job_id
+
+
+class BatchRunner:
+    """Feeds queued jobs to a process pool until the queue is empty, or forever when started in the background."""
+
+    def __init__(self, db_file=JOBS_DB, workers=None):
+        self.db_file = db_file
+        self.pool = open_jobs(db_file)
+        cores = cpu_threads()
+        self.workers = workers or max(1, cores // THREADS_PER_WORKER)
+        self.threads = max(1, cores // self.workers)
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def _executor(self):
+        # Fresh interpreters: forked children would share the parent's SQLite connections
+        return ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker, initargs=(self.threads,)
+        )
+
+    def run(self, until_empty=True, on_finished=None):
+        """Runs jobs on the worker pool; calls on_finished(job_id) as each one ends."""
+        executor = self._executor()
+        running = {}
+        recovered = 0.0
+        try:
+            while not self.stopping.is_set():
+                if time.monotonic() - recovered > STALE_SECONDS:
+                    recover(self.pool)
+                    recovered = time.monotonic()
+                while len(running) < self.workers:
+                    job_id = claim(self.pool)
+                    if job_id is None:
+                        break
+                    running[executor.submit(run_job, self.db_file, job_id)] = job_id
+                if not running:
+                    if until_empty:
+                        return
+                    self.wake.wait(POLL_SECONDS)
+                    self.wake.clear()
+                    continue
+                finished, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+                broken = []
+                for future in finished:
+                    job_id = running.pop(future)
+                    try:
+                        future.result()
+                    except BrokenProcessPool:
+                        broken.append(job_id)
+                        continue
+                    if on_finished is not None:
+                        on_finished(job_id)
+                if broken:
+                    # A worker died (out of memory, killed): the pool is unusable, so
+                    # everything it was running goes back to the queue and a new pool starts
+                    requeue(self.pool, broken + list(running.values()), "Worker process died")
+                    running.clear()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = self._executor()
+        finally:
+            executor.shutdown(wait=not self.stopping.is_set(), cancel_futures=True)
+
+    def start(self):
+        """Runs the queue on a daemon thread until stop(); call wake.set() after queueing jobs."""
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(
+                target=self.run, kwargs={'until_empty': False}, name='transcription-batch', daemon=True
+            )
+            self.thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+
+def write_outputs(pool, job_id, output_dir):
+    """Writes a job's transcript as NAME.txt and its segments as NAME.json under output_dir."""
+    with pool.reader() as conn:
+        name, language = conn.execute(
+            "SELECT name, IFNULL(detected_language, language) FROM transcription_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+    segments = job_segments(pool, job_id)
+    base = os.path.join(output_dir, os.path.splitext(name)[0])
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with open(base + '.txt', 'w', encoding='utf-8') as f:
+        f.write('\n'.join(f"[{transcribe.format_timestamp(s['start'])}] {s['text']}" for s in segments) + '\n')
+    with open(base + '.json', 'w', encoding='utf-8') as f:
+        json.dump({'language': language, 'segments': segments}, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe every recording in a directory.")
+    parser.add_argument('directory', nargs='?')
+    parser.add_argument('--db', default=JOBS_DB, help="job queue database")
+    parser.add_argument('--workers', type=int, help="worker processes; default cores // %d" % THREADS_PER_WORKER)
+    parser.add_argument('--size', default=DEFAULT_SIZE)
+    parser.add_argument('--compute-type', default=DEFAULT_COMPUTE_TYPE, choices=('int8', 'float32'))
+    parser.add_argument('--language', help="skip language detection, e.g. 'en'")
+    parser.add_argument('--output', help="write NAME.txt and NAME.json here as jobs finish")
+    parser.add_argument('--retry-failed', action='store_true', help="queue failed jobs again")
+    parser.add_argument('--status', action='store_true', help="list jobs and exit")
+    args = parser.parse_args()
+
+    runner = BatchRunner(args.db, args.workers)
+    if args.status:
+        with pd.option_context('display.width', 200, 'display.max_rows', None):
+            print(job_table(runner.pool).drop(columns=['created_on', 'finished_on']).to_string(index=False))
+        return
+    if args.retry_failed:
+        print(f"{retry_failed(runner.pool)} failed jobs queued again")
+    if args.directory:
+        queued = 0
+        for path in find_media(args.directory):
+            _, new = enqueue(runner.pool, path, os.path.relpath(path, args.directory),
+                             args.size, args.compute_type, args.language)
+            queued += new
+        print(f"{queued} new jobs queued")
+
+    def finished(job_id):
+        row = job_table(runner.pool).set_index('id').loc[job_id]
+        print(f"{row['status']:>6} {row['name']} ({row['segments']} segments){': ' + row['error'] if pd.notna(row['error']) else ''}")
+        if args.output and row['status'] == 'done':
+            write_outputs(runner.pool, job_id, args.output)
+
+    print(f"Running on {runner.workers} workers x {runner.threads} threads", file=sys.stderr)
+    started = time.perf_counter()
+    try:
+        runner.run(on_finished=finished)
+    except KeyboardInterrupt:
+        print("Interrupted; running jobs resume on the next run", file=sys.stderr)
+        return
+    print(f"Queue empty after {time.perf_counter() - started:.0f} s", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Transcription results cached by recording content.
+
+A result is keyed by the SHA-256 of the uploaded bytes plus the model size,
+compute type and requested language, so the same recording uploaded again
+is answered from SQLite without decoding or inference. Whole results are
+kept: detected language, duration and every segment with its timestamps.
+
+The cache is bounded by the total size of the stored results. When a new
+result takes it over max_bytes, the least recently used results are
+dropped. Transcripts are indexed in an FTS5 trigram table, so search()
+finds any phrase in any cached transcript, down to the segment and time.
+
+Usage: python transcript_cache.py [--db FILE] [--search TEXT] [--stats] [--clear]
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+import timeutil
+from connection import get_pool
+
+CACHE_DB = 'transcriptions.db'
+MAX_BYTES = int(os.environ.get('TRANSCRIPT_CACHE_MB', 512)) * 1024 * 1024
+
+SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS transcript_cache (
+           id INTEGER PRIMARY KEY,
+           sha256 TEXT NOT NULL,
+           model_size TEXT NOT NULL,
+           compute_type TEXT NOT NULL,
+           language TEXT NOT NULL DEFAULT '',
+           name TEXT,
+           detected_language TEXT,
+           duration REAL,
+           segments TEXT NOT NULL,
+           text TEXT NOT NULL,
+           bytes INTEGER NOT NULL,
+           created_on INTEGER NOT NULL,
+           last_used INTEGER NOT NULL,
+           hits INTEGER NOT NULL DEFAULT 0,
+           UNIQUE (sha256, model_size, compute_type, language)
+       )""",
+    "CREATE INDEX IF NOT EXISTS idx_transcript_cache_last_used ON transcript_cache (last_used)",
+    """CREATE VIRTUAL TABLE IF NOT EXISTS transcript_search
+       USING fts5(name, text, content = 'transcript_cache', content_rowid = 'id', tokenize = 'trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS transcript_cache_ai AFTER INSERT ON transcript_cache BEGIN
+           INSERT INTO transcript_search (rowid, name, text) VALUES (new.id, new.name, new.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS transcript_cache_ad AFTER DELETE ON transcript_cache BEGIN
+           INSERT INTO transcript_search (transcript_search, rowid, name, text)
+           VALUES ('delete', old.id, old.name, old.text);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS transcript_cache_au AFTER UPDATE OF name, text ON transcript_cache BEGIN
+           INSERT INTO transcript_search (transcript_search, rowid, name, text)
+           VALUES ('delete', old.id, old.name, old.text);
+           INSERT INTO transcript_search (rowid, name, text) VALUES (new.id, new.name, new.text);
+       END""",
+)
+
+
+def content_sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class TranscriptCache:
+    """Size-bounded LRU store of full transcription results in SQLite."""
+
+    def __init__(self, pool, max_bytes=MAX_BYTES):
+        self.pool = pool
+        self.max_bytes = max_bytes
+        with pool.transaction() as conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+    def get(self, sha256, size, compute_type, language=None):
+        """The cached result {'language', 'duration', 'segments', 'name'}, or None."""
+        with self.pool.transaction() as conn:
+            row = conn.execute(
+                """UPDATE transcript_cache SET last_used = ?, hits = hits + 1
+                   WHERE sha256 = ? AND model_size = ? AND compute_type = ? AND language = ?
+                   RETURNING detected_language, duration, segments, name""",
+                (timeutil.now(), sha256, size, compute_type, language or '')
+            ).fetchone()
+        if row is None:
+            return None
+        detected, duration, segments, name = row
+        return {'language': detected, 'duration': duration, 'segments': json.loads(segments), 'name': name}
+
+    def put(self, sha256, size, compute_type, language, segments, detected_language=None, duration=None, name=None):
+        """Stores a finished result, then drops least recently used results beyond max_bytes."""
+        payload = json.dumps(segments, ensure_ascii=False)
+        text = ' '.join(segment['text'] for segment in segments)
+        now = timeutil.now()
+        with self.pool.transaction() as conn:
+            conn.execute(
+                """INSERT INTO transcript_cache
+                   (sha256, model_size, compute_type, language, name, detected_language, duration,
+                    segments, text, bytes, created_on, last_used)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (sha256, model_size, compute_type, language) DO UPDATE SET
+                       name = excluded.name, detected_language = excluded.detected_language,
+                       duration = excluded.duration, segments = excluded.segments, text = excluded.text,
+                       bytes = excluded.bytes, last_used = excluded.last_used""",
+                (sha256, size, compute_type, language or '', name, detected_language, duration,
+                 payload, text, len(payload.encode()) + len(text.encode()), now, now)
+            )
+            conn.execute(
+                """DELETE FROM transcript_cache WHERE id IN (
+                       SELECT id FROM (
+                           SELECT id, SUM(bytes) OVER (ORDER BY last_used DESC, id DESC) AS kept
+                           FROM transcript_cache
+                       )
+                       WHERE kept > ?
+                   )""",
+                (self.max_bytes,)
+            )
+
+    def search(self, text, limit=50):
+        """Segments of cached transcripts containing `text`, best matching transcripts first."""
+        term = text.strip()
+        if not term:
+            return pd.DataFrame()
+        if len(term) >= 3:
+            match, rank = "transcript_search MATCH ?", "bm25(transcript_search)"
+            param = '"' + term.replace('"', '""') + '"'
+        else:
+            # Trigrams need at least three characters; fall back to a scan
+            match, rank, param = "transcript_search.text LIKE ?", "0", f"%{term}%"
+        query = f"""
+            WITH hits AS (
+                SELECT rowid, {rank} AS rank FROM transcript_search
+                WHERE {match}
+                ORDER BY rank LIMIT ?
+            )
+            SELECT c.name, c.model_size || '/' || c.compute_type AS model, c.detected_language AS language,
+                   segment.value ->> 'start' AS start, segment.value ->> 'end' AS end,
+                   segment.value ->> 'text' AS text, c.sha256
+            FROM hits
+            JOIN transcript_cache c ON c.id = hits.rowid
+            JOIN json_each(c.segments) segment
+            WHERE segment.value ->> 'text' LIKE ?
+            ORDER BY hits.rank, c.id, segment.key
+            LIMIT ?
+        """
+        with self.pool.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(param, limit, f"%{term}%", limit))
+
+    def clear(self):
+        with self.pool.transaction() as conn:
+            return conn.execute("DELETE FROM transcript_cache").rowcount
+
+    def stats(self):
+        with self.pool.reader() as conn:
+            entries, size, hits = conn.execute(
+                "SELECT COUNT(*), IFNULL(SUM(bytes), 0), IFNULL(SUM(hits), 0) FROM transcript_cache"
+            ).fetchone()
+        return {'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes, 'hits': hits}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(db_file=CACHE_DB):
+    """Returns the shared transcript cache for db_file, creating it on first use."""
+    with _caches_lock:
+        cache = _caches.get(db_file)
+        if cache is None or cache.pool._closed:
+            cache = _caches[db_file] = TranscriptCache(get_pool(db_file))
+        return cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the transcription result cache.")
+    parser.add_argument('--db', default=CACHE_DB)
+    parser.add_argument('--search', help="find segments containing this text")
+    parser.add_argument('--stats', action='store_true')
+    parser.add_argument('--clear', action='store_true', help="drop every cached result")
+    args = parser.parse_args()
+
+    cache = get_cache(args.db)
+    if args.clear:
+        print(f"{cache.clear()} cached results dropped")
+    if args.search:
+        with pd.option_context('display.width', 200, 'display.max_colwidth', 100):
+            print(cache.search(args.search).drop(columns='sha256').to_string(index=False))
+    if args.stats or not (args.search or args.clear):
+        print(cache.stats())
+
+
+if __name__ == '__main__':
+    main()